@@ -1,39 +1,79 @@
-from src.services import OUTPUT_DIRECTORY, construct_log_message
+from src.services import OUTPUT_DIRECTORY
 from src.services.analytics import AlmaAnalytics, PrimoAnalytics
+from src.services.concurrency import fetch_concurrently
+from src.services.logs import configure_logging, get_logger
 
-from os import makedirs
-from os.path import abspath, join, basename
+from os import makedirs, remove, replace
+from os.path import abspath, exists, join, basename
+from time import monotonic
 
 # name of the current script, for use in logging
 SCRIPT_NAME = basename(__file__)
+logger = get_logger(SCRIPT_NAME)
+
+# how many reports in a dictionary are run (and polled) at the same time
+DEFAULT_MAX_CONCURRENT_REPORTS = 4
 
 
 def log_report_complete(output_dir):
-    message = construct_log_message(SCRIPT_NAME, "Reports created and available at '" + output_dir + "'.")
-    linebreak = "-"*len(message)
-    print("\n\n{0}\n\n{1}\n\n{0}\n\n".format(linebreak, message))
+    logger.info("Reports created and available at '{}'.", output_dir, output_dir=output_dir)
+
+
+def log_report_summary(summary):
+    lines = ["{:<20} {:>10} {:>10}  {}".format("report", "seconds", "rows", "status")]
+    for report in summary:
+        lines.append("{:<20} {:>10.1f} {:>10}  {}".format(report, *summary[report]))
+    fields = {report: dict(zip(("seconds", "rows", "status"), summary[report])) for report in summary}
+    logger.info("summary of reports run:\n{}", "\n".join(lines), summary=fields)
+
+
+def run_report(service, input_path, output_report_path):
+    """stream a single report into a '.part' file, moving it into place once the report completes. -> row count"""
+    partial_output_path = output_report_path + ".part"
+    try:
+        row_count = service.write_report_to_tsv(input_path, partial_output_path)
+    except Exception:
+        if exists(partial_output_path):
+            remove(partial_output_path)
+        raise
+    replace(partial_output_path, output_report_path)
+    return row_count
 
 
-def run_reports_from_dictionary(service, reports_dict, project_id="jwasys/bu-lib-stats", output_dir=OUTPUT_DIRECTORY, upload_upon_completion=False):
+def run_reports_from_dictionary(service, reports_dict, project_id="jwasys/bu-lib-stats", output_dir=OUTPUT_DIRECTORY,
+                                upload_upon_completion=False, max_concurrent_reports=DEFAULT_MAX_CONCURRENT_REPORTS):
     try:
         makedirs(output_dir)
     except FileExistsError:
         pass  # directory already existed
 
-    for report in reports_dict:
+    # run the reports side by side (each spends most of its time waiting between polls), writing each as it finishes
+    started_at = {}
+
+    def run_report_by_name(report):
         input_path = reports_dict[report]["path"]
         output_filename = reports_dict[report]["output"]
-        print(construct_log_message(SCRIPT_NAME, "running report for output: '" + output_filename + "'"))
+        logger.info("running report for output: '{}'", output_filename, report=report)
+        started_at[report] = monotonic()
+
+        output_report_path = abspath(join(output_dir, output_filename))
+        row_count = run_report(service, input_path, output_report_path)
+        if upload_upon_completion:
+            service.upload_to_dw(output_report_path, project_id)
+        return row_count
 
-        try:
-            report_response_data = service.prepare_df_from_report_path(input_path)
-            output_report_path = abspath(join(output_dir, output_filename))
-            report_response_data.to_csv(output_report_path, sep='\t')
+    summary = {}
+    for report, row_count in fetch_concurrently(run_report_by_name, reports_dict, max_concurrent_reports, None):
+        duration = monotonic() - started_at.get(report, monotonic())
+        if isinstance(row_count, Exception):
+            input_path = reports_dict[report]["path"]
+            logger.warning("Error running report : '{}'\n-> {}\n", input_path, row_count, report=report)
+            summary[report] = (duration, "-", "failed")
+        else:
+            summary[report] = (duration, row_count, "written to '" + reports_dict[report]["output"] + "'")
 
-            if upload_upon_completion:
-                service.upload_to_dw(output_report_path, project_id)
-        except ValueError as error:
-            print(construct_log_message(SCRIPT_NAME, "Error running report : '" + input_path + "'\n-> {}\n".format(error), level="WARN"))
+    log_report_summary(summary)
+    return summary
 
 
 def run_weekly_circulation_statistics():
@@ -87,5 +127,8 @@ def run_monthly_primo_api_tests():
 
 
 if __name__ == "__main__":
+    # reports log from several threads at once: write from the background, and (via SERVICES_LOG_SAMPLE_RATES) only
+    #   a sample of the per-request lines
+    configure_logging(buffered=True)
     run_weekly_circulation_statistics()
     run_monthly_primo_api_tests()
@@ -0,0 +1,71 @@
+"""
+## how long each part of the services package takes to import (measured with `python -X importtime` in a fresh
+##   interpreter), and whether importing it drags in a heavy dependency it should only load on first use
+## run from the project root: `python -m src.benchmarks.import_time [--check]`
+##   (with `--check`, exits with an error if any module imports a dependency it's meant to defer - e.g. on the cron host)
+"""
+
+from src.services import construct_log_message
+
+from os import environ, pathsep
+from os.path import abspath, basename, dirname, join
+from pkgutil import iter_modules
+from subprocess import run
+from sys import argv, executable, exit
+
+SCRIPT_NAME = basename(__file__)
+
+PROJECT_DIRECTORY = abspath(join(dirname(__file__), "../.."))
+RUNS = 5
+
+# heavy dependencies, and the modules that mustn't import them until they're actually used: every module of the
+#   services package, imported under the `src.services` root the scripts and tests use (the async services leave their
+#   coroutine classes to `async_*` modules, which are the only ones allowed to import asyncio up front)
+HEAVY_MODULES = ("pandas", "lxml.etree", "asyncio")
+ASYNC_MODULE_PREFIX = "async_"
+DEFERRED_IMPORTS = {"src.services": HEAVY_MODULES}
+DEFERRED_IMPORTS.update(
+    ("src.services." + name, tuple(module for module in HEAVY_MODULES if module != "asyncio")
+     if name.startswith(ASYNC_MODULE_PREFIX) else HEAVY_MODULES)
+    for _, name, _ in sorted(iter_modules([join(PROJECT_DIRECTORY, "src", "services")]))
+)
+
+
+def measure_import(module):
+    """import `module` in a fresh interpreter -> (cumulative import time in ms, heavy modules that got imported)"""
+    code = "import sys, {0}; print(','.join(name for name in {1!r} if name in sys.modules))".format(module,
+                                                                                                   HEAVY_MODULES)
+    environment = dict(environ, PYTHONPATH=pathsep.join([join(PROJECT_DIRECTORY, "src"), PROJECT_DIRECTORY]))
+    result = run([executable, "-X", "importtime", "-c", code], capture_output=True, text=True, cwd=PROJECT_DIRECTORY,
+                 env=environment, check=True)
+
+    cumulative_microseconds = 0
+    for line in result.stderr.splitlines():
+        # 'import time: self [us] | cumulative | imported package'
+        if line.startswith("import time:") and line.rsplit("|", 1)[-1].strip() == module:
+            cumulative_microseconds = int(line.split("|")[1])
+    heavy_imports = [name for name in result.stdout.strip().split(",") if name]
+    return cumulative_microseconds / 1000, heavy_imports
+
+
+def run_benchmark(check=False):
+    print(construct_log_message(SCRIPT_NAME, "import times (best of {} fresh interpreters)".format(RUNS)))
+    print("{:<36} {:>10}  {}".format("module", "ms", "heavy dependencies imported"))
+    violations = []
+    for module, deferred in DEFERRED_IMPORTS.items():
+        best, heavy_imports = None, []
+        for _ in range(RUNS):
+            milliseconds, heavy_imports = measure_import(module)
+            best = milliseconds if best is None else min(best, milliseconds)
+        print("{:<36} {:>10.1f}  {}".format(module, best, ", ".join(heavy_imports) or "-"))
+        violations.extend((module, name) for name in heavy_imports if name in deferred)
+
+    for module, name in violations:
+        print(construct_log_message(SCRIPT_NAME, "importing '{}' imports '{}', which it should defer until it's "
+                                                 "used".format(module, name), level="WARN"))
+    if check and violations:
+        exit(1)
+
+
+if __name__ == "__main__":
+    run_benchmark(check="--check" in argv[1:])
@@ -0,0 +1,74 @@
+"""
+## throughput of reading and writing the same records as binary (ISO 2709) marc and as MARCXML
+## run from the project root: `python -m src.benchmarks.marc_codecs [record count]`
+"""
+
+from src.services import construct_log_message
+from src.services.record_utils import MarcRecord, ControlField, DataField, MarcCollectionWriter, \
+    iter_iso2709_records, iter_marcxml_records, write_iso2709_records
+
+from os.path import basename, getsize, join
+from sys import argv
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+SCRIPT_NAME = basename(__file__)
+
+DEFAULT_RECORD_COUNT = 20000
+
+
+def make_sample_records(count):
+    """records shaped roughly like our catalog's: a handful of control fields and a dozen or so data fields"""
+    for number in range(count):
+        yield MarcRecord('00000nam a2200000 i 4500', [
+            ControlField('001', '99{:010d}3651'.format(number)),
+            ControlField('005', '20190901120000.0'),
+            ControlField('008', '190901s2019    mau           000 0 eng d'),
+            DataField('020', ' ', ' ', [('a', '978{:010d}'.format(number))]),
+            DataField('035', ' ', ' ', [('a', '(OCoLC){}'.format(number * 7))]),
+            DataField('100', '1', ' ', [('a', 'Author, Sample {}'.format(number)), ('e', 'author.')]),
+            DataField('245', '1', '0', [('a', 'A sample title about récords :'), ('b', 'number {} /'.format(number)),
+                                        ('c', 'Sample Author.')]),
+            DataField('264', ' ', '1', [('a', 'Boston :'), ('b', 'Boston University,'), ('c', '2019.')]),
+            DataField('300', ' ', ' ', [('a', '1 online resource (xii, 345 pages) :'), ('b', 'illustrations')]),
+            DataField('500', ' ', ' ', [('a', 'A general note that runs on for a while, as notes tend to. ' * 3)]),
+            DataField('650', ' ', '0', [('a', 'Libraries'), ('x', 'Automation.')]),
+            DataField('650', ' ', '0', [('a', 'Cataloging'), ('x', 'Data processing.')]),
+            DataField('700', '1', ' ', [('a', 'Editor, Sample.'), ('e', 'editor.')]),
+            DataField('856', '4', '0', [('u', 'http://hdl.handle.net/2144/{}'.format(number))]),
+        ])
+
+
+def time_it(label, function, record_count):
+    started_at = perf_counter()
+    function()
+    seconds = perf_counter() - started_at
+    print("{:<28} {:>8.2f}s {:>12,.0f} records/s".format(label, seconds, record_count / seconds))
+
+
+def run_benchmark(record_count=DEFAULT_RECORD_COUNT):
+    print(construct_log_message(SCRIPT_NAME, "reading and writing {:,} records in each format".format(record_count)))
+    records = list(make_sample_records(record_count))
+    with TemporaryDirectory() as directory:
+        mrc_path = join(directory, "sample.mrc")
+        xml_path = join(directory, "sample.xml")
+
+        def write_marcxml():
+            with MarcCollectionWriter(xml_path) as writer:
+                for record in records:
+                    writer.write(record)
+
+        time_it("write ISO 2709", lambda: write_iso2709_records(records, mrc_path), record_count)
+        time_it("write MARCXML", write_marcxml, record_count)
+        time_it("read ISO 2709 (model)", lambda: sum(1 for _ in iter_iso2709_records(mrc_path, as_model=True)),
+                record_count)
+        time_it("read MARCXML (model)", lambda: sum(1 for _ in iter_marcxml_records(xml_path, as_model=True)),
+                record_count)
+        time_it("read ISO 2709 (elements)", lambda: sum(1 for _ in iter_iso2709_records(mrc_path)), record_count)
+        time_it("read MARCXML (elements)", lambda: sum(1 for _ in iter_marcxml_records(xml_path)), record_count)
+        print("{:<28} {:>9,} bytes\n{:<28} {:>9,} bytes".format("ISO 2709 file size", getsize(mrc_path),
+                                                            "MARCXML file size", getsize(xml_path)))
+
+
+if __name__ == "__main__":
+    run_benchmark(int(argv[1]) if len(argv) > 1 else DEFAULT_RECORD_COUNT)
@@ -0,0 +1,75 @@
+"""
+## throughput of `transform_marcxml_file_in_parallel` (sorting every record's fields) against the single-process
+##   `transform_marcxml_file`, for a growing number of worker processes
+## also times the work left in the main process, which caps how far the pipeline can scale: slicing the records out of
+##   the file (`iter_marcxml_chunks`) against parsing and re-serializing each one there, as the pipeline used to
+## run from the project root: `python -m src.benchmarks.pipeline [MARCXML file] [record count]`
+##   (without a file, a sample collection of records with shuffled fields is generated)
+"""
+
+from src.services import construct_log_message
+from src.services.pipeline import DEFAULT_CHUNK_SIZE, iter_marcxml_chunks, iter_serialized_chunks, \
+    transform_marcxml_file_in_parallel
+from src.services.record_utils import iter_marcxml_records, sort_marc_tags, transform_marcxml_file
+from src.benchmarks.sort_marc_tags import write_shuffled_sample
+
+from multiprocessing import cpu_count
+from os.path import basename, join
+from sys import argv
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+SCRIPT_NAME = basename(__file__)
+
+DEFAULT_RECORD_COUNT = 20000
+ROUNDS = 3
+
+
+def best_time(function):
+    """-> (the fastest of `ROUNDS` runs in seconds, what the last run returned)"""
+    best, result = None, None
+    for _ in range(ROUNDS):
+        started_at = perf_counter()
+        result = function()
+        seconds = perf_counter() - started_at
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def count_serialized_records(chunks):
+    return sum(len(chunk) for chunk in chunks)
+
+
+def run_benchmark(path=None, record_count=DEFAULT_RECORD_COUNT):
+    with TemporaryDirectory() as directory:
+        if path is None:
+            path = join(directory, "shuffled.xml")
+            write_shuffled_sample(path, record_count)
+        target = join(directory, "sorted.xml")
+
+        print(construct_log_message(SCRIPT_NAME, "transforming '{}' (best of {} rounds, {} cores)".format(
+            basename(path), ROUNDS, cpu_count())))
+        print("{:<34} {:>8} {:>14}".format("", "seconds", "records/s"))
+
+        def report(label, seconds, count):
+            print("{:<34} {:>8.3f} {:>14,.0f}".format(label, seconds, count / seconds))
+
+        # the main process's share of the work
+        seconds, count = best_time(lambda: count_serialized_records(
+            iter_serialized_chunks(iter_marcxml_records(path), DEFAULT_CHUNK_SIZE)))
+        report("main: parse + serialize (before)", seconds, count)
+        seconds, _ = best_time(lambda: sum(1 for _ in iter_marcxml_chunks(path, DEFAULT_CHUNK_SIZE)))
+        report("main: slice records (now)", seconds, count)
+
+        sequential, count = best_time(lambda: transform_marcxml_file(path, target, sort_marc_tags))
+        report("transform_marcxml_file", sequential, count)
+        processes = 1
+        while processes <= max(cpu_count(), 2):
+            seconds, _ = best_time(lambda: transform_marcxml_file_in_parallel(path, target, [sort_marc_tags],
+                                                                              processes))
+            report("in parallel, {} process{}".format(processes, "" if processes == 1 else "es"), seconds, count)
+            processes *= 2
+
+
+if __name__ == "__main__":
+    run_benchmark(argv[1] if len(argv) > 1 else None, int(argv[2]) if len(argv) > 2 else DEFAULT_RECORD_COUNT)
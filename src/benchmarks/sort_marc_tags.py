@@ -0,0 +1,90 @@
+"""
+## compares the in-place `sort_marc_tags` with the version it replaced (which rebuilt every record from scratch)
+## run from the project root: `python -m src.benchmarks.sort_marc_tags [MARCXML file] [record count]`
+##   (without a file, a sample collection of records with shuffled fields is generated)
+"""
+
+from src.services import construct_log_message
+from src.services.record_utils import MarcCollectionWriter, iter_marcxml_records, sort_marc_tags
+from src.benchmarks.marc_codecs import make_sample_records
+
+from lxml import etree
+from os.path import basename, join
+from random import Random
+from sys import argv
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+SCRIPT_NAME = basename(__file__)
+
+DEFAULT_RECORD_COUNT = 20000
+ROUNDS = 3
+
+
+def previous_sort_marc_tags(record):
+    """`sort_marc_tags` as it was: sorts (tag, element) pairs gathered from every attribute of every child, then moves
+    the children into a brand-new (un-namespaced, attribute-less) record"""
+    data = []
+    for elem in record.getchildren():
+        if 'leader' in elem.tag:
+            data.append(('000', elem))
+        else:
+            attrib = elem.attrib
+            for k, v in attrib.items():
+                if k == 'tag':
+                    data.append((v, elem))
+    data = sorted(data, key=lambda x: x[0])
+    new_rec = etree.Element('record')
+    for i in data:
+        new_rec.append(i[1])
+    return new_rec
+
+
+def write_shuffled_sample(path, record_count):
+    shuffle = Random(2019).shuffle
+    with MarcCollectionWriter(path) as writer:
+        for record in make_sample_records(record_count):
+            shuffle(record.fields)
+            writer.write(record)
+
+
+def load_records(path, record_count):
+    """the records' MARCXML, so each round can parse fresh copies (both versions change the records they're given)"""
+    records = []
+    for record in iter_marcxml_records(path):
+        records.append(etree.tostring(record))
+        if len(records) == record_count:
+            break
+    return records
+
+
+def time_sort(sort, serialized_records):
+    best = None
+    for _ in range(ROUNDS):
+        records = [etree.fromstring(record) for record in serialized_records]
+        started_at = perf_counter()
+        for record in records:
+            sort(record)
+        seconds = perf_counter() - started_at
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def run_benchmark(path=None, record_count=DEFAULT_RECORD_COUNT):
+    with TemporaryDirectory() as directory:
+        if path is None:
+            path = join(directory, "shuffled.xml")
+            write_shuffled_sample(path, record_count)
+        serialized_records = load_records(path, record_count)
+
+    print(construct_log_message(SCRIPT_NAME, "sorting {:,} records (best of {} rounds)".format(len(serialized_records),
+                                                                                              ROUNDS)))
+    previous = time_sort(previous_sort_marc_tags, serialized_records)
+    current = time_sort(sort_marc_tags, serialized_records)
+    for label, seconds in (("previous sort_marc_tags", previous), ("in-place sort_marc_tags", current)):
+        print("{:<26} {:>8.3f}s {:>12,.0f} records/s".format(label, seconds, len(serialized_records) / seconds))
+    print("{:<26} {:>8.2f}x".format("speedup", previous / current))
+
+
+if __name__ == "__main__":
+    run_benchmark(argv[1] if len(argv) > 1 else None, int(argv[2]) if len(argv) > 2 else DEFAULT_RECORD_COUNT)
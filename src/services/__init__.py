@@ -1,7 +1,6 @@
 from os.path import join, abspath, dirname
-from time import strftime
-from urllib.error import HTTPError
-from urllib.request import Request, urlopen
+from re import sub as replace_pattern
+from time import strftime, sleep
 
 try:
     from src.services.secrets import API_KEYS
@@ -13,9 +12,27 @@ OUTPUT_DIRECTORY = abspath(join(dirname(__file__), "../../output"))
 
 # helpful reused variables
 HTTP_TOO_MANY_REQUESTS = 429
+HTTP_NOT_MODIFIED = 304
 HTTP_BAD_REQUEST = 400
 
 
+class ServiceRequestError(Exception):
+    """a request that the server refused or failed (a 4xx/5xx response, or still 'Too Many Requests' after retrying)"""
+
+    def __init__(self, method, url, status, reason, body=""):
+        self.method = method
+        self.url = redact_url(url)
+        self.status = status
+        self.reason = reason
+        self.body = body  # whatever the server said about it (Alma explains errors in the body)
+        super(ServiceRequestError, self).__init__("'{} {}' response to {} '{}'".format(status, reason, method, self.url))
+
+
+def redact_url(url):
+    """the url without its apikey, safe for logs and error messages"""
+    return replace_pattern(r"(?<=[?&])apikey=[^&]*(&|$)", "", url).rstrip("?&")
+
+
 def construct_log_message(module, message, level="INFO"):
     """prepare a formatted log message with timestamp, originating method, and log level"""
     message = "{timestamp} | {module_name} [{level}] | {message}".format(
@@ -34,22 +51,42 @@ def construct_log_message(module, message, level="INFO"):
 
 class Service:
 
-    def __init__(self, use_production=False, logging=True):
+    def __init__(self, use_production=False, logging=True, transport=None, rate_limiter=None, retry_policy=None,
+                 cache=None):
         self.env = "production" if use_production else "sandbox"
         self.log = logging
         self.api_key = get_api_key("alma", "bibs", self.env, notify_empty=logging)
         self.base_url = "https://www.google.com/"
 
+        # imported here rather than at the top, so that `import services` stays cheap for scripts that only log
+        from .logs import get_logger
+        from .rate_limit import RetryPolicy
+        from .transport import get_default_transport
+        self.logger = get_logger(self.__class__.__name__)
+        self.transport = transport if transport else get_default_transport()  # shared keep-alive connection pools
+        self.rate_limiter = rate_limiter  # when not given, the limiter shared by everything using `self.api_key`
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy()
+        self.cache = cache  # an optional `ResponseCache` (see services/cache.py)
+
     def log_message(self, message, level="INFO"):
         if self.log:
-            message_prefix = self.__class__.__name__
-            print(construct_log_message(message_prefix, message, level=level))
+            self.logger.log(level, message)
+
+    def log_request(self, sample, message, *args, **fields):
+        """per-request INFO lines: only formatted if they'll be written, and sampled (1 in N) if logging says so"""
+        if self.log:
+            self.logger.log("INFO", message, *args, sample=sample, **fields)
 
     def log_warning(self, message):
         self.log_message(message, level="WARN")
 
-    def make_request(self, apiPath="", queryParams=None, method='GET', requestBody=None, headers=None):
+    def get_rate_limiter(self):
+        if self.rate_limiter:
+            return self.rate_limiter
+        from .rate_limit import get_rate_limiter
+        return get_rate_limiter(self.api_key)
 
+    def build_url(self, apiPath="", queryParams=None):
         # build URL we'll be requesting to (note: we expect the apiPath to start with '/')
         url = '{base_url}{api_path}?apikey={api_key}'.format(
             base_url=self.base_url, api_path=apiPath, api_key=self.api_key
@@ -57,32 +94,89 @@ class Service:
         if queryParams:
             for key, value in queryParams.items():
                 url += '&{}={}'.format(key, value)
+        return url
 
-        # build request
-        data = requestBody if requestBody else {}
-        headers = headers if headers else {}
-        request = Request(url, data=data, headers=headers)
-        request.get_method = lambda: method
-
-        # send and store request
-        url_no_args = request.full_url.split("?")[0] or request.full_url
-        self.log_message("making a '{}' request to '{}'.".format(method, url_no_args))
-        try:
-            response = urlopen(request)
-            response_body = response.read().decode(response.headers.get_content_charset())
-
-            if response.status == HTTP_TOO_MANY_REQUESTS:
-                self.log_warning("WARNING! Received a 'Too Many Requests' response from alma! Please WAIT before retrying")
-                exit(1)
-            elif response.status == HTTP_BAD_REQUEST:
-                self.log_warning("WARNING! Bad Request")
-                self.log_message(request)
-            else:
-                self.log_message("-> response code: " + str(response.status))
-
-            return response_body
-        except HTTPError as httpError:
-            self.log_warning("ERROR received making request: '" + request.full_url + "'!\n" + httpError.msg)
+    def make_request(self, apiPath="", queryParams=None, method='GET', requestBody=None, headers=None):
+        url = self.build_url(apiPath, queryParams)
+        cached, cached_body, headers = self.check_cache(method, url, headers)
+        if cached_body is not None:
+            return cached_body
+
+        # send the request over a pooled (keep-alive) connection, waiting on the rate limiter and retrying when throttled
+        path = url.split("?")[0]
+        self.log_request("request", "making a '{}' request to '{}'.", method, path, method=method, url=path)
+        rate_limiter = self.get_rate_limiter()
+        attempt = 0
+        while True:
+            rate_limiter.acquire()
+            response = self.transport.request(method, url, body=requestBody if requestBody else None, headers=headers)
+            delay = self.get_retry_delay(method, response, attempt, rate_limiter)
+            if delay is None:
+                break
+            attempt += 1
+            sleep(delay)
+
+        return self.handle_response(method, url, response, cached, attempt)
+
+    def check_cache(self, method, url, headers):
+        """answer from the cache when we can, otherwise ask the server whether our cached copy is still current
+        returns the cached entry (if any), its body (if it can be used as-is) and the headers to send"""
+        if self.cache is None or not self.cache.is_cacheable(method, url):
+            return None, None, headers
+
+        cached = self.cache.get(method, url)
+        if cached and cached.is_fresh:
+            self.cache.record_hit()
+            path = url.split("?")[0]
+            self.log_request("request", "using cached response for '{}'.", path, method=method, url=path, cached=True)
+            return cached, cached.body.decode("utf-8"), headers
+        if cached and cached.etag:
+            headers = dict(headers) if headers else {}
+            headers["If-None-Match"] = cached.etag
+        return cached, None, headers
+
+    def get_retry_delay(self, method, response, attempt, rate_limiter):
+        """how long to wait before retrying a (throttled or failed) response, or `None` if it shouldn't be retried"""
+        rate_limiter.update_from_headers(response.headers)
+        if not self.retry_policy.should_retry(response.status, attempt, method):
+            return None
+
+        delay = self.retry_policy.get_delay(attempt, response.headers.get("Retry-After"))
+        if response.status == HTTP_TOO_MANY_REQUESTS:
+            rate_limiter.record_throttled(delay)
+        rate_limiter.record_retry()
+        self.log_warning("received a '{}' response; retrying in {:.1f} seconds (attempt {} of {})".format(
+            response.status, delay, attempt + 1, self.retry_policy.max_retries
+        ))
+        return delay
+
+    def handle_response(self, method, url, response, cached, attempt):
+        """log the outcome of a request, keep the cache up to date, and return the response body
+        raises a `ServiceRequestError` for an error response (including 'Too Many Requests' once retries run out)"""
+        rate_limiter = self.get_rate_limiter()
+        if response.status == HTTP_TOO_MANY_REQUESTS:
+            self.log_warning("WARNING! Still receiving 'Too Many Requests' responses from alma after {} retries!".format(attempt))
+            raise ServiceRequestError(method, url, response.status, response.reason, response.text())
+        elif response.status >= HTTP_BAD_REQUEST:
+            self.log_warning("ERROR received making request: '" + redact_url(url) + "'!\n" + response.reason)
+            raise ServiceRequestError(method, url, response.status, response.reason, response.text())
+        elif response.status == HTTP_NOT_MODIFIED and cached:
+            rate_limiter.record_success()
+            self.log_request("response", "-> response code: 304 (cached response is still current)", status=304)
+            self.cache.refresh(method, url)
+            self.cache.record_hit(revalidated=True)
+            return cached.body.decode("utf-8")
+        else:
+            rate_limiter.record_success()
+            self.log_request("response", "-> response code: {}", response.status, status=response.status)
+
+        response_body = response.text()
+        if self.cache is not None and self.cache.is_cacheable(method, url):
+            self.cache.record_miss()
+            self.cache.put(method, url, response_body.encode("utf-8"), response.headers.get("ETag"))
+        elif self.cache is not None and method.upper() != 'GET':
+            self.cache.invalidate(url)
+        return response_body
 
 
 def get_api_key(platform="alma", api="bibs", env="sandbox", notify_empty=True):
@@ -90,5 +184,6 @@ def get_api_key(platform="alma", api="bibs", env="sandbox", notify_empty=True):
         return API_KEYS[platform][api][env]
     except NameError:
         if notify_empty:
-            print(construct_log_message("services/__init__.py", "unable to acquire API", "WARN"))
+            from .logs import get_logger
+            get_logger("services/__init__.py").warning("unable to acquire API")
         return ""
@@ -4,13 +4,18 @@
 ## EDITED: aidans (atla5) 2019-01
 """
 # import datadotworld as dw
+from collections import namedtuple
+from csv import writer as csv_writer
+from io import BytesIO
 from os.path import join
-from pandas import DataFrame
 from time import sleep
 from urllib.parse import quote_plus
 from xml.etree import ElementTree as ET
 
-from src.services import Service, CONTENT_TYPE_XML, OUTPUT_DIRECTORY, get_api_key
+from . import Service, CONTENT_TYPE_XML, OUTPUT_DIRECTORY, get_api_key
+from .lazy import lazy_import
+
+pandas = lazy_import("pandas")  # only imported once a DataFrame is actually built
 
 # assorted magical
 DEFAULT_LIMIT = 1000
@@ -21,76 +26,277 @@ SAMPLE_DW_UPLOAD_PROJECT = "jwasys/bu-lib-stats"
 SAMPLE_REPORT_PATH_IN = "/shared/Boston%20University/Reports/jwa/NumberOfLoansPast7days"
 SAMPLE_REPORT_PATH_OUT = join(OUTPUT_DIRECTORY, "circ_stats.tsv")
 
+# namespaces used within a report's 'ResultXml'
+ROWSET_NAMESPACE = "urn:schemas-microsoft-com:xml-analysis:rowset"
+XSD_NAMESPACE = "http://www.w3.org/2001/XMLSchema"
+SAW_SQL_NAMESPACE = "urn:saw-sql"
+REPORT_NAMESPACES = {"rowset": ROWSET_NAMESPACE, "xsd": XSD_NAMESPACE}
+
+# how the 'saw-sql:type' of a column maps onto the dtype it's given in a DataFrame
+INTEGER_SQL_TYPES = ("integer", "int", "smallint", "bigint", "tinyint")
+FLOAT_SQL_TYPES = ("double", "float", "real", "numeric", "decimal")
+DATE_SQL_TYPES = ("date", "timestamp", "datetime", "time")
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5  # string columns with fewer distinct values than this (relative to rows) are categorical
+
+# a column as described by the report's schema (`name` is the tag used in each row, e.g. 'Column3')
+ReportColumn = namedtuple("ReportColumn", ["name", "heading", "sql_type"])
+
 
 def is_report_finished(report):
     return report.find('*/IsFinished').text != 'false'
 
 
+def get_resumption_token(report):
+    token = report.find('*/ResumptionToken')
+    return token.text if token is not None else None
+
+
+def clean_column_heading(heading):
+    return heading.replace(' REPORT_SUM(', '').replace(' Name)', '')
+
+
+def parse_report_columns(report):
+    """the columns described in the schema of a report page (only the first page of a report carries the schema)"""
+    rowset = report.find('*/ResultXml/rowset:rowset', REPORT_NAMESPACES)
+    if rowset is None:
+        return []
+    elements = rowset.findall('xsd:schema/xsd:complexType/xsd:sequence/xsd:element', REPORT_NAMESPACES)
+    return [
+        ReportColumn(
+            el.attrib['name'],
+            clean_column_heading(el.attrib.get('{%s}columnHeading' % SAW_SQL_NAMESPACE, el.attrib['name'])),
+            el.attrib.get('{%s}type' % SAW_SQL_NAMESPACE)
+        ) for el in elements
+    ]
+
+
+def get_column_name(column_tag):
+    """'{urn:schemas-microsoft-com:xml-analysis:rowset}Column3' -> 'Column3'"""
+    return column_tag[len(ROWSET_NAMESPACE) + 2:]
+
+
+def convert_report_column(values, sql_type):
+    """turn a column's raw text values into a Series typed according to the column's 'saw-sql:type'"""
+    sql_type = (sql_type or "").lower()
+    if sql_type in INTEGER_SQL_TYPES:
+        return pandas.to_numeric(pandas.Series(values, dtype=object), errors='coerce').astype("Int64")
+    if sql_type in FLOAT_SQL_TYPES:
+        return pandas.to_numeric(pandas.Series(values, dtype=object), errors='coerce')
+    if sql_type in DATE_SQL_TYPES:
+        return pandas.to_datetime(pandas.Series(values, dtype=object), errors='coerce')
+
+    column = pandas.Series(values, dtype=object)
+    if values and len(set(values)) <= len(values) * CATEGORICAL_MAX_UNIQUE_RATIO:
+        return column.astype("category")
+    return column
+
+
+class ReportFrameBuilder:
+    """ReportFrameBuilder collects the rows of a report column-by-column and builds a typed DataFrame from them once"""
+
+    def __init__(self, columns=None):
+        self.columns = []
+        self.values = []
+        self.row_count = 0
+        self._positions = {}
+        if columns:
+            self.set_columns(columns)
+
+    def set_columns(self, columns):
+        self.columns = list(columns)
+        self.values = [[] for _ in self.columns]
+        self._positions = {column.name: position for position, column in enumerate(self.columns)}
+
+    def reset(self):
+        """forget every row (and the columns) collected so far, e.g. when a report is re-requested from the start"""
+        self.set_columns([])
+        self.row_count = 0
+
+    def add_row(self, row):
+        """add a single 'Row' element (cells the report left empty become `None`)"""
+        filled = set()
+        for col in row:
+            position = self._positions[get_column_name(col.tag)]
+            self.values[position].append(col.text)
+            filled.add(position)
+        if len(filled) < len(self.columns):
+            for position, column_values in enumerate(self.values):
+                if position not in filled:
+                    column_values.append(None)
+        self.row_count += 1
+
+    def add_report(self, report):
+        """add every row of a (parsed) report page, taking the columns from its schema if they aren't known yet"""
+        if not self.columns:
+            self.set_columns(parse_report_columns(report))
+        for row in report.iterfind('*/ResultXml/rowset:rowset/rowset:Row', REPORT_NAMESPACES):
+            self.add_row(row)
+
+    def add_report_xml(self, source):
+        """add a raw report page (a filename or file object) with `iterparse`, discarding each row once it's read
+        returns the page's root element without its rows (enough for `is_report_finished`, `get_resumption_token`)"""
+        schema_tag = '{%s}element' % XSD_NAMESPACE
+        row_tag = '{%s}Row' % ROWSET_NAMESPACE
+        columns = []
+        root = rowset = None
+        for event, element in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                if element.tag == '{%s}rowset' % ROWSET_NAMESPACE:
+                    rowset = element
+                continue
+            if element.tag == row_tag:
+                if not self.columns:
+                    self.set_columns(columns)
+                self.add_row(element)
+                rowset.remove(element)
+            elif element.tag == schema_tag and not self.columns:
+                columns.append(ReportColumn(
+                    element.attrib['name'],
+                    clean_column_heading(element.attrib.get('{%s}columnHeading' % SAW_SQL_NAMESPACE, element.attrib['name'])),
+                    element.attrib.get('{%s}type' % SAW_SQL_NAMESPACE)
+                ))
+        if not self.columns and columns:
+            self.set_columns(columns)
+        return root
+
+    def to_data_frame(self):
+        data_frame = pandas.DataFrame({
+            position: convert_report_column(column_values, column.sql_type)
+            for position, (column, column_values) in enumerate(zip(self.columns, self.values))
+        })
+        data_frame.columns = [column.heading for column in self.columns]  # headings aren't necessarily unique
+        return data_frame
+
+
+def parse_report(response, builder=None):
+    """parse a report page; given a `ReportFrameBuilder`, its rows are streamed straight into the builder as the page is
+    parsed (see `ReportFrameBuilder.add_report_xml`) rather than kept in the tree returned"""
+    if builder is None:
+        return ET.fromstring(response)
+    return builder.add_report_xml(BytesIO(response.encode('utf-8')))
+
+
+def parse_report_rows(report, columns):
+    """yield a tuple of values for each row of a report page, ordered as `columns` (empty cells become `None`)"""
+    column_positions = {column.name: position for position, column in enumerate(columns)}
+    for row in report.iterfind('*/ResultXml/rowset:rowset/rowset:Row', REPORT_NAMESPACES):
+        values = [None] * len(columns)
+        for col in row:
+            values[column_positions[get_column_name(col.tag)]] = col.text
+        yield tuple(values)
+
+
 class AlmaAnalytics(Service):
+    # how often, and how many rows at a time, to ask for more of a report
+    default_seconds_between_requests = 1
+    default_limit = DEFAULT_LIMIT
 
-    def __init__(self, use_production=False, logging=True):
-        super(AlmaAnalytics, self).__init__(use_production, logging)  # properly subclass from Service
+    def __init__(self, use_production=False, logging=True, transport=None, rate_limiter=None, retry_policy=None,
+                 cache=None):
+        super(AlmaAnalytics, self).__init__(use_production, logging, transport, rate_limiter, retry_policy, cache)  # properly subclass from Service
         self.base_url = "https://api-na.hosted.exlibrisgroup.com/almaws/v1"
         self.api_key = get_api_key("alma", "analytics", "production")
 
     def prepare_df_from_report_path(self, reportPath, secondsBetweenRequests=1, limit=DEFAULT_LIMIT):
+        builder = ReportFrameBuilder()
+        for _ in self.iter_report_pages(reportPath, secondsBetweenRequests, limit, builder):
+            pass  # each page's rows were parsed into the builder as the page arrived
+
+        # convert the data into a typed pandas 'DataFrame' (built once, from every page of the report)
+        output_data_frame = builder.to_data_frame()
+        self.log_message("shape of output dataframe: " + str(output_data_frame.shape))
+        return output_data_frame
+
+    def iter_report_pages(self, reportPath, secondsBetweenRequests=None, limit=None, builder=None):
+        """yield each page of the report (as parsed XML) as soon as it arrives. Given a `ReportFrameBuilder`, the rows of
+        each page are streamed into it while the page is parsed, and left out of the page yielded"""
+        seconds_between_requests = secondsBetweenRequests or self.default_seconds_between_requests
+        limit = limit or self.default_limit
+
         self.log_message("requesting report for the first time by the reportPath: '" + reportPath + "'...")
-        report = self.request_analytics_report_by_path(reportPath, limit=limit)
+        report = self.request_analytics_report_by_path(reportPath, limit=limit, builder=builder)
+        resumption_token = get_resumption_token(report)
+        yield report
 
-        # if the report isn't finished, use its 'ResumptionToken' to keep re-asking about it until it is
+        # if the report isn't finished, use its 'ResumptionToken' to keep asking for the next page until it is
         while not is_report_finished(report):
-            sleep(secondsBetweenRequests)
-            resumption_token = report.find('*/ResumptionToken').text
+            sleep(seconds_between_requests)
+            resumption_token = get_resumption_token(report) or resumption_token
             self.log_message("re-requesting report via the ResumptionToken (starting with): '" + resumption_token[:25] + "'...")
-            report = self.request_analytics_report_by_token(resumption_token, limit=limit)
+            report = self.request_analytics_report_by_token(resumption_token, limit=limit, builder=builder)
+            yield report
 
-        # process and convert the data into a pandas 'DataFrame' and (optionally) save to disk
-        output_data_frame = self.process_completed_report_into_df(report)
-        return output_data_frame
+    def iter_report_rows(self, reportPath, secondsBetweenRequests=None, limit=None, chunk_size=None, include_headings=True):
+        """iter_report_rows(reportPath, secondsBetweenRequests, limit, chunk_size, include_headings):
+        streams the rows of a report page by page, so only one page is ever held in memory
+        Requires: reportPath
+        yields a tuple of column headings first (unless `include_headings` is False), then a tuple of values per row
+          (or lists of up to `chunk_size` row tuples, if given)
+        """
+        columns = None
+        chunk = []
+        for report in self.iter_report_pages(reportPath, secondsBetweenRequests, limit):
+            if columns is None:
+                columns = parse_report_columns(report) or None
+                if columns is not None and include_headings:
+                    yield tuple(column.heading for column in columns)
+            if columns is None:
+                if report.find('*/ResultXml/rowset:rowset/rowset:Row', REPORT_NAMESPACES) is not None:
+                    raise ValueError("report '{}' returned rows before describing its columns".format(reportPath))
+                continue
+
+            for row in parse_report_rows(report, columns):
+                if not chunk_size:
+                    yield row
+                    continue
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
 
-    def request_analytics_report_by_path(self, pathToReport, limit=DEFAULT_LIMIT):
+    def write_report_to_tsv(self, reportPath, outputPath, secondsBetweenRequests=None, limit=None):
+        """stream a report straight to a tab-separated file (laid out like `DataFrame.to_csv`); returns the row count"""
+        row_count = 0
+        with open(outputPath, 'w', newline='', encoding='utf-8') as output_file:
+            tsv = csv_writer(output_file, delimiter='\t', lineterminator='\n')
+            rows = self.iter_report_rows(reportPath, secondsBetweenRequests, limit)
+            tsv.writerow(("",) + next(rows, ()))
+            for row_count, row in enumerate(rows, start=1):
+                tsv.writerow((row_count - 1,) + row)
+        self.log_message("wrote {} rows to '{}'".format(row_count, outputPath))
+        return row_count
+
+    def request_analytics_report_by_path(self, pathToReport, limit=DEFAULT_LIMIT, builder=None):
         api_path = '/analytics/reports'
         query_params = {"limit": limit, "path": quote_plus(pathToReport)}
         response = self.make_request(api_path, queryParams=query_params, headers=CONTENT_TYPE_XML)
-        report = ET.fromstring(response)
+        report = parse_report(response, builder)
 
         message = response if PRINT_REPORT_UPON_COMPLETION else "report successfully obtained by path"
         self.log_message(message)
         return report
 
-    def request_analytics_report_by_token(self, resumptionToken, limit=DEFAULT_LIMIT):
+    def request_analytics_report_by_token(self, resumptionToken, limit=DEFAULT_LIMIT, builder=None):
         api_path = '/analytics/reports'
         query_params = {"token": resumptionToken, "limit": limit}
         response = self.make_request(api_path, queryParams=query_params, headers=CONTENT_TYPE_XML)
-        report = ET.fromstring(response)
+        report = parse_report(response, builder)
 
         message = response if PRINT_REPORT_UPON_COMPLETION else "report successfully obtained by token"
         self.log_message(message)
         return report
 
     def process_completed_report_into_df(self, report):
-        results = report.find('*/ResultXml')
-        rows = results.findall('*/ns0:Row', {'ns0': 'urn:schemas-microsoft-com:xml-analysis:rowset'})
-
-        # convert information into Pandas DataFrame
-        df = DataFrame()
-        row_dict = {}
-        for row in rows:
-            for col in list(row):  # row.getchildren()
-                row_dict[col.tag[-7:]] = col.text
-            row_dict
-            df = df.append(row_dict, ignore_index=True)
-
-        columns = []
-        resultXml = report.findall('./*/ResultXml')[0]
-        rowset = resultXml.find('./{urn:schemas-microsoft-com:xml-analysis:rowset}rowset')
-        sequence = rowset.findall('./*/*/*/*')
-        for el in sequence:
-            columns.append(el.attrib['{urn:saw-sql}columnHeading'].replace(' REPORT_SUM(', '').replace(' Name)', ''))
+        builder = ReportFrameBuilder()
+        builder.add_report(report)
 
+        # convert information into a typed Pandas DataFrame
+        df = builder.to_data_frame()
         self.log_message("shape of output dataframe: " + str(df.shape))
-        df.columns = columns
-        df.head()
         return df
 
     def upload_to_dw(self, filepath, project_name):
@@ -101,32 +307,55 @@ class AlmaAnalytics(Service):
 
 
 class PrimoAnalytics(AlmaAnalytics):
-    def __init__(self, use_production=False, logging=True):
-        super(PrimoAnalytics, self).__init__(use_production, logging)  # properly subclass from Service
+    default_seconds_between_requests = 3
+    default_limit = 25
+
+    def __init__(self, use_production=False, logging=True, transport=None, rate_limiter=None, retry_policy=None,
+                 cache=None):
+        super(PrimoAnalytics, self).__init__(use_production, logging, transport, rate_limiter, retry_policy, cache)  # properly subclass from Service
         self.base_url = "https://api-na.hosted.exlibrisgroup.com/primo/v1"
         self.api_key = get_api_key("primo", "analytics", "production")
 
     def prepare_df_from_report_path(self, reportPath, secondsBetweenRequests=3, limit=25):
+        return super(PrimoAnalytics, self).prepare_df_from_report_path(reportPath, secondsBetweenRequests, limit)
+
+    def iter_report_pages(self, reportPath, secondsBetweenRequests=None, limit=None, builder=None):
+        seconds_between_requests = secondsBetweenRequests or self.default_seconds_between_requests
+        limit = limit or self.default_limit
+
         self.log_message("requesting report for the first time by the reportPath: '" + reportPath + "'...")
-        report = self.request_analytics_report_by_path(reportPath, limit=limit)
+        report = self.request_analytics_report_by_path(reportPath, limit=limit, builder=builder)
+        resumption_token = get_resumption_token(report)
 
-        # if the report isn't finished, use its 'ResumptionToken' to keep re-asking about it until it is
+        # without a 'ResumptionToken' the report can only be re-requested by its path, which starts it over from the
+        #   first row: only the last of those responses is passed on (or kept by the builder), so no row is counted twice
+        while not resumption_token and not is_report_finished(report):
+            sleep(seconds_between_requests)
+            self.log_message("re-requesting report via the reportPath (primo): '" + reportPath + "'...")
+            if builder is not None:
+                builder.reset()
+            report = self.request_analytics_report_by_path(reportPath, limit=limit, builder=builder)
+            resumption_token = get_resumption_token(report)
+        yield report
+
+        # if the report isn't finished, use its 'ResumptionToken' to keep asking for the next page until it is
         while not is_report_finished(report):
-            sleep(secondsBetweenRequests)
-            try:
-                resumption_token = report.find('*/ResumptionToken').text
-                self.log_message("re-requesting report via the ResumptionToken (starting with): '" + resumption_token[:25] + "'...")
-                report = self.request_analytics_report_by_token(resumption_token)
-            except AttributeError:
-                self.log_message("re-requesting report via the reportPath (primo): '" + reportPath + "'...")
-                report = self.request_analytics_report_by_path(reportPath, limit=limit)
-
-        # process and convert the data into a pandas 'DataFrame' and (optionally) save to disk
-        output_data_frame = self.process_completed_report_into_df(report)
-        return output_data_frame
+            sleep(seconds_between_requests)
+            resumption_token = get_resumption_token(report) or resumption_token
+            self.log_message("re-requesting report via the ResumptionToken (starting with): '" + resumption_token[:25] + "'...")
+            report = self.request_analytics_report_by_token(resumption_token, builder=builder)
+            yield report
+
+
+def __getattr__(name):
+    # the async services live in their own module so that importing this one doesn't import asyncio
+    #   (see async_analytics.py)
+    if name in ("AsyncAlmaAnalytics", "AsyncPrimoAnalytics"):
+        from . import async_analytics
+        return getattr(async_analytics, name)
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
 
 
 if __name__ == "__main__":
     alma_analytics_svc = AlmaAnalytics(use_production=True)
-    report_response_data = alma_analytics_svc.prepare_df_from_report_path(SAMPLE_REPORT_PATH_IN)
-    report_response_data.to_csv(SAMPLE_REPORT_PATH_OUT, sep='\t')
\ No newline at end of file
+    alma_analytics_svc.write_report_to_tsv(SAMPLE_REPORT_PATH_IN, SAMPLE_REPORT_PATH_OUT)
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+## the coroutine counterparts to `analytics.AlmaAnalytics` and `analytics.PrimoAnalytics`, kept apart from them so that
+##   scripts which only use the blocking services don't pay for importing asyncio (they're still available from
+##   `analytics`, imported on first use)
+"""
+
+import asyncio
+from urllib.parse import quote_plus
+
+from . import CONTENT_TYPE_XML, get_api_key
+from .analytics import AlmaAnalytics, PrimoAnalytics, ReportFrameBuilder, DEFAULT_LIMIT, get_resumption_token, \
+    is_report_finished, parse_report
+from .async_service import AsyncService
+
+
+class AsyncAlmaAnalytics(AsyncService):
+    """AsyncAlmaAnalytics polls Analytics reports from an event loop, so many reports can be awaited side by side"""
+    default_seconds_between_requests = AlmaAnalytics.default_seconds_between_requests
+    default_limit = AlmaAnalytics.default_limit
+
+    def __init__(self, use_production=False, logging=True, transport=None, rate_limiter=None, retry_policy=None,
+                 cache=None):
+        super(AsyncAlmaAnalytics, self).__init__(use_production, logging, transport, rate_limiter, retry_policy, cache)
+        self.base_url = "https://api-na.hosted.exlibrisgroup.com/almaws/v1"
+        self.api_key = get_api_key("alma", "analytics", "production")
+
+    async def request_analytics_report_by_path(self, pathToReport, limit=DEFAULT_LIMIT, builder=None):
+        query_params = {"limit": limit, "path": quote_plus(pathToReport)}
+        response = await self.make_request('/analytics/reports', queryParams=query_params, headers=CONTENT_TYPE_XML)
+        self.log_message("report successfully obtained by path")
+        return parse_report(response, builder)
+
+    async def request_analytics_report_by_token(self, resumptionToken, limit=DEFAULT_LIMIT, builder=None):
+        query_params = {"token": resumptionToken, "limit": limit}
+        response = await self.make_request('/analytics/reports', queryParams=query_params, headers=CONTENT_TYPE_XML)
+        self.log_message("report successfully obtained by token")
+        return parse_report(response, builder)
+
+    async def iter_report_pages(self, reportPath, secondsBetweenRequests=None, limit=None, builder=None):
+        """see `AlmaAnalytics.iter_report_pages`"""
+        seconds_between_requests = secondsBetweenRequests or self.default_seconds_between_requests
+        limit = limit or self.default_limit
+
+        self.log_message("requesting report for the first time by the reportPath: '" + reportPath + "'...")
+        report = await self.request_analytics_report_by_path(reportPath, limit=limit, builder=builder)
+        resumption_token = get_resumption_token(report)
+        yield report
+
+        while not is_report_finished(report):
+            await asyncio.sleep(seconds_between_requests)
+            resumption_token = get_resumption_token(report) or resumption_token
+            self.log_message("re-requesting report via the ResumptionToken (starting with): '" + resumption_token[:25] + "'...")
+            report = await self.request_analytics_report_by_token(resumption_token, limit=limit, builder=builder)
+            yield report
+
+    async def prepare_df_from_report_path(self, reportPath, secondsBetweenRequests=None, limit=None):
+        """see `AlmaAnalytics.prepare_df_from_report_path`"""
+        builder = ReportFrameBuilder()
+        async for _ in self.iter_report_pages(reportPath, secondsBetweenRequests, limit, builder):
+            pass
+
+        output_data_frame = builder.to_data_frame()
+        self.log_message("shape of output dataframe: " + str(output_data_frame.shape))
+        return output_data_frame
+
+
+class AsyncPrimoAnalytics(AsyncAlmaAnalytics):
+    default_seconds_between_requests = PrimoAnalytics.default_seconds_between_requests
+    default_limit = PrimoAnalytics.default_limit
+
+    def __init__(self, use_production=False, logging=True, transport=None, rate_limiter=None, retry_policy=None,
+                 cache=None):
+        super(AsyncPrimoAnalytics, self).__init__(use_production, logging, transport, rate_limiter, retry_policy, cache)
+        self.base_url = "https://api-na.hosted.exlibrisgroup.com/primo/v1"
+        self.api_key = get_api_key("primo", "analytics", "production")
+
+    async def iter_report_pages(self, reportPath, secondsBetweenRequests=None, limit=None, builder=None):
+        """see `PrimoAnalytics.iter_report_pages`"""
+        seconds_between_requests = secondsBetweenRequests or self.default_seconds_between_requests
+        limit = limit or self.default_limit
+
+        self.log_message("requesting report for the first time by the reportPath: '" + reportPath + "'...")
+        report = await self.request_analytics_report_by_path(reportPath, limit=limit, builder=builder)
+        resumption_token = get_resumption_token(report)
+
+        while not resumption_token and not is_report_finished(report):
+            await asyncio.sleep(seconds_between_requests)
+            self.log_message("re-requesting report via the reportPath (primo): '" + reportPath + "'...")
+            if builder is not None:
+                builder.reset()
+            report = await self.request_analytics_report_by_path(reportPath, limit=limit, builder=builder)
+            resumption_token = get_resumption_token(report)
+        yield report
+
+        while not is_report_finished(report):
+            await asyncio.sleep(seconds_between_requests)
+            resumption_token = get_resumption_token(report) or resumption_token
+            self.log_message("re-requesting report via the ResumptionToken (starting with): '" + resumption_token[:25] + "'...")
+            report = await self.request_analytics_report_by_token(resumption_token, builder=builder)
+            yield report
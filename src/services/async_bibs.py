@@ -0,0 +1,97 @@
+"""
+## the coroutine counterpart to `bibs.AlmaBibs`, kept apart from it so that scripts which only use `AlmaBibs` don't
+##   pay for importing asyncio (it's still available as `bibs.AsyncAlmaBibs`, imported on first use)
+"""
+
+from . import CONTENT_TYPE_XML, get_api_key
+from .async_service import AsyncService, fetch_concurrently_async, DEFAULT_MAX_CONCURRENCY
+from .bibs import parse_bibs_chunk
+from .lazy import lazy_import
+
+from urllib.parse import quote_plus
+
+etree = lazy_import("lxml.etree")
+
+
+class AsyncAlmaBibs(AsyncService):
+    """AsyncAlmaBibs offers coroutine versions of the `AlmaBibs` lookups and updates, for use from an event loop"""
+
+    def __init__(self, use_production=False, logging=True, transport=None, rate_limiter=None, retry_policy=None,
+                 cache=None):
+        super(AsyncAlmaBibs, self).__init__(use_production, logging, transport, rate_limiter, retry_policy, cache)
+        self.base_url = "https://api-na.hosted.exlibrisgroup.com/almaws/v1"
+        self.api_key = get_api_key("alma", "bibs", self.env)
+
+    async def get_bib_record_by_mms_id(self, mms_id):
+        """see `AlmaBibs.get_bib_record_by_mms_id`"""
+        path = '/bibs/{mms_id}'.format(mms_id=mms_id)
+        query_params = {"expand": "None"}
+        response_body = await self.make_request(path, query_params, headers=CONTENT_TYPE_XML)
+        return etree.fromstring(response_body.encode())
+
+    async def get_bib_records_by_mms_ids(self, mms_ids, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """yields (mms_id, bib or the raised exception) pairs as each bib arrives, with up to `max_concurrency` in flight"""
+        async for mms_id, bib in fetch_concurrently_async(self.get_bib_record_by_mms_id, mms_ids, max_concurrency):
+            yield mms_id, bib
+
+    async def get_bib_records_chunk(self, mms_ids):
+        """see `AlmaBibs.get_bib_records_chunk`"""
+        mms_ids = [str(mms_id) for mms_id in mms_ids]
+        query_params = {"mms_id": ",".join(mms_ids), "view": "full", "expand": "None"}
+        response_body = await self.make_request('/bibs', query_params, headers=CONTENT_TYPE_XML)
+        return parse_bibs_chunk(response_body, mms_ids)
+
+    async def update_bib_record_by_mms_id(self, mms_id, bib):
+        """see `AlmaBibs.update_bib_record_by_mms_id`"""
+        path = '/bibs/{mms_id}'.format(mms_id=mms_id)
+        query_params = {
+            "validate": "true",
+            "stale_version_check": "false"
+        }
+        values = etree.tostring(bib)
+        response_body = await self.make_request(path, query_params, method='PUT', requestBody=values, headers=CONTENT_TYPE_XML)
+        return etree.fromstring(response_body.encode())
+
+    async def get_holdings_list_for_bib(self, mms_id):
+        """see `AlmaBibs.get_holdings_list_for_bib`"""
+        path = '/bibs/{mms_id}/holdings'.format(mms_id=mms_id)
+        response_body = await self.make_request(path, headers=CONTENT_TYPE_XML)
+        return etree.fromstring(response_body.encode())
+
+    async def get_holdings_record(self, mms_id, holdings_id):
+        """see `AlmaBibs.get_holdings_record`"""
+        path = '/bibs/{mms_id}/holdings/{holdings_id}'.format(mms_id=mms_id, holdings_id=holdings_id)
+        response_body = await self.make_request(path, headers=CONTENT_TYPE_XML)
+        return etree.fromstring(response_body.encode())
+
+    async def update_holdings_record(self, mms_id, holdings_id, holdings_object):
+        """see `AlmaBibs.update_holdings_record`"""
+        holdings_object = etree.tostring(holdings_object)
+        path = '/bibs/{mms_id}/holdings/{holding_id}'.format(mms_id=mms_id, holding_id=holdings_id)
+        response_body = await self.make_request(path, method='PUT', headers=CONTENT_TYPE_XML, requestBody=holdings_object)
+        return etree.fromstring(response_body.encode())
+
+    async def get_items_from_holdings_record(self, mms_id, holdings_id, limit, offset, order_by="none", direction="desc"):
+        """see `AlmaBibs.get_items_from_holdings_record`"""
+        path = '/bibs/{mms_id}/holdings/{holding_id}/items'.format(mms_id=mms_id, holding_id=holdings_id)
+        query_params = {
+            "limit": limit,
+            "offset": offset,
+            "order_by": quote_plus(order_by),
+            "direction": quote_plus(direction)
+        }
+        response_body = await self.make_request(path, query_params, headers=CONTENT_TYPE_XML)
+        return etree.fromstring(response_body.encode())
+
+    async def get_representations_list(self, mms_id, limit, offset):
+        """see `AlmaBibs.get_representations_list`"""
+        path = '/bibs/{mms_id}/representations'.format(mms_id=mms_id)
+        query_params = {"limit": limit, "offset": offset}
+        response_body = await self.make_request(path, query_params, headers=CONTENT_TYPE_XML)
+        return etree.fromstring(response_body.encode())
+
+    async def get_representation(self, mms_id, rep_id):
+        """see `AlmaBibs.get_representation`"""
+        path = '/bibs/{mms_id}/representations/{rep_id}'.format(mms_id=mms_id, rep_id=rep_id)
+        response_body = await self.make_request(path, headers=CONTENT_TYPE_XML)
+        return etree.fromstring(response_body.encode())
@@ -0,0 +1,26 @@
+"""
+## the coroutine counterpart to `dspace.Dspace`, kept apart from it so that scripts which only use `Dspace` don't pay
+##   for importing asyncio (it's still available as `dspace.AsyncDspace`, imported on first use)
+"""
+
+from .async_transport import get_default_async_transport
+from .dspace import build_openbu_url, parse_openbu_record
+from .logs import get_logger
+
+logger = get_logger("dspace.py")
+
+
+class AsyncDspace:
+    '''
+    coroutine versions of the `Dspace` tools, for use from an event loop
+    '''
+
+    async def get_openBU_results(identifier, rights, transport=None):
+        '''see `Dspace.get_openBU_results`'''
+        transport = transport if transport else get_default_async_transport()
+        try:
+            response = await transport.request('GET', build_openbu_url(identifier))
+            return parse_openbu_record(response.body, identifier, rights)
+        except Exception as error:  # unreachable, refused or unreadable: like `Dspace.get_openBU_results`, no record
+            logger.warning("unable to get OpenBU record '{}': {}", identifier, error, identifier=identifier)
+            return ('', '')
@@ -0,0 +1,31 @@
+"""
+## the coroutine counterpart to `primo.Primo`, kept apart from it so that scripts which only use `Primo` don't pay for
+##   importing asyncio (it's still available as `primo.AsyncPrimo`, imported on first use)
+"""
+
+import asyncio
+from http.client import HTTPException
+
+from .async_transport import get_default_async_transport
+from .logs import get_logger
+
+logger = get_logger("primo.py")
+
+
+class AsyncPrimo:
+    '''
+    coroutine versions of the `Primo` tools, for use from an event loop (parse results with `Primo.get_primo_json`)
+    '''
+
+    async def get_primo_results(url, transport=None):
+        '''see `Primo.get_primo_results`'''
+        transport = transport if transport else get_default_async_transport()
+        try:
+            response = await transport.request('GET', url)
+        except (OSError, EOFError, HTTPException, asyncio.TimeoutError) as error:
+            logger.warning("unable to search primo: {}", error, url=url)
+            return ''
+        if response.status >= 400:
+            logger.warning("primo responded '{} {}'", response.status, response.reason, url=url)
+            return ''
+        return response.body
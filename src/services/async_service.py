@@ -0,0 +1,76 @@
+"""
+## asyncio counterpart to `Service`: the same URL building, logging, rate limiting, retries and caching, but with a
+##   coroutine `make_request` so thousands of requests can be in flight from a single event loop
+"""
+
+import asyncio
+
+from . import Service
+from .async_transport import get_default_async_transport
+
+DEFAULT_MAX_CONCURRENCY = 50
+
+
+class AsyncService(Service):
+
+    def __init__(self, use_production=False, logging=True, transport=None, rate_limiter=None, retry_policy=None,
+                 cache=None):
+        super(AsyncService, self).__init__(use_production, logging, transport, rate_limiter, retry_policy, cache)
+        self.transport = transport  # an `AsyncHttpTransport`; when None, the one shared within the running event loop
+
+    def get_transport(self):
+        return self.transport if self.transport else get_default_async_transport()
+
+    async def make_request(self, apiPath="", queryParams=None, method='GET', requestBody=None, headers=None):
+        url = self.build_url(apiPath, queryParams)
+        cached, cached_body, headers = self.check_cache(method, url, headers)
+        if cached_body is not None:
+            return cached_body
+
+        path = url.split("?")[0]
+        self.log_request("request", "making a '{}' request to '{}'.", method, path, method=method, url=path)
+        transport = self.get_transport()
+        rate_limiter = self.get_rate_limiter()
+        attempt = 0
+        while True:
+            waited = 0.0
+            delay = rate_limiter.try_acquire(waited)
+            while delay:
+                await asyncio.sleep(delay)
+                waited += delay
+                delay = rate_limiter.try_acquire(waited)
+
+            response = await transport.request(method, url, body=requestBody if requestBody else None, headers=headers)
+            delay = self.get_retry_delay(method, response, attempt, rate_limiter)
+            if delay is None:
+                break
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        return self.handle_response(method, url, response, cached, attempt)
+
+
+async def fetch_concurrently_async(fetch, keys, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """fetch_concurrently_async(fetch, keys, max_concurrency):
+    awaits `fetch(key)` for every key, with at most `max_concurrency` in flight at once
+    Yields (key, result) pairs in the order they complete; if `fetch` raised, the exception takes the place of the result
+    """
+    async def fetch_one(key):
+        try:
+            return key, await fetch(key)
+        except Exception as error:
+            return key, error
+
+    keys = iter(keys)
+    pending = set()
+    while True:
+        for key in keys:
+            pending.add(asyncio.ensure_future(fetch_one(key)))
+            if len(pending) >= max_concurrency:
+                break
+        if not pending:
+            return
+
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
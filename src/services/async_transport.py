@@ -0,0 +1,201 @@
+"""
+## asyncio counterpart to `transport.HttpTransport`: a minimal HTTP/1.1 client over asyncio streams that keeps
+##   per-host pools of keep-alive connections and caps how many connections each host gets at once
+"""
+
+import asyncio
+from collections import deque
+from http.client import parse_headers
+from io import BytesIO
+from ssl import create_default_context
+from time import monotonic
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from .transport import TransportResponse, DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT, DEFAULT_TIMEOUT, is_idempotent
+
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 50
+
+# responses that never carry a body
+NO_BODY_STATUSES = (204, 304)
+
+
+class AsyncHostConnectionPool:
+    """idle (reader, writer) stream pairs to one host, plus a semaphore bounding the connections open at once"""
+
+    def __init__(self, scheme, host, port, pool_size, idle_timeout, timeout, max_connections):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(max_connections)
+        self._idle = deque()
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    async def new_connection(self):
+        ssl_context = create_default_context() if self.scheme == "https" else None
+        self.connections_created += 1
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context), self.timeout
+        )
+
+    async def acquire(self):
+        """-> ((reader, writer), was_reused)"""
+        now = monotonic()
+        while self._idle:
+            connection, released_at = self._idle.pop()
+            if now - released_at <= self.idle_timeout and not connection[0].at_eof():
+                self.connections_reused += 1
+                return connection, True
+            connection[1].close()
+        return await self.new_connection(), False
+
+    def release(self, connection):
+        if len(self._idle) < self.pool_size:
+            self._idle.append((connection, monotonic()))
+        else:
+            connection[1].close()
+
+    def close(self):
+        idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            connection[1].close()
+
+
+class AsyncHttpTransport:
+    """AsyncHttpTransport sends requests from a single event loop over per-host pools of keep-alive connections"""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_TIMEOUT,
+                 max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.max_connections_per_host = max_connections_per_host
+        self._pools = {}
+
+    def get_pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = AsyncHostConnectionPool(scheme, host, port, self.pool_size, self.idle_timeout, self.timeout,
+                                           self.max_connections_per_host)
+            self._pools[key] = pool
+        return pool
+
+    async def request(self, method, url, body=None, headers=None):
+        """send a request to `url` and return the fully-read `TransportResponse`"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        pool = self.get_pool(scheme, parts.hostname, port)
+        async with pool.slots:
+            connection, reused = await pool.acquire()
+            try:
+                response, will_close = await self._send(connection, method, parts.netloc, target, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                connection[1].close()
+                if not reused or not is_idempotent(method):
+                    raise  # (connections the server closed while idle are weeded out in `acquire`, before anything is sent)
+                # the server dropped the idle connection as we used it; retry once on a brand new one
+                connection = await pool.new_connection()
+                try:
+                    response, will_close = await self._send(connection, method, parts.netloc, target, body, headers)
+                except BaseException:
+                    connection[1].close()
+                    raise
+            except BaseException:
+                connection[1].close()
+                raise
+
+            if will_close:
+                connection[1].close()
+            else:
+                pool.release(connection)
+        return response
+
+    async def _send(self, connection, method, host, target, body, headers):
+        reader, writer = connection
+        lines = ["{} {} HTTP/1.1".format(method, target), "Host: " + host]
+        for name, value in (headers or {}).items():
+            lines.append("{}: {}".format(name, value))
+        if body is not None:
+            lines.append("Content-Length: " + str(len(body)))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await writer.drain()
+        return await asyncio.wait_for(self._read_response(reader, method), self.timeout)
+
+    @staticmethod
+    async def _read_response(reader, method):
+        """-> (TransportResponse, whether the server will close the connection)"""
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before a response was received")
+        version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+        status = int(status)
+
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            header_lines.append(line)
+        headers = parse_headers(BytesIO(b"".join(header_lines) + b"\r\n"))
+        will_close = version == "HTTP/1.0" or headers.get("Connection", "").lower() == "close"
+
+        if method == "HEAD" or status in NO_BODY_STATUSES or 100 <= status < 200:
+            body = b""
+        elif headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass  # skip any trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b"".join(chunks)
+        elif headers.get("Content-Length") is not None:
+            body = await reader.readexactly(int(headers["Content-Length"]))
+        else:
+            body = await reader.read()
+            will_close = True
+
+        return TransportResponse(status, reason, headers, body), will_close
+
+    def stats(self):
+        """counts of connections opened and re-used, per host"""
+        return {
+            "{}://{}:{}".format(pool.scheme, pool.host, pool.port): {
+                "connections_created": pool.connections_created,
+                "connections_reused": pool.connections_reused,
+                "idle_connections": len(pool._idle)
+            } for pool in self._pools.values()
+        }
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.close()
+
+
+# asyncio streams belong to the loop that opened them, so each running loop gets its own shared transport
+_default_async_transports = WeakKeyDictionary()
+
+
+def get_default_async_transport():
+    """return the `AsyncHttpTransport` shared within the running event loop (creating it on first use)"""
+    loop = asyncio.get_running_loop()
+    transport = _default_async_transports.get(loop)
+    if transport is None:
+        transport = AsyncHttpTransport()
+        _default_async_transports[loop] = transport
+    return transport
@@ -4,13 +4,47 @@
 ## EDITED: aidans (atla5) 2019-01
 """
 
-from services import Service, CONTENT_TYPE_XML, get_api_key
+from . import Service, CONTENT_TYPE_XML, get_api_key
+from .concurrency import fetch_concurrently, iter_chunks, DEFAULT_MAX_WORKERS
+from .lazy import lazy_import
+from .record_utils import diff_marc_records, digest_bib
 
+from copy import deepcopy
 from urllib.parse import quote_plus
-from lxml import etree
+from xml.sax.saxutils import escape
 from time import strftime
 
+etree = lazy_import("lxml.etree")
+
 # reused variables
+BULK_BIBS_LIMIT = 100  # the most mms_ids Alma's '/bibs' endpoint accepts in a single call
+PAGE_LIMIT = 100  # the most records Alma returns in a single page of a list (items, representations, ...)
+
+# the repositories we link representations to: key -> (name in Alma, whether the public note is url-quoted)
+REPRESENTATION_REPOSITORIES = {
+    "ia": ("InternetArchive", True),
+    "ht": ("HathiTrust", False)
+}
+REPRESENTATION_TEMPLATE = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<representation is_remote="true">
+    <id />
+    <library desc="Mugar">MUG</library>
+    <usage_type desc="Derivative">DERIVATIVE_COPY</usage_type>
+    <public_note>{rights}</public_note>
+    <delivery_url>{delivery_url}</delivery_url>
+    <thumbnail_url/>
+    <repository desc="{repository}">{repository}</repository>
+    <originating_record_id>{identifier}</originating_record_id>
+    <linking_parameter_1>{linking_parameter}</linking_parameter_1>
+    <linking_parameter_2/>
+    <linking_parameter_3/>
+    <linking_parameter_4/>
+    <linking_parameter_5/>
+    <created_by>jwasys</created_by>
+    <created_date>{yyyy_mm_dd}Z</created_date>
+    <last_modified_by>jwasys</last_modified_by>
+    <last_modified_date>{yyyy_mm_dd}Z</last_modified_date>
+</representation>"""
 RIGHTS_DICTIONARY = {
     "pd": "Public Domain : You can copy, modify, distribute and perform the work, even for commercial purposes, all without asking permission.",
     "pdus": "Public Domain (US) : You can copy, modify, distribute and perform the work, even for commercial purposes, all without asking permission in the U.S.",
@@ -25,11 +59,49 @@ RIGHTS_DICTIONARY = {
 }
 
 
+def parse_bibs_chunk(response_body, mms_ids):
+    """split a '<bibs>' response into (mms_id, bib) pairs ordered as `mms_ids`, with `None` for any bib that's missing"""
+    bibs_by_mms_id = {}
+    if response_body:
+        for bib in etree.fromstring(response_body.encode()).iterfind('bib'):
+            bibs_by_mms_id[bib.findtext('mms_id')] = bib
+    return [(mms_id, bibs_by_mms_id.get(mms_id)) for mms_id in mms_ids]
+
+
+def get_total_record_count(list_element):
+    """the 'total_record_count' Alma puts on every list (of items, holdings, representations, ...)"""
+    return int(list_element.get('total_record_count', 0))
+
+
+def get_remaining_offsets(total_record_count, page_size):
+    """the offsets of the pages still to fetch once the first page of a list has come back"""
+    return range(page_size, total_record_count, page_size)
+
+
+def build_representation_payload(identifier, rights, repository, yyyy_mm_dd=None):
+    """the XML body for adding a remote representation (see `AlmaBibs.add_representation`), as bytes"""
+    if repository not in REPRESENTATION_REPOSITORIES:
+        raise ValueError("unknown repository '{}' (expected one of: {})".format(
+            repository, ", ".join(REPRESENTATION_REPOSITORIES)))
+    repository_name, quote_rights = REPRESENTATION_REPOSITORIES[repository]
+    rights = RIGHTS_DICTIONARY[rights]
+    delivery_url = identifier.replace('%3A', ':').replace('%2F', '/')
+    return REPRESENTATION_TEMPLATE.format(
+        repository=repository_name,
+        identifier=quote_plus(identifier),
+        rights=(quote_plus(rights) if quote_rights else escape(rights)).replace('\n', ''),
+        linking_parameter=quote_plus(identifier),
+        delivery_url=quote_plus(delivery_url),
+        yyyy_mm_dd=yyyy_mm_dd if yyyy_mm_dd else strftime("%Y-%m-%d")
+    ).encode('utf-8')
+
+
 class AlmaBibs(Service):
     """AlmaBibs is a set of tools for adding and manipulating Alma bib records"""
 
-    def __init__(self, use_production=False, logging=True):
-        super(AlmaBibs, self).__init__(use_production, logging)  # properly subclass from Service
+    def __init__(self, use_production=False, logging=True, transport=None, rate_limiter=None, retry_policy=None,
+                 cache=None):
+        super(AlmaBibs, self).__init__(use_production, logging, transport, rate_limiter, retry_policy, cache)  # properly subclass from Service
         self.base_url = "https://api-na.hosted.exlibrisgroup.com/almaws/v1"
         self.api_key = get_api_key("alma", "bibs", self.env)
 
@@ -44,6 +116,57 @@ class AlmaBibs(Service):
         bib = etree.fromstring(response_body.encode())
         return bib
 
+    def get_bib_records_by_mms_ids(self, mms_ids, max_workers=DEFAULT_MAX_WORKERS,
+                                   requests_per_second=None):
+        """get_bib_records_by_mms_ids(mms_ids, max_workers, requests_per_second):
+            fetches many bibs concurrently (see `get_bib_record_by_mms_id`); every request still waits on this service's
+              shared rate limiter, `requests_per_second` optionally paces them further
+            Requires an iterable of mms_ids
+            yields (mms_id, bib) pairs as they complete, with the raised exception in place of any bib that failed
+        """
+        return fetch_concurrently(self.get_bib_record_by_mms_id, mms_ids, max_workers, requests_per_second)
+
+    def get_bib_records_chunk(self, mms_ids):
+        """get_bib_records_chunk(mms_ids):
+            retrieves up to 100 bibs in a single call to the '/bibs' endpoint
+            Requires a list of mms_ids (at most `BULK_BIBS_LIMIT`)
+            returns a list of (mms_id, bib) pairs in the order requested, with `None` for any bib Alma didn't return
+        """
+        mms_ids = [str(mms_id) for mms_id in mms_ids]
+        query_params = {"mms_id": ",".join(mms_ids), "view": "full", "expand": "None"}
+        response_body = self.make_request('/bibs', query_params, headers=CONTENT_TYPE_XML)
+        return parse_bibs_chunk(response_body, mms_ids)
+
+    def iter_bib_records_in_bulk(self, mms_ids, chunk_size=BULK_BIBS_LIMIT, max_workers=1):
+        """iter_bib_records_in_bulk(mms_ids, chunk_size, max_workers):
+            retrieves any number of bibs in chunks of `chunk_size` mms_ids per call (optionally fetching
+              `max_workers` chunks at once)
+            Requires an iterable of mms_ids
+            yields (mms_id, bib) pairs, with `None` in place of the bib for each mms_id that wasn't found
+        """
+        chunks = iter_chunks(mms_ids, min(chunk_size, BULK_BIBS_LIMIT))
+        for chunk, bibs_or_error in fetch_concurrently(self.get_bib_records_chunk, map(tuple, chunks), max_workers, None):
+            if isinstance(bibs_or_error, Exception):
+                self.log_warning("error retrieving bibs {}..{} in bulk: {}".format(chunk[0], chunk[-1], bibs_or_error))
+                bibs_or_error = [(str(mms_id), None) for mms_id in chunk]
+            for mms_id, bib in bibs_or_error:
+                yield (mms_id, bib)
+
+    def get_bib_records_in_bulk(self, mms_ids, chunk_size=BULK_BIBS_LIMIT, max_workers=1):
+        """get_bib_records_in_bulk(mms_ids, chunk_size, max_workers):
+            Requires an iterable of mms_ids
+            returns a tuple of a dictionary of bibs keyed by mms_id and the list of mms_ids that weren't found
+        """
+        bibs_by_mms_id, missing_mms_ids = {}, []
+        for mms_id, bib in self.iter_bib_records_in_bulk(mms_ids, chunk_size, max_workers):
+            if bib is None:
+                missing_mms_ids.append(mms_id)
+            else:
+                bibs_by_mms_id[mms_id] = bib
+        if missing_mms_ids:
+            self.log_warning("{} of the requested bibs could not be retrieved".format(len(missing_mms_ids)))
+        return bibs_by_mms_id, missing_mms_ids
+
     def update_bib_record_by_mms_id(self, mms_id, bib):
         """update_bib_in_alma(mms_id,bib,key):
         update a bib record in alma.
@@ -57,11 +180,32 @@ class AlmaBibs(Service):
             "validate": "true",
             "stale_version_check": "false"
         }
-        values = etree.tostring(bib)  # TODO resolve ValueError: 'Please use bytes input or XML fragments...
+        values = etree.tostring(bib)
         response_body = self.make_request(path, query_params, method='PUT', requestBody=values, headers=CONTENT_TYPE_XML)
-        bib = etree.fromstring(response_body)
+        bib = etree.fromstring(response_body.encode())
         return bib
 
+    def update_bib_record_if_changed(self, mms_id, transform):
+        """update_bib_record_if_changed(mms_id, transform):
+        fetches a bib, applies `transform(bib)` (which returns the bib to save, and may change the one it's given) and
+          only PUTs the result back if it differs from what Alma had - ignoring field order and formatting whitespace
+        Requires:
+            mms_id,
+            transform - a function from a bib object (xml) to the bib object to save
+        returns a tuple of the changes made (see `record_utils.diff_marc_records`; empty when there was nothing to
+          update) and the updated bib object from Alma (None when there was nothing to update)
+        """
+        bib = self.get_bib_record_by_mms_id(mms_id)
+        original_bib = deepcopy(bib)
+        original_digest = digest_bib(bib)
+        transformed_bib = transform(bib)
+        if digest_bib(transformed_bib) == original_digest:
+            self.log_message("bib '{}' is unchanged; skipping the update.".format(mms_id))
+            return {}, None
+        # anything the field-level diff can't describe (e.g. the record's attributes) still counts as a change
+        changes = diff_marc_records(original_bib, transformed_bib) or {"record": "changed"}
+        return changes, self.update_bib_record_by_mms_id(mms_id, transformed_bib)
+
     def get_holdings_list_for_bib(self, mms_id):
         """get_holdings_list_for_bib(mms_id,key):
         retrieves a list of holdings attached to the bib record.
@@ -70,9 +214,18 @@ class AlmaBibs(Service):
         """
         path = '/bibs/{mms_id}/holdings'.format(mms_id=mms_id)
         response_body = self.make_request(path, headers=CONTENT_TYPE_XML)
-        holdings_list = etree.fromstring(response_body)  # TODO: resolve ValueError: 'Please use bytes input or XML...
+        holdings_list = etree.fromstring(response_body.encode())
         return holdings_list
 
+    def get_holdings_lists_for_bibs(self, mms_ids, max_workers=DEFAULT_MAX_WORKERS,
+                                    requests_per_second=None):
+        """get_holdings_lists_for_bibs(mms_ids, max_workers, requests_per_second):
+        retrieves the holdings lists of many bibs concurrently (see `get_holdings_list_for_bib`)
+        Requires an iterable of mms_ids
+        yields (mms_id, holdings_list) pairs as they complete, with the raised exception in place of any that failed
+        """
+        return fetch_concurrently(self.get_holdings_list_for_bib, mms_ids, max_workers, requests_per_second)
+
     def get_holdings_record(self, mms_id, holdings_id):
         """get_holdings_record(mms_id,key):
         retrieves a holdings record attached to the bib record.
@@ -83,7 +236,7 @@ class AlmaBibs(Service):
         """
         path = '/bibs/{mms_id}/holdings/{holdings_id}'.format(mms_id=mms_id, holdings_id=holdings_id)
         response_body = self.make_request(path, headers=CONTENT_TYPE_XML)
-        holdings = etree.fromstring(response_body)
+        holdings = etree.fromstring(response_body.encode())
         return holdings
 
     def update_holdings_record(self, mms_id, holdings_id, holdings_object):
@@ -98,7 +251,7 @@ class AlmaBibs(Service):
         path = '/bibs/{mms_id}/holdings/{holding_id}'.format(mms_id=mms_id, holding_id=holdings_id)
 
         response_body = self.make_request(path, method='PUT', headers=CONTENT_TYPE_XML, requestBody=holdings_object)
-        holdings = etree.fromstring(response_body)
+        holdings = etree.fromstring(response_body.encode())
         return holdings
 
     def delete_holdings_record(self, mms_id, holdings_id, bib_method):
@@ -131,9 +284,90 @@ class AlmaBibs(Service):
             "direction": quote_plus(direction)
         }
         response_body = self.make_request(path, query_params, headers=CONTENT_TYPE_XML)
-        items_list = etree.fromstring(response_body)
+        items_list = etree.fromstring(response_body.encode())
         return items_list
 
+    def get_item_pages(self, holdings_keys, page_size=PAGE_LIMIT, order_by="none", direction="desc",
+                       max_workers=DEFAULT_MAX_WORKERS, requests_per_second=None):
+        """get_item_pages(holdings_keys, page_size, order_by, direction, max_workers, requests_per_second):
+        pages through the items of many holdings records concurrently: the first page of every holdings record is
+          fetched and, as soon as its total_record_count is known, its remaining pages are fetched ahead of the first
+          pages still to come
+        Requires an iterable of (mms_id, holdings_id) pairs
+        yields (mms_id, holdings_id, items_list) for every page as it completes, with the raised exception in place of
+          any page that failed
+        """
+        def get_page(key):
+            mms_id, holdings_id, offset = key
+            return self.get_items_from_holdings_record(mms_id, holdings_id, page_size, offset, order_by, direction)
+
+        def get_remaining_pages(key, items_list):
+            mms_id, holdings_id, offset = key
+            if offset:
+                return ()
+            return ((mms_id, holdings_id, remaining_offset) for remaining_offset in
+                    get_remaining_offsets(get_total_record_count(items_list), page_size))
+
+        first_pages = ((mms_id, holdings_id, 0) for mms_id, holdings_id in holdings_keys)
+        for (mms_id, holdings_id, _), items_list in fetch_concurrently(get_page, first_pages, max_workers,
+                                                                       requests_per_second, get_remaining_pages):
+            yield (mms_id, holdings_id, items_list)
+
+    def iter_items_for_bibs(self, mms_ids, page_size=PAGE_LIMIT, max_workers=DEFAULT_MAX_WORKERS,
+                            requests_per_second=None):
+        """iter_items_for_bibs(mms_ids, page_size, max_workers, requests_per_second):
+        walks bib -> every holdings record -> every item for many bibs at once, fetching holdings lists and item pages
+          concurrently (see `get_holdings_lists_for_bibs` and `get_item_pages`)
+        Requires an iterable of mms_ids
+        yields (mms_id, holdings_id, item) for every item, in no particular order. A holdings list or item page that
+          couldn't be retrieved yields the raised exception in place of the item (with `None` for the holdings_id of a
+          failed holdings list), so nothing goes missing silently
+        """
+        failures = []
+
+        def iter_holdings_keys():
+            for mms_id, holdings_list in self.get_holdings_lists_for_bibs(mms_ids, max_workers, requests_per_second):
+                if isinstance(holdings_list, Exception):
+                    failures.append((mms_id, None, holdings_list))
+                    continue
+                for holdings_id in holdings_list.iterfind('holding/holding_id'):
+                    yield (mms_id, holdings_id.text)
+
+        for mms_id, holdings_id, items_list in self.get_item_pages(iter_holdings_keys(), page_size,
+                                                                   max_workers=max_workers,
+                                                                   requests_per_second=requests_per_second):
+            while failures:
+                yield failures.pop()
+            if isinstance(items_list, Exception):
+                self.log_warning("unable to retrieve items for holdings '{}' of bib '{}': {}"
+                                 .format(holdings_id, mms_id, items_list))
+                yield (mms_id, holdings_id, items_list)
+                continue
+            for item in items_list.iterfind('item'):
+                yield (mms_id, holdings_id, item)
+        while failures:
+            yield failures.pop()
+
+    def get_all_representations(self, mms_id, page_size=PAGE_LIMIT, max_workers=DEFAULT_MAX_WORKERS):
+        """get_all_representations(mms_id, page_size, max_workers):
+        retrieves every digital representation attached to a bib record, however many pages of them there are
+          (after the first page, the rest are fetched concurrently)
+        Requires: mms_id
+        returns a list of representation elements in Alma's order
+        """
+        first_page = self.get_representations_list(mms_id, page_size, 0)
+        pages = {0: first_page}
+
+        def get_page(offset):
+            return self.get_representations_list(mms_id, page_size, offset)
+
+        offsets = get_remaining_offsets(get_total_record_count(first_page), page_size)
+        for offset, representations_list in fetch_concurrently(get_page, offsets, max_workers, None):
+            if isinstance(representations_list, Exception):
+                raise representations_list
+            pages[offset] = representations_list
+        return [representation for offset in sorted(pages) for representation in pages[offset].iterfind('representation')]
+
     def get_representations_list(self, mms_id, limit, offset):
         """get_representations_list(mms_id, limit, offset, key):
         retrieve a list of digital representations attached to a bib record.
@@ -146,9 +380,21 @@ class AlmaBibs(Service):
         query_params = {"limit": limit, "offset": offset}
 
         response_body = self.make_request(path, query_params, headers=CONTENT_TYPE_XML)
-        representations_list = etree.fromstring(response_body)
+        representations_list = etree.fromstring(response_body.encode())
         return representations_list
 
+    def get_representations_lists_for_bibs(self, mms_ids, limit, offset, max_workers=DEFAULT_MAX_WORKERS,
+                                           requests_per_second=None):
+        """get_representations_lists_for_bibs(mms_ids, limit, offset, max_workers, requests_per_second):
+        retrieves the representations lists of many bibs concurrently (see `get_representations_list`)
+        Requires an iterable of mms_ids, plus the limit and offset applied to each list
+        yields (mms_id, representations_list) pairs as they complete, with the raised exception in place of any that failed
+        """
+        def get_representations_list_for_bib(mms_id):
+            return self.get_representations_list(mms_id, limit, offset)
+
+        return fetch_concurrently(get_representations_list_for_bib, mms_ids, max_workers, requests_per_second)
+
     def get_representation(self, mms_id, rep_id):
         """get_representation(mms_id,rep_id):
         retrieve the digital representation record.
@@ -158,9 +404,34 @@ class AlmaBibs(Service):
         """
         path = '/bibs/{mms_id}/representations/{rep_id}'.format(mms_id=mms_id, rep_id=rep_id)
         response_body = self.make_request(path, headers=CONTENT_TYPE_XML)
-        representation = etree.fromstring(response_body)
+        representation = etree.fromstring(response_body.encode())
         return representation
 
+    def add_representation(self, mms_id, identifier, rights, repository, yyyy_mm_dd=None):
+        """add_representation(mms_id, identifier, rights, repository, yyyy_mm_dd):
+        adds a remote digital representation record to a bib record in Alma
+        Requires:
+            mms_id,
+            identifier - the OAI record identifier
+            rights - a key of `RIGHTS_DICTIONARY`
+            repository - a key of `REPRESENTATION_REPOSITORIES` ('ia' or 'ht')
+            yyyy_mm_dd (optional) - the created/modified date to record (today by default; pass it in when adding many)
+        Returns the mms_id, the OAI record identifier, and the ID for the digital representation (None if Alma added the
+          representation but its response couldn't be read - the representation is there either way)
+        Raises a `ServiceRequestError` if Alma refused it
+        """
+        path = '/bibs/{mms_id}/representations'.format(mms_id=mms_id)
+        values = build_representation_payload(identifier, rights, repository, yyyy_mm_dd)
+        response_body = self.make_request(path, method='POST', headers=CONTENT_TYPE_XML, requestBody=values)
+        try:
+            representation_id = etree.fromstring(response_body.encode()).findtext('id')
+        except etree.XMLSyntaxError as error:
+            # the POST succeeded, so this mustn't be mistaken for a failure (and the representation added again)
+            self.log_warning("added a representation of '{}' to bib '{}', but couldn't read its ID: {}".format(
+                identifier, mms_id, error))
+            representation_id = None
+        return (mms_id, identifier, representation_id)
+
     def add_ia_representation(self, mms_id, identifier, rights):
         """
         add_representation adds a digital representation record to a bib record in Alma for a
@@ -171,43 +442,7 @@ class AlmaBibs(Service):
             rights - a string indicating the rights associated with the digital object
         Returns the mms_id, the OAI record identifier, and the ID for the digital representation
         """
-        rights = RIGHTS_DICTIONARY[rights]
-        delivery_url = identifier.replace('%3A', ':').replace('%2F', '/')
-        linking_parameter = identifier
-        path = '/bibs/{mms_id}/representations'.format(mms_id=mms_id)
-
-        values = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
-            <representation is_remote="true">    
-                <id />    
-                <library desc="Mugar">MUG</library>    
-                <usage_type desc="Derivative">DERIVATIVE_COPY</usage_type> 
-                <public_note>{rights}</public_note>
-                <delivery_url>{delivery_url}</delivery_url>    
-                <thumbnail_url/>    
-                <repository desc="InternetArchive">InternetArchive</repository>  
-                <originating_record_id>{identifier}</originating_record_id>    
-                <linking_parameter_1>{linking_parameter}</linking_parameter_1>    
-                <linking_parameter_2/>    
-                <linking_parameter_3/>    
-                <linking_parameter_4/>    
-                <linking_parameter_5/>    
-                <created_by>jwasys</created_by>    
-                <created_date>{yyyy_mm_dd}Z</created_date>    
-                <last_modified_by>jwasys</last_modified_by>    
-                <last_modified_date>{yyyy_mm_dd}Z</last_modified_date>
-            </representation>'''.format(
-                identifier=quote_plus(linking_parameter),
-                mms_id=mms_id,
-                rights=quote_plus(rights).replace('\n', ''),
-                linking_parameter=quote_plus(linking_parameter),
-                delivery_url=quote_plus(delivery_url),
-                yyyy_mm_dd=strftime("%Y-%m-%d")
-            )
-
-        response_body = self.make_request(path, method='POST', headers=CONTENT_TYPE_XML, requestBody=values.encode("utf-8"))
-        tree = etree.fromstring(response_body)
-        x = tree.find('id')
-        return (mms_id, identifier, x.text)
+        return self.add_representation(mms_id, identifier, rights, 'ia')
 
     def add_ht_representation(self, mms_id, identifier, rights):
         """
@@ -219,42 +454,27 @@ class AlmaBibs(Service):
             rights - a string indicating the rights associated with the digital object
         Returns the mms_id, the OAI record identifier, and the ID for the digital representation
         """
-        rights = RIGHTS_DICTIONARY[rights]
-        delivery_url = identifier.replace('%3A', ':').replace('%2F', '/')
-        linking_parameter = identifier
-        path = '/bibs/{mms_id}/representations'.format(mms_id=mms_id)
+        return self.add_representation(mms_id, identifier, rights, 'ht')
+
+    def find_representation(self, mms_id, identifier):
+        """find_representation(mms_id, identifier):
+        looks through a bib's representations for one already made for the OAI record `identifier`
+        Requires: mms_id, identifier
+        returns the representation's ID, or None if the bib has none for `identifier`
+        """
+        originating_record_ids = (identifier, quote_plus(identifier))
+        for representation in self.get_all_representations(mms_id):
+            if representation.findtext('originating_record_id') in originating_record_ids:
+                return representation.findtext('id')
+        return None
+
 
-        values = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
-            <representation is_remote="true">    
-                <id />    
-                <library desc="Mugar">MUG</library>    
-                <usage_type desc="Derivative">DERIVATIVE_COPY</usage_type> 
-                <public_note>{rights}</public_note>
-                <delivery_url>{delivery_url}</delivery_url>    
-                <thumbnail_url/>    
-                <repository desc="HathiTrust">HathiTrust</repository>  
-                <originating_record_id>{identifier}</originating_record_id>    
-                <linking_parameter_1>{linking_parameter}</linking_parameter_1>    
-                <linking_parameter_2/>    
-                <linking_parameter_3/>    
-                <linking_parameter_4/>    
-                <linking_parameter_5/>    
-                <created_by>jwasys</created_by>    
-                <created_date>{yyyy_mm_dd}Z</created_date>    
-                <last_modified_by>jwasys</last_modified_by>    
-                <last_modified_date>{yyyy_mm_dd}Z</last_modified_date>
-            </representation>'''.format(
-            mms_id=mms_id,
-            identifier=quote_plus(linking_parameter),
-            rights=rights.replace('\n', ''),
-            linking_parameter=quote_plus(linking_parameter),
-            delivery_url=quote_plus(delivery_url),
-            yyyy_mm_dd=strftime("%Y-%m-%d")
-        )
-        response_body = self.make_request(path, requestBody=values.encode('utf-8'), headers=CONTENT_TYPE_XML, method='POST')
-        tree = etree.fromstring(response_body)
-        x = tree.find('id')
-        return (mms_id, identifier, x.text)
+def __getattr__(name):
+    # `AsyncAlmaBibs` lives in its own module so that importing this one doesn't import asyncio (see async_bibs.py)
+    if name == "AsyncAlmaBibs":
+        from .async_bibs import AsyncAlmaBibs
+        return AsyncAlmaBibs
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
 
 
 if __name__ == "__main__":
@@ -272,6 +492,9 @@ if __name__ == "__main__":
 
     # test real bib functionality
     sample_bib_record = alma_service.get_bib_record_by_mms_id(sample_mms_id)
+    # sample_bibs, sample_missing_mms_ids = alma_service.get_bib_records_in_bulk([sample_mms_id])
+    # for fetched_mms_id, bib_or_error in alma_service.get_bib_records_by_mms_ids([sample_mms_id]):
+    #     print(fetched_mms_id, bib_or_error)
     # updated_bib = alma_service.update_bib_record_by_mms_id(sample_mms_id, sample_bib)
 
     # holdings
@@ -287,7 +510,7 @@ if __name__ == "__main__":
     sample_rep_id = 5678  # TODO replace with legitimate example
     sample_oai_id = "arXiv.org:hep-th/9901001"
     sample_rights = "pd"
-    # alma_service.get_representations_list(sample_mms_id, sample_limit, sample_offset)  # TODO resolve same encoding error
+    # alma_service.get_representations_list(sample_mms_id, sample_limit, sample_offset)
     # alma_service.get_representation(sample_mms_id, sample_rep_id)  # TODO invalid rep_id
     # alma_service.add_ia_representation(sample_mms_id, sample_oai_id, sample_rights)  # TODO unknown Bad Request (<representations total_record_count="0"/>)
     # alma_service.add_ht_representation(sample_mms_id, sample_oai_id, sample_rights)  # TODO unknown Bad Request (<representations total_record_count="0"/>)
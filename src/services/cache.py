@@ -0,0 +1,186 @@
+"""
+## opt-in, persistent cache of GET responses for the `Service` classes
+## entries live in a SQLite file under `OUTPUT_DIRECTORY`, expire per endpoint, are evicted least-recently-used first
+##   and are revalidated with the server's ETag (if it sent one) instead of being downloaded again
+"""
+
+from hashlib import sha256
+from os import makedirs
+from os.path import join, dirname
+from re import compile as compile_regex
+from sqlite3 import connect
+from threading import Lock
+from time import time
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from . import OUTPUT_DIRECTORY
+
+DEFAULT_CACHE_PATH = join(OUTPUT_DIRECTORY, "cache", "responses.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_TTL = 60 * 60 * 24  # one day
+
+# how long responses from each kind of endpoint stay fresh (first matching pattern wins), in seconds
+DEFAULT_TTLS = (
+    (r"/bibs/[^/]+/holdings/[^/]+/items", 60 * 60),  # item circulation status changes often
+    (r"/bibs/[^/]+/holdings", 60 * 60 * 6),
+    (r"/bibs/[^/]+/representations", 60 * 60 * 6),
+    (r"/bibs", 60 * 60 * 24),
+    (r"/analytics/reports", 0)  # never cache report pages (their resumption tokens are single-use)
+)
+
+# query parameters that are credentials rather than part of what's asked for: they're kept out of the stored path, but
+#   still go into the (hashed) key, so a response fetched with one apikey (e.g. sandbox) is never served for another
+CREDENTIAL_QUERY_PARAMS = ("apikey",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_by_last_used ON responses (last_used);
+CREATE INDEX IF NOT EXISTS responses_by_path ON responses (path);
+"""
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "is_fresh")
+
+    def __init__(self, body, etag, is_fresh):
+        self.body = body
+        self.etag = etag
+        self.is_fresh = is_fresh
+
+
+class ResponseCache:
+    """ResponseCache stores response bodies keyed by method, path, query and apikey (only ever stored hashed)"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttls=DEFAULT_TTLS, default_ttl=DEFAULT_TTL):
+        makedirs(dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = [(compile_regex(pattern), ttl) for pattern, ttl in ttls]
+        self.default_ttl = default_ttl
+        self._lock = Lock()
+        self._db = connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    @staticmethod
+    def split_url(url):
+        """-> (path, query string without credentials, sorted so equivalent requests share an entry)"""
+        parts = urlsplit(url)
+        query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in CREDENTIAL_QUERY_PARAMS)
+        return "{}://{}{}".format(parts.scheme, parts.netloc, parts.path), urlencode(query)
+
+    @staticmethod
+    def get_credentials(url):
+        return sorted((k, v) for k, v in parse_qsl(urlsplit(url).query) if k in CREDENTIAL_QUERY_PARAMS)
+
+    def make_key(self, method, url):
+        path, query = self.split_url(url)
+        credentials = urlencode(self.get_credentials(url))
+        return sha256("{} {}?{} {}".format(method.upper(), path, query, credentials).encode()).hexdigest()
+
+    def get_ttl(self, url):
+        path = urlsplit(url).path
+        for pattern, ttl in self.ttls:
+            if pattern.search(path):
+                return ttl
+        return self.default_ttl
+
+    def is_cacheable(self, method, url):
+        return method.upper() == "GET" and self.get_ttl(url) > 0
+
+    def get(self, method, url):
+        """return the `CachedResponse` for a request (or `None`), marking it as recently used"""
+        key = self.make_key(method, url)
+        now = time()
+        with self._lock:
+            row = self._db.execute("SELECT body, etag, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        body, etag, expires_at = row
+        return CachedResponse(bytes(body), etag, now < expires_at)
+
+    def record_hit(self, revalidated=False):
+        with self._lock:
+            self.hits += 1
+            if revalidated:
+                self.revalidations += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, method, url, body, etag=None):
+        key = self.make_key(method, url)
+        path, _ = self.split_url(url)
+        now = time()
+        with self._lock:
+            replaced = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._total_bytes += len(body) - (replaced[0] if replaced else 0)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, path, body, etag, stored_at, expires_at, last_used, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, path, body, etag, now, now + self.get_ttl(url), now, len(body))
+            )
+            self._evict()
+
+    def refresh(self, method, url):
+        """the server confirmed (via a '304 Not Modified') that the cached copy is still current"""
+        now = time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE responses SET stored_at = ?, expires_at = ?, last_used = ? WHERE key = ?",
+                (now, now + self.get_ttl(url), now, self.make_key(method, url))
+            )
+
+    def _evict(self):
+        """drop the least recently used entries until the cache fits within `max_bytes`"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_bytes -= size
+            if self._total_bytes <= self.max_bytes:
+                break
+
+    def invalidate(self, url):
+        """forget the cached responses a write (PUT/POST/DELETE) to `url` could have made stale: those for its path,
+        anything beneath it, and the collection it belongs to (e.g. '/bibs' for '/bibs/{mms_id}')"""
+        path, _ = self.split_url(url)
+        parent_path = path.rsplit("/", 1)[0]
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM responses WHERE path = ? OR path = ? OR substr(path, 1, ?) = ?",
+                (path, parent_path, len(path) + 1, path + "/")
+            )
+            self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses,
+                    "revalidations": self.revalidations}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
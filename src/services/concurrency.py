@@ -0,0 +1,91 @@
+"""
+## helpers for running many API calls at once through a bounded pool of worker threads
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from time import monotonic, sleep
+
+from .rate_limit import DEFAULT_REQUESTS_PER_SECOND
+
+DEFAULT_MAX_WORKERS = 10
+
+
+class RequestPacer:
+    """spaces out calls across threads so that no more than `requests_per_second` start each second
+    (for callers that don't already go through a `Service` and its shared `RateLimiter`)"""
+
+    def __init__(self, requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0
+        self._next_start = monotonic()
+        self._lock = Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            sleep(start - now)
+
+
+def fetch_concurrently(fetch, keys, max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                       follow_up=None):
+    """fetch_concurrently(fetch, keys, max_workers, requests_per_second, follow_up):
+    calls `fetch(key)` for every key on a pool of `max_workers` threads, starting at most `requests_per_second`
+      calls each second. Only a small window of keys is queued at once, so `keys` can be a lazy iterable.
+      With `follow_up(key, result)`, each successful result can add more keys to fetch (e.g. the rest of a paged list),
+      which are fetched ahead of any of `keys` still to come
+    Yields (key, result) pairs in the order they complete; if `fetch` raised, the exception takes the place of the result
+    """
+    pacer = RequestPacer(requests_per_second)
+    max_pending = max_workers * 2
+
+    def paced_fetch(key):
+        pacer.wait()
+        return fetch(key)
+
+    keys = iter(keys)
+    follow_up_keys = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        exhausted = False
+        while True:
+            while len(pending) < max_pending:
+                if follow_up_keys:
+                    key = follow_up_keys.popleft()
+                elif exhausted:
+                    break
+                else:
+                    try:
+                        key = next(keys)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                pending[executor.submit(paced_fetch, key)] = key
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                error = future.exception()
+                if error is None and follow_up is not None:
+                    follow_up_keys.extend(follow_up(key, future.result()))
+                yield (key, error if error is not None else future.result())
+
+
+def iter_chunks(items, chunk_size):
+    """split any iterable into lists of (at most) `chunk_size` items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -7,6 +7,96 @@
 from urllib.request import Request, urlopen
 from urllib.parse import quote_plus
 
+from .concurrency import fetch_concurrently
+from .lazy import lazy_import
+from .logs import get_logger
+from .record_utils import MarcRecordIndex
+
+ET = lazy_import("lxml.etree")
+
+logger = get_logger("dspace.py")
+
+# OpenBU is a single DSpace server, so be gentler with it than with the Alma APIs
+DEFAULT_OPENBU_WORKERS = 4
+DEFAULT_OPENBU_REQUESTS_PER_SECOND = 2
+
+OPENBU_OAI_URL = 'http://open.bu.edu/oai/request'
+OAI_NAMESPACES = {'oai': 'http://www.openarchives.org/OAI/2.0/', 'marc': 'http://www.loc.gov/MARC21/slim',
+                  'ns0': 'http://www.openarchives.org/OAI/2.0/'}
+
+RIGHTS_DICTIONARY = {'pd': 'public domain', 'pdus': 'public domain (US)', 'icworld': 'in copyright (world)',
+                     'icus': 'in copyright (US)', 'ic': 'in copyright', 'und': 'unknown',
+                     'cc-by-nc-nd-3.0': 'Creative Commons Attribution-NonCommercial-NoDerivatives',
+                     'cc-by-nc-nd-4.0': 'Creative Commons Attribution-NonCommercial-NoDerivatives',
+                     'cc-by-nc-3.0': 'Creative Commons Attribution-NonCommercial',
+                     'cc-by-nc-4.0': 'Creative Commons Attribution-NonCommercial',
+                     'cc-by-nc-sa-4.0': 'Creative Commons Attribution-NonCommercial-ShareAlike',
+                     'cc-by-nc-sa-3.0': 'Creative Commons Attribution-NonCommercial-ShareAlike',
+                     'cc-by-sa-4.0': 'Creative Commons Attribution-ShareAlike',
+                     'cc-by-sa-3.0': 'Creative Commons Attribution-ShareAlike',
+                     'cc-by-3.0': 'Creative Commons Attribution',
+                     'cc-by-4.0': 'Creative Commons Attribution',
+                     }
+
+
+def build_openbu_url(identifier):
+    url = OPENBU_OAI_URL + '?verb=GetRecord&identifier={{identifier}}&metadataPrefix=marc'
+    return url.replace('{{identifier}}', quote_plus(identifier))
+
+
+def describe_rights(rights):
+    if type(rights) != str:
+        rights = 'Undetermined'
+        # rights = 'cc-by-nc-sa-4.0'
+    if rights in RIGHTS_DICTIONARY:
+        rights = RIGHTS_DICTIONARY[rights]
+    return rights
+
+
+def make_openbu_field(tag, identifier, rights, namespace=None):
+    """the 024/924 field pointing back at the OpenBU record (and its handle)"""
+    def qualified(name):
+        return '{%s}%s' % (namespace, name) if namespace else name
+
+    field = ET.Element(qualified('datafield'), {'ind1': '7', 'ind2': ' ', 'tag': tag})
+    for code, text in (('a', identifier), ('c', rights), ('2', 'OpenBU'), ('0', 'http://hdl.handle.net/' + identifier[16:])):
+        subfield = ET.SubElement(field, qualified('subfield'), {'code': code})
+        subfield.text = text
+    return field
+
+
+def transform_openbu_record(marc_record, identifier, rights):
+    """replace the record's 024s with our own 024/924 pair, and make the 720 'author' the 100"""
+    rights = describe_rights(rights)
+    namespace = ET.QName(marc_record).namespace
+    fields = MarcRecordIndex(marc_record)  # one pass over the record for every tag looked at below
+
+    fields.remove_fields('024')
+    fields.add_field(make_openbu_field('024', identifier, rights, namespace))
+    fields.add_field(make_openbu_field('924', identifier, rights, namespace))
+
+    for el in fields.get_fields('720'):
+        for e in el:
+            if e.text == 'author':
+                el.attrib.clear()
+                el.attrib.update({'tag': '100', 'ind1': '1', 'ind2': ' '})
+    return marc_record
+
+
+def parse_openbu_record(response_body, identifier, rights):
+    """pull the header and (transformed) MARC record out of a 'GetRecord' response -> (oai_header, marc_record)"""
+    oai_result = ET.fromstring(response_body)
+    header = oai_result.find('./ns0:GetRecord/ns0:record/ns0:header', OAI_NAMESPACES)
+    if header is not None and header.attrib.get('status') == 'deleted':
+        return ('deleted', '')
+
+    record = oai_result.find('oai:GetRecord/oai:record', OAI_NAMESPACES)
+    oai_header = record[0]
+    marc_record = record[1].find('marc:record', OAI_NAMESPACES)
+    transform_openbu_record(marc_record, identifier, rights)
+    # marc_record = sort_marc_tags(marc_record)
+    return (oai_header, marc_record)
+
 
 class Dspace:
     '''
@@ -19,87 +109,31 @@ class Dspace:
 
     def get_openBU_results(identifier, rights):
         '''get_primo_results executes the search and returns the response'''
-        url = 'http://open.bu.edu/oai/request?verb=GetRecord&identifier={{identifier}}&metadataPrefix=marc'
-        url = url.replace('{{identifier}}', quote_plus(identifier))
-        # print(url)
-        request = Request(url)
-        # rights = 0
-        recno = identifier
-        if type(rights) != str:
-            rights = 'Undetermined'
-            # rights = 'cc-by-nc-sa-4.0'
-        rights_dict = {'pd': 'public domain', 'pdus': 'public domain (US)', 'icworld': 'in copyright (world)',
-                       'icus': 'in copyright (US)', 'ic': 'in copyright', 'und': 'unknown',
-                       'cc-by-nc-nd-3.0': 'Creative Commons Attribution-NonCommercial-NoDerivatives',
-                       'cc-by-nc-nd-4.0': 'Creative Commons Attribution-NonCommercial-NoDerivatives',
-                       'cc-by-nc-3.0': 'Creative Commons Attribution-NonCommercial',
-                       'cc-by-nc-4.0': 'Creative Commons Attribution-NonCommercial',
-                       'cc-by-nc-sa-4.0': 'Creative Commons Attribution-NonCommercial-ShareAlike',
-                       'cc-by-nc-sa-3.0': 'Creative Commons Attribution-NonCommercial-ShareAlike',
-                       'cc-by-sa-4.0': 'Creative Commons Attribution-ShareAlike',
-                       'cc-by-sa-3.0': 'Creative Commons Attribution-ShareAlike',
-                       'cc-by-3.0': 'Creative Commons Attribution',
-                       'cc-by-4.0': 'Creative Commons Attribution',
-                       }
-
-        ## now let's add the ht_recno to 024$a
-        if rights in rights_dict:
-            rights = rights_dict[rights]
-
-        _024 = '''       <datafield ind1="7" ind2=" " tag="024">
-                <subfield code="a">{{OpenBU_record}}</subfield>
-                <subfield code="c">{{rights}}</subfield>
-                <subfield code="2">OpenBU</subfield>
-                <subfield code="0">http://hdl.handle.net/{{record}}</subfield>
-            </datafield>'''.replace('{{OpenBU_record}}', recno).replace('{{rights}}', rights).replace('{{record}}',
-                                                                                                      recno[16:])
-        _924 = '''       <datafield ind1="7" ind2=" " tag="924">
-                <subfield code="a">{{OpenBU_record}}</subfield>
-                <subfield code="c">{{rights}}</subfield>
-                <subfield code="2">OpenBU</subfield>
-                <subfield code="0">http://hdl.handle.net/{{record}}</subfield>
-            </datafield>'''.replace('{{OpenBU_record}}', recno).replace('{{rights}}', rights).replace('{{record}}',
-                                                                                                      recno[16:])
-
-        field_924 = ET.fromstring(_924)
-        field_024 = ET.fromstring(_024)
-
+        request = Request(build_openbu_url(identifier))
         try:
-
             response_body = urlopen(request).read()
-            oai_result = ET.fromstring(response_body)
-            # ns = {'oai':'http://www.openarchives.org/OAI/2.0/','marc':'http://www.loc.gov/MARC21/slim'}
-
-            ns = {'oai': 'http://www.openarchives.org/OAI/2.0/', 'marc': 'http://www.loc.gov/MARC21/slim',
-                  'ns0': 'http://www.openarchives.org/OAI/2.0/'}
-            header = oai_result.find('./ns0:GetRecord/ns0:record/ns0:header', ns)
-            try:
-                if header.attrib['status'] == 'deleted':
-                    return ('deleted', '')
-            except Exception as e:
-                pass
-
-            oai_header = oai_result.find('oai:GetRecord', ns).getchildren()[0][0]
-            metadata = oai_result.find('oai:GetRecord', ns).getchildren()[0][1]
-            marc_record = metadata.find('marc:record', ns)
-            _024s = marc_record.findall('*/[@tag="024"]')
-            for _024 in _024s:
-                marc_record.remove(_024)
-            marc_record.append(field_024)
-            marc_record.append(field_924)
-
-            for el in marc_record.findall('*/[@tag="720"]'):
-                for e in el.getchildren():
-                    # print(e.tag,e.attrib,e.text)
-                    if e.text == 'author':
-                        el.attrib = {'tag': '100', 'ind1': '1', 'ind2': ' '}
-
-            # marc_record = sort_marc_tags(marc_record)
+            return parse_openbu_record(response_body, identifier, rights)
         except Exception as e:
             print('There was an exception')
             print(e)
-            oai_header = ''
-            marc_record = ''
-        # print(ET.tostring(marc_record))
-        return (oai_header, marc_record)
+            return ('', '')
+
+    @staticmethod
+    def get_many_openBU_results(identifiers_and_rights, max_workers=DEFAULT_OPENBU_WORKERS,
+                                requests_per_second=DEFAULT_OPENBU_REQUESTS_PER_SECOND):
+        '''get_many_openBU_results runs `get_openBU_results` for each (identifier, rights) pair on a bounded pool,
+           yielding (identifier, (oai_header, marc_record)) pairs as each completes'''
+        def get_results(identifier_and_rights):
+            return Dspace.get_openBU_results(*identifier_and_rights)
+
+        for (identifier, _), results in fetch_concurrently(get_results, identifiers_and_rights, max_workers,
+                                                           requests_per_second):
+            yield (identifier, results)
+
 
+def __getattr__(name):
+    # `AsyncDspace` lives in its own module so that importing this one doesn't import asyncio (see async_dspace.py)
+    if name == "AsyncDspace":
+        from .async_dspace import AsyncDspace
+        return AsyncDspace
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
@@ -0,0 +1,276 @@
+"""
+## harvesting OpenBU over OAI-PMH: `ListRecords` pages are followed by resumption token (optionally within
+##   `from`/`until` windows harvested concurrently), stream-parsed, given the same 024/924/720->100 treatment as
+##   `Dspace.get_openBU_results`, and written out as one MARCXML collection as they arrive
+## a `HarvestState` remembers what earlier harvests saw, so later ones only ask for (and write) what changed since
+"""
+
+from collections import namedtuple
+from datetime import date, timedelta
+from http.client import HTTPException
+from io import BytesIO
+from os import makedirs
+from os.path import dirname, join
+from sqlite3 import connect
+from time import time
+from urllib.parse import urlencode
+
+from . import OUTPUT_DIRECTORY
+from .concurrency import fetch_concurrently, RequestPacer
+from .dspace import OPENBU_OAI_URL, OAI_NAMESPACES, DEFAULT_OPENBU_WORKERS, DEFAULT_OPENBU_REQUESTS_PER_SECOND, \
+    transform_openbu_record
+from .lazy import lazy_import
+from .record_utils import MarcCollectionWriter
+from .transport import get_default_transport
+
+ET = lazy_import("lxml.etree")
+
+OAI_NAMESPACE = OAI_NAMESPACES['oai']
+DEFAULT_METADATA_PREFIX = 'marc'
+DEFAULT_HARVEST_PATH = join(OUTPUT_DIRECTORY, "openbu_harvest.xml")
+DEFAULT_STATE_PATH = join(OUTPUT_DIRECTORY, "harvest", "openbu.sqlite")
+
+# what a harvested record turned out to be, compared with the harvest state
+RECORD_NEW = 'new'
+RECORD_CHANGED = 'changed'
+RECORD_UNCHANGED = 'unchanged'
+RECORD_DELETED = 'deleted'
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS harvests (
+    name TEXT PRIMARY KEY,
+    last_harvested TEXT NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    identifier TEXT PRIMARY KEY,
+    datestamp TEXT,
+    deleted INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_by_deleted ON records (deleted, updated_at);
+"""
+
+# an OAI error code meaning "nothing to harvest" rather than "something went wrong"
+NO_RECORDS_MATCH = 'noRecordsMatch'
+
+# one harvested record: `marc_record` is the transformed MARC element (`None` for a deleted record)
+OaiRecord = namedtuple("OaiRecord", ["identifier", "datestamp", "deleted", "marc_record"])
+
+
+class OaiError(Exception):
+    pass
+
+
+def build_list_records_url(metadata_prefix=DEFAULT_METADATA_PREFIX, from_date=None, until=None, set_spec=None,
+                           resumption_token=None):
+    """a `ListRecords` request; a resumption token stands on its own (the protocol forbids the other arguments)"""
+    if resumption_token:
+        return OPENBU_OAI_URL + '?' + urlencode({'verb': 'ListRecords', 'resumptionToken': resumption_token})
+    params = {'verb': 'ListRecords', 'metadataPrefix': metadata_prefix}
+    for name, value in (('from', from_date), ('until', until), ('set', set_spec)):
+        if value:
+            params[name] = str(value)
+    return OPENBU_OAI_URL + '?' + urlencode(params)
+
+
+def iter_date_windows(from_date, until, window_days):
+    """split [from_date, until] into consecutive, non-overlapping (from, until) day windows of `window_days` days"""
+    start = from_date
+    while start <= until:
+        end = min(start + timedelta(days=window_days - 1), until)
+        yield (start, end)
+        start = end + timedelta(days=1)
+
+
+def parse_list_records(response_body, rights_for=None):
+    """parse_list_records(response_body, rights_for):
+    stream-parses one `ListRecords` page, transforming each MARC record with the rights `rights_for(identifier)`
+      gives it (undetermined when `rights_for` is None); each record's element is cleared once it has been handled
+    returns (list of `OaiRecord`s, the resumption token for the next page or None)
+    """
+    records = []
+    resumption_token = None
+    tags = ('{%s}record' % OAI_NAMESPACE, '{%s}resumptionToken' % OAI_NAMESPACE, '{%s}error' % OAI_NAMESPACE)
+    for _, element in ET.iterparse(BytesIO(response_body), events=('end',), tag=tags):
+        name = ET.QName(element).localname
+        if name == 'error':
+            code = element.get('code')
+            if code == NO_RECORDS_MATCH:
+                return [], None
+            raise OaiError("OpenBU responded '{}': {}".format(code, (element.text or '').strip()))
+        if name == 'resumptionToken':
+            resumption_token = (element.text or '').strip() or None
+            continue
+
+        header = element.find('oai:header', OAI_NAMESPACES)
+        identifier = header.findtext('oai:identifier', namespaces=OAI_NAMESPACES)
+        datestamp = header.findtext('oai:datestamp', namespaces=OAI_NAMESPACES)
+        if header.get('status') == 'deleted':
+            records.append(OaiRecord(identifier, datestamp, True, None))
+        else:
+            marc_record = element.find('oai:metadata/marc:record', OAI_NAMESPACES)
+            rights = rights_for(identifier) if rights_for else None
+            # detach the MARC record so clearing the OAI record below doesn't empty it
+            marc_record.getparent().remove(marc_record)
+            records.append(OaiRecord(identifier, datestamp, False, transform_openbu_record(marc_record, identifier,
+                                                                                            rights)))
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    return records, resumption_token
+
+
+def fetch_oai_page(url, transport=None, pacer=None):
+    transport = transport if transport else get_default_transport()
+    if pacer:
+        pacer.wait()
+    try:
+        response = transport.request('GET', url)
+    except (OSError, HTTPException) as e:
+        raise OaiError("unable to reach OpenBU: {}".format(e))
+    if response.status >= 400:
+        raise OaiError("OpenBU responded '{} {}'".format(response.status, response.reason))
+    return response.body
+
+
+def iter_list_records(from_date=None, until=None, set_spec=None, metadata_prefix=DEFAULT_METADATA_PREFIX,
+                      rights_for=None, transport=None, pacer=None):
+    """iter_list_records(from_date, until, set_spec, metadata_prefix, rights_for, transport, pacer):
+    follows `ListRecords` resumption tokens through a whole harvest, one page in memory at a time (pages are spaced
+      out by `pacer`, a `RequestPacer`, when given)
+    Yields `OaiRecord`s
+    """
+    url = build_list_records_url(metadata_prefix, from_date, until, set_spec)
+    while url:
+        records, resumption_token = parse_list_records(fetch_oai_page(url, transport, pacer), rights_for)
+        yield from records
+        url = build_list_records_url(resumption_token=resumption_token) if resumption_token else None
+
+
+class HarvestState:
+    """HarvestState keeps, in a SQLite file, the date of each named harvest's last successful run and the datestamp
+    and deleted status of every record seen. Changes made during a harvest are only kept once `finish_harvest` is
+    called, so a harvest that fails part way is simply run again from the same date"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        makedirs(dirname(path), exist_ok=True)
+        self.path = path
+        self._db = connect(path)
+        self._db.executescript(STATE_SCHEMA)
+
+    def get_last_harvested(self, name):
+        """the `until` date (as an ISO string) of the last successful harvest called `name`, or None"""
+        row = self._db.execute("SELECT last_harvested FROM harvests WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def update_record(self, record):
+        """note a harvested `OaiRecord` -> RECORD_NEW, RECORD_CHANGED, RECORD_UNCHANGED or RECORD_DELETED"""
+        row = self._db.execute("SELECT datestamp, deleted FROM records WHERE identifier = ?",
+                               (record.identifier,)).fetchone()
+        if row is not None and row[0] == record.datestamp and bool(row[1]) == record.deleted:
+            return RECORD_UNCHANGED
+        self._db.execute("INSERT OR REPLACE INTO records (identifier, datestamp, deleted, updated_at) VALUES (?, ?, ?, ?)",
+                         (record.identifier, record.datestamp, int(record.deleted), time()))
+        if record.deleted:
+            return RECORD_DELETED
+        return RECORD_NEW if row is None else RECORD_CHANGED
+
+    def finish_harvest(self, name, until):
+        self._db.execute("INSERT OR REPLACE INTO harvests (name, last_harvested, finished_at) VALUES (?, ?, ?)",
+                         (name, str(until), time()))
+        self._db.commit()
+
+    def abandon_harvest(self):
+        self._db.rollback()
+
+    def get_deleted_identifiers(self, since=None):
+        """identifiers of records deleted from OpenBU (only those noted after the unix time `since`, if given)"""
+        rows = self._db.execute("SELECT identifier FROM records WHERE deleted = 1 AND updated_at > ? ORDER BY identifier",
+                                (since if since else 0,))
+        return [identifier for identifier, in rows]
+
+    def stats(self):
+        total, deleted = self._db.execute("SELECT COUNT(*), COALESCE(SUM(deleted), 0) FROM records").fetchone()
+        return {"records": total, "deleted_records": deleted}
+
+    def close(self):
+        self._db.close()
+
+
+class OpenBUHarvester:
+    """OpenBUHarvester harvests OpenBU with `ListRecords`, splitting a `from`/`until` range into windows that are
+    harvested concurrently (each window follows its own resumption tokens)"""
+
+    def __init__(self, set_spec=None, metadata_prefix=DEFAULT_METADATA_PREFIX, rights_for=None, transport=None,
+                 max_workers=DEFAULT_OPENBU_WORKERS, requests_per_second=DEFAULT_OPENBU_REQUESTS_PER_SECOND):
+        self.set_spec = set_spec
+        self.metadata_prefix = metadata_prefix
+        self.rights_for = rights_for  # identifier -> rights code (see `dspace.RIGHTS_DICTIONARY`)
+        self.transport = transport
+        self.max_workers = max_workers
+        self.pacer = RequestPacer(requests_per_second)  # shared by every window, so it bounds the whole harvest
+
+    def iter_window(self, from_date=None, until=None):
+        return iter_list_records(from_date, until, self.set_spec, self.metadata_prefix, self.rights_for,
+                                 self.transport, self.pacer)
+
+    def iter_records(self, from_date=None, until=None, window_days=None):
+        """iter_records(from_date, until, window_days):
+        harvests everything changed between `from_date` and `until` (dates; either may be None for an open range).
+          With `window_days` and a `from_date`, the range is split into windows of that many days which are harvested
+          `max_workers` at a time; windows are yielded whole, in the order they finish
+        Yields `OaiRecord`s (raises `OaiError` if any page fails)
+        """
+        if not window_days or from_date is None or self.max_workers <= 1:
+            yield from self.iter_window(from_date, until)
+            return
+
+        windows = iter_date_windows(from_date, until if until else date.today(), window_days)
+        harvest_window = lambda window: list(self.iter_window(*window))
+        for window, records in fetch_concurrently(harvest_window, windows, self.max_workers, None):
+            if isinstance(records, Exception):
+                raise records
+            yield from records
+
+    def harvest_to_file(self, path=DEFAULT_HARVEST_PATH, from_date=None, until=None, window_days=None):
+        """harvest_to_file(path, from_date, until, window_days):
+        writes every (non-deleted) harvested record to a MARCXML collection at `path` as it arrives
+        returns the list of `OaiRecord`s for deleted records, for the caller to act on
+        """
+        deleted = []
+        with MarcCollectionWriter(path) as writer:
+            for record in self.iter_records(from_date, until, window_days):
+                if record.deleted:
+                    deleted.append(record)
+                else:
+                    writer.write(record.marc_record)
+        return deleted
+
+    def harvest_changes(self, state, path=DEFAULT_HARVEST_PATH, name='openbu', window_days=None, until=None):
+        """harvest_changes(state, path, name, window_days, until):
+        harvests only what changed since the last successful harvest called `name` (everything, the first time),
+          writing new and changed records to a MARCXML collection at `path` and noting each record in `state`
+          (a `HarvestState`). The harvest runs up to `until` (today by default), which becomes the next one's `from`
+        returns a summary: counts of new, changed, unchanged and deleted records and the list of identifiers deleted
+          in this harvest (for propagating to Alma)
+        """
+        until = until if until else date.today()
+        last_harvested = state.get_last_harvested(name)
+        from_date = date.fromisoformat(last_harvested) if last_harvested else None
+        summary = {RECORD_NEW: 0, RECORD_CHANGED: 0, RECORD_UNCHANGED: 0, RECORD_DELETED: 0, "from": last_harvested,
+                   "until": str(until), "deleted_identifiers": []}
+        try:
+            with MarcCollectionWriter(path) as writer:
+                for record in self.iter_records(from_date, until, window_days):
+                    outcome = state.update_record(record)
+                    summary[outcome] += 1
+                    if outcome == RECORD_DELETED:
+                        summary["deleted_identifiers"].append(record.identifier)
+                    elif outcome != RECORD_UNCHANGED:
+                        writer.write(record.marc_record)
+        except BaseException:
+            state.abandon_harvest()
+            raise
+        state.finish_harvest(name, until)
+        return summary
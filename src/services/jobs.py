@@ -0,0 +1,239 @@
+"""
+## resumable batch jobs: every id's outcome is journaled to disk as it happens, so an interrupted run can pick up
+##   where it left off (re-trying only what failed or never finished) instead of starting over
+"""
+
+from csv import DictReader, writer as csv_writer
+from hashlib import sha256
+from json import dumps, loads
+from os import makedirs
+from os.path import dirname, exists, join
+from threading import Lock
+from time import strftime
+
+from . import OUTPUT_DIRECTORY
+from .concurrency import fetch_concurrently
+from .lazy import lazy_import
+from .logs import get_logger
+
+etree = lazy_import("lxml.etree")
+
+JOURNAL_DIRECTORY = join(OUTPUT_DIRECTORY, "jobs")
+
+# the states an id can be in
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def make_job_key(job_id):
+    """ids are journaled as strings; tuples (e.g. (mms_id, holdings_id)) become 'mms_id:holdings_id'"""
+    if isinstance(job_id, (tuple, list)):
+        return ":".join(str(part) for part in job_id)
+    return str(job_id)
+
+
+def digest_result(result):
+    """a short fingerprint of whatever a task returned (e.g. the updated record Alma sent back)"""
+    if result is None:
+        return None
+    if isinstance(result, str):
+        result = result.encode("utf-8")
+    elif isinstance(result, (dict, list, tuple)):
+        result = dumps(result, sort_keys=True).encode("utf-8")
+    elif not isinstance(result, bytes):
+        result = etree.tostring(result)
+    return sha256(result).hexdigest()
+
+
+class JobJournal:
+    """JobJournal is an append-only JSON-lines file of status changes; the latest line for an id is its status"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = Lock()
+        makedirs(dirname(path) or ".", exist_ok=True)
+        if exists(path):
+            self._load()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    continue  # a partially-written last line from a run that was killed
+                self.entries[entry["id"]] = entry
+
+    def record(self, key, status, digest=None, error=None, result=None):
+        entry = {"id": key, "status": status, "digest": digest, "error": error, "at": strftime('%Y-%m-%d %H:%M:%S')}
+        if result is not None:
+            entry["result"] = result
+        with self._lock:
+            self.entries[key] = entry
+            self._file.write(dumps(entry) + "\n")
+            self._file.flush()
+
+    def get_status(self, key):
+        entry = self.entries.get(key)
+        return entry["status"] if entry else None
+
+    def count(self, status):
+        return sum(1 for entry in self.entries.values() if entry["status"] == status)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CheckpointedJob:
+    """CheckpointedJob runs `task(job_id)` for many ids, journaling each outcome so later runs can resume"""
+
+    def __init__(self, task, journal_path, max_workers=1, logging=True, describe_result=None):
+        self.task = task
+        self.journal_path = journal_path
+        self.max_workers = max_workers
+        self.log = logging
+        self.describe_result = describe_result  # optional: result -> JSON-able details to journal alongside its digest
+
+    def log_message(self, message, level="INFO"):
+        if self.log:
+            get_logger(self.__class__.__name__).log(level, message)
+
+    def run(self, job_ids, retry_failed=True):
+        """run the task for every id that isn't already done (or failed, unless `retry_failed`). -> status counts"""
+        journal = JobJournal(self.journal_path)
+        skipped = 0
+
+        def ids_to_run():
+            nonlocal skipped
+            for job_id in job_ids:
+                status = journal.get_status(make_job_key(job_id))
+                if status == STATUS_DONE or (status == STATUS_FAILED and not retry_failed):
+                    skipped += 1
+                    continue
+                journal.record(make_job_key(job_id), STATUS_PENDING)
+                yield job_id
+
+        completed, failed = 0, 0
+        try:
+            for job_id, result in fetch_concurrently(self.task, ids_to_run(), self.max_workers, None):
+                key = make_job_key(job_id)
+                if isinstance(result, Exception):
+                    failed += 1
+                    journal.record(key, STATUS_FAILED, error="{}: {}".format(type(result).__name__, result))
+                    self.log_message("'{}' failed: {}".format(key, result), level="WARN")
+                else:
+                    completed += 1
+                    details = self.describe_result(result) if self.describe_result else None
+                    journal.record(key, STATUS_DONE, digest=digest_result(result), result=details)
+        finally:
+            journal.close()
+
+        summary = {"done": completed, "failed": failed, "skipped": skipped}
+        self.log_message("finished job journaled at '{}': {}".format(self.journal_path, summary))
+        return summary
+
+
+def run_bib_updates(bibs_service, mms_ids, transform, job_name, max_workers=1, retry_failed=True, skip_unchanged=True):
+    """run_bib_updates(bibs_service, mms_ids, transform, job_name, max_workers, retry_failed, skip_unchanged):
+    fetch each bib, apply `transform(bib)` (which returns the bib to save) and PUT it back, journaling every mms_id
+      to 'output/jobs/{job_name}.jsonl' so the job can be re-run to resume it. With `skip_unchanged`, bibs the
+      transform didn't really change aren't PUT at all, and the journal notes which fields each update changed
+    returns the counts of bibs done, failed and skipped (already done), plus (with `skip_unchanged`) how many of
+      those done were updated and how many were left unchanged
+    """
+    if not skip_unchanged:
+        def update_bib(mms_id):
+            bib = bibs_service.get_bib_record_by_mms_id(mms_id)
+            return bibs_service.update_bib_record_by_mms_id(mms_id, transform(bib))
+
+        job = CheckpointedJob(update_bib, join(JOURNAL_DIRECTORY, job_name + ".jsonl"), max_workers, bibs_service.log)
+        return job.run(mms_ids, retry_failed)
+
+    outcomes = {"updated": 0, "unchanged": 0}
+    outcomes_lock = Lock()
+
+    def update_bib_if_changed(mms_id):
+        changes, _ = bibs_service.update_bib_record_if_changed(mms_id, transform)
+        outcome = "updated" if changes else "unchanged"
+        with outcomes_lock:
+            outcomes[outcome] += 1
+        return {"outcome": outcome, "changes": changes}
+
+    job = CheckpointedJob(update_bib_if_changed, join(JOURNAL_DIRECTORY, job_name + ".jsonl"), max_workers,
+                          bibs_service.log, describe_result=lambda result: result)
+    summary = job.run(mms_ids, retry_failed)
+    summary.update(outcomes)
+    return summary
+
+
+def run_holdings_updates(bibs_service, mms_and_holdings_ids, transform, job_name, max_workers=1, retry_failed=True):
+    """run_holdings_updates(bibs_service, mms_and_holdings_ids, transform, job_name, max_workers, retry_failed):
+    the same as `run_bib_updates`, for holdings records identified by (mms_id, holdings_id) pairs
+    """
+    def update_holdings(mms_and_holdings_id):
+        mms_id, holdings_id = mms_and_holdings_id
+        holdings = bibs_service.get_holdings_record(mms_id, holdings_id)
+        return bibs_service.update_holdings_record(mms_id, holdings_id, transform(holdings))
+
+    job = CheckpointedJob(update_holdings, join(JOURNAL_DIRECTORY, job_name + ".jsonl"), max_workers, bibs_service.log)
+    return job.run(mms_and_holdings_ids, retry_failed)
+
+
+def read_representation_rows(csv_path):
+    """the (mms_id, identifier, rights, repository) rows of a CSV file with those four columns"""
+    with open(csv_path, newline='', encoding="utf-8") as csv_file:
+        for row in DictReader(csv_file):
+            yield (row["mms_id"].strip(), row["identifier"].strip(), row["rights"].strip(), row["repository"].strip())
+
+
+def write_representation_ledger(journal, rows, ledger_path):
+    """one line per (mms_id, identifier) of this run: what happened and the representation it ended up with"""
+    with open(ledger_path, "w", newline='', encoding="utf-8") as ledger_file:
+        ledger = csv_writer(ledger_file)
+        ledger.writerow(["mms_id", "identifier", "repository", "status", "outcome", "representation_id", "error"])
+        for mms_id, identifier, _, repository in rows:
+            entry = journal.entries.get(make_job_key((mms_id, identifier)), {})
+            result = entry.get("result") or {}
+            ledger.writerow([mms_id, identifier, repository, entry.get("status"), result.get("outcome"),
+                             result.get("representation_id"), entry.get("error")])
+
+
+def run_representation_loads(bibs_service, rows, job_name, max_workers=4, retry_failed=True, skip_existing=True):
+    """run_representation_loads(bibs_service, rows, job_name, max_workers, retry_failed, skip_existing):
+    adds remote representations in bulk: every row is an (mms_id, identifier, rights, repository) tuple, with
+      `repository` one of `bibs.REPRESENTATION_REPOSITORIES` (see `read_representation_rows` for reading them from a CSV).
+      Repeated rows are only loaded once and, with `skip_existing`, a bib that already has a representation for the
+      identifier keeps it instead of getting a second one. POSTs run `max_workers` at a time under the service's
+      rate limiter; every row is journaled to 'output/jobs/{job_name}.jsonl' (so the job can be re-run to resume it)
+      and the results are written to the ledger 'output/jobs/{job_name}.csv'
+    returns the counts of rows done, failed and skipped (already done)
+    """
+    yyyy_mm_dd = strftime("%Y-%m-%d")  # one date for the whole load
+    unique_rows = list({(row[0], row[1]): tuple(row) for row in rows}.values())
+    rows_by_key = {(mms_id, identifier): (rights, repository) for mms_id, identifier, rights, repository in unique_rows}
+
+    def load_representation(mms_and_identifier):
+        mms_id, identifier = mms_and_identifier
+        rights, repository = rows_by_key[mms_and_identifier]
+        if skip_existing:
+            representation_id = bibs_service.find_representation(mms_id, identifier)
+            if representation_id is not None:
+                return {"outcome": "already present", "representation_id": representation_id}
+        _, _, representation_id = bibs_service.add_representation(mms_id, identifier, rights, repository, yyyy_mm_dd)
+        return {"outcome": "added", "representation_id": representation_id}
+
+    journal_path = join(JOURNAL_DIRECTORY, job_name + ".jsonl")
+    job = CheckpointedJob(load_representation, journal_path, max_workers, bibs_service.log,
+                          describe_result=lambda result: result)
+    summary = job.run(list(rows_by_key), retry_failed)
+
+    journal = JobJournal(journal_path)
+    try:
+        write_representation_ledger(journal, unique_rows, join(JOURNAL_DIRECTORY, job_name + ".csv"))
+    finally:
+        journal.close()
+    return summary
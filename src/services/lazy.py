@@ -0,0 +1,30 @@
+"""
+## deferred imports for heavy dependencies (pandas, lxml): a module-level stand-in that only imports the real module
+##   the first time one of its attributes is used, so scripts that never touch it don't pay for importing it
+"""
+
+from importlib import import_module
+
+
+class LazyModule:
+    """LazyModule stands in for the module called `name` until an attribute of it is first asked for"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        return "<lazily imported module '{}'{}>".format(self._name, "" if self._module is None else " (loaded)")
+
+
+def lazy_import(name):
+    """a stand-in for `import name` that defers the import until the module is used"""
+    return LazyModule(name)
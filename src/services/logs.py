@@ -0,0 +1,217 @@
+"""
+## structured logging for the services and scripts: each line is a record (level, module, message and any extra
+##   fields) rendered either in the familiar `construct_log_message` text format or as JSON lines
+## records below the configured level are dropped before anything is formatted, per-request INFO lines can be
+##   sampled, and output can be buffered and written from a background thread so logging stays off the hot path
+## configure once per script with `configure_logging(...)` (or the SERVICES_LOG_* environment variables)
+"""
+
+from atexit import register as register_at_exit
+from json import dumps
+from os import environ
+from queue import SimpleQueue, Empty
+from sys import stdout
+from threading import Event, Lock, Thread
+from time import localtime, strftime, time
+
+from . import construct_log_message
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40}
+DEFAULT_LEVEL = environ.get("SERVICES_LOG_LEVEL", "INFO").upper()
+DEFAULT_FORMAT = environ.get("SERVICES_LOG_FORMAT", "text").lower()
+DEFAULT_SAMPLE_RATES = environ.get("SERVICES_LOG_SAMPLE_RATES", "")  # e.g. "request=20,response=20"
+
+DEFAULT_FLUSH_INTERVAL = 0.5  # seconds a buffered line may wait before it's written
+
+
+def get_level_number(level):
+    return LEVELS.get(level.upper(), LEVELS["INFO"]) if isinstance(level, str) else level
+
+
+def parse_sample_rates(sample_rates):
+    """'request=20,response=20' -> {"request": 20, "response": 20} (dictionaries are returned as they are)"""
+    if not isinstance(sample_rates, str):
+        return dict(sample_rates) if sample_rates else {}
+    rates = {}
+    for rate in sample_rates.split(","):
+        if "=" in rate:
+            sample, every = rate.split("=", 1)
+            rates[sample.strip()] = int(every)
+    return rates
+
+
+def render_text(record):
+    """the human-readable format scripts have always printed, banners around warnings and all (extra fields are left
+    to the JSON renderer)"""
+    return construct_log_message(record["module"], record["message"], level=record["level"])
+
+
+def render_json(record):
+    """one JSON object per line: 'time' (ISO 8601, local time with milliseconds), 'level', 'module', 'message', ..."""
+    record = dict(record)
+    timestamp = record["time"]
+    record["time"] = strftime("%Y-%m-%dT%H:%M:%S", localtime(timestamp)) + ".{:03d}".format(int(timestamp % 1 * 1000))
+    return dumps(record, default=str)
+
+
+RENDERERS = {"text": render_text, "json": render_json}
+
+
+class StreamWriter:
+    """writes each line straight to the stream (as `print` did)"""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._lock = Lock()
+
+    def write(self, line):
+        stream = self.stream if self.stream else stdout  # looked up each time, so redirected output is respected
+        with self._lock:
+            stream.write(line + "\n")
+            stream.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BufferedWriter:
+    """hands lines to a background thread that writes them in batches, so callers never wait on the stream"""
+
+    def __init__(self, stream=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self._queue = SimpleQueue()
+        self._pending = Event()
+        self._lock = Lock()
+        self._closed = False
+        self._thread = Thread(target=self._run, name="BufferedLogWriter", daemon=True)
+        self._thread.start()
+        register_at_exit(self.close)
+
+    def write(self, line):
+        self._queue.put(line)
+        self._pending.set()
+
+    def _drain(self):
+        with self._lock:  # lines are only taken off the queue while holding the lock, so they come out in order
+            lines = []
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            if lines:
+                stream = self.stream if self.stream else stdout
+                stream.write("\n".join(lines) + "\n")
+                stream.flush()
+
+    def _run(self):
+        while not self._closed:
+            if self._pending.wait(self.flush_interval):
+                self._pending.clear()  # cleared before draining, so a line written meanwhile wakes the next round
+                self._drain()
+
+    def flush(self):
+        self._drain()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pending.set()  # wake the thread so it notices it's closed
+            self._thread.join(self.flush_interval * 2)
+            self._drain()
+
+
+class LogConfiguration:
+    """the settings every `Logger` shares: minimum level, renderer, writer and sample rates"""
+
+    def __init__(self, level=DEFAULT_LEVEL, output_format=DEFAULT_FORMAT, writer=None, sample_rates=DEFAULT_SAMPLE_RATES):
+        self.level = get_level_number(level)
+        self.render = RENDERERS[output_format]
+        self.writer = writer if writer else StreamWriter()
+        # sample name -> emit 1 in every N of those lines (e.g. {"request": 10}); unlisted samples are all emitted
+        self.sample_every = parse_sample_rates(sample_rates)
+        self._sample_counts = {}
+        self._lock = Lock()
+
+    def take_sample(self, sample):
+        every = self.sample_every.get(sample, 1)
+        if every <= 1:
+            return True
+        with self._lock:
+            count = self._sample_counts.get(sample, 0)
+            self._sample_counts[sample] = count + 1
+        return count % every == 0
+
+
+_configuration = LogConfiguration()
+
+
+def configure_logging(level=DEFAULT_LEVEL, output_format=DEFAULT_FORMAT, sample_rates=DEFAULT_SAMPLE_RATES,
+                      buffered=False, stream=None):
+    """configure_logging(level, output_format, sample_rates, buffered, stream):
+    sets up logging for every `Logger` (call it once, at the start of a script)
+    Requires:
+        level - the lowest level written ('DEBUG', 'INFO', 'WARN' or 'ERROR')
+        output_format - 'text' (the `construct_log_message` format) or 'json' (JSON lines)
+        sample_rates - {sample name: N} to write only 1 in every N lines logged with that sample (e.g. {"request": 20},
+          or the string "request=20")
+        buffered - write lines from a background thread rather than as they're logged
+        stream - where to write (standard output by default)
+    returns the new `LogConfiguration`
+    """
+    global _configuration
+    _configuration.writer.close()
+    writer = BufferedWriter(stream) if buffered else StreamWriter(stream)
+    _configuration = LogConfiguration(level, output_format, writer, sample_rates)
+    return _configuration
+
+
+class Logger:
+    """Logger writes records for one module (or class, or script) through the shared configuration"""
+
+    __slots__ = ("module",)
+
+    def __init__(self, module):
+        self.module = module
+
+    def is_enabled(self, level):
+        return get_level_number(level) >= _configuration.level
+
+    def log(self, level, message, *args, sample=None, **fields):
+        """log(level, message, *args, sample, **fields):
+        writes a record, unless it's below the configured level or `sample` says to skip it; `message` is only
+          formatted with `args` (`message.format(*args)`) once the record is known to be written
+        """
+        configuration = _configuration
+        if get_level_number(level) < configuration.level:
+            return
+        if sample is not None and not configuration.take_sample(sample):
+            return
+        record = {"time": time(), "level": level.upper(), "module": self.module,
+                  "message": message.format(*args) if args else message}
+        record.update(fields)
+        configuration.writer.write(configuration.render(record))
+
+    def debug(self, message, *args, **fields):
+        self.log("DEBUG", message, *args, **fields)
+
+    def info(self, message, *args, **fields):
+        self.log("INFO", message, *args, **fields)
+
+    def warning(self, message, *args, **fields):
+        self.log("WARN", message, *args, **fields)
+
+    def error(self, message, *args, **fields):
+        self.log("ERROR", message, *args, **fields)
+
+
+def get_logger(module):
+    return Logger(module)
+
+
+def flush_logs():
+    _configuration.writer.flush()
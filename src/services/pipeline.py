@@ -0,0 +1,249 @@
+"""
+## runs CPU-bound record transforms (e.g. `sort_marc_tags` or the OpenBU 024/924/720 rewrite) across a pool of
+##   processes: records are sent out in chunks as serialized MARCXML, transformed by a chain of functions, and come
+##   back in the order they went in
+## when transforming a file, the records are sliced out of it without being parsed, so all of the parsing happens in the
+##   workers (see `src/benchmarks/pipeline.py`)
+"""
+
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Pool, cpu_count
+from re import DOTALL, compile as compile_regex
+
+from .lazy import lazy_import
+from .record_utils import MARC_NAMESPACE, MARC_RECORD_TAGS
+
+etree = lazy_import("lxml.etree")
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_BLOCK_SIZE = 1024 * 1024  # bytes of a MARCXML file read at a time
+
+# what can come before the document's root: the declaration, processing instructions, comments, doctype and whitespace
+PROLOG = compile_regex(rb"(?:\s+|<\?.*?\?>|<!--.*?-->|<![^\[>]*(?:\[.*?\])?\s*>)*", DOTALL)
+ROOT_START_TAG = compile_regex(rb"<([^\s?!/>]+)[^>]*>")
+# a (possibly prefixed) record's start tag
+RECORD_START_TAG = compile_regex(rb"<((?:[\w.-]+:)?record)(?=[\s/>])[^>]*>")
+END_TAG_FOLLOWERS = (b">", b" ", b"\t", b"\r", b"\n")
+# markup the record slicer passes over, as (opener, closer): it may hold what looks like a record's start or end tag
+SKIPPED_MARKUP = ((b"<!--", b"-->"), (b"<![CDATA[", b"]]>"), (b"<?", b"?>"))
+LONGEST_MARKUP_OPENER = len(b"<![CDATA[")
+MARKUP_MARKERS = (b"!", b"?")  # what follows the '<' of each of them
+LESS_THAN = ord("<")
+
+# the transforms a worker process applies, set once per process by `init_worker` rather than sent with every chunk
+_worker_transforms = ()
+
+
+def init_worker(transforms):
+    global _worker_transforms
+    _worker_transforms = transforms
+
+
+def apply_transforms(record, transforms):
+    """pass a record through each transform in turn -> the result, or None if a transform dropped the record"""
+    for transform in transforms:
+        record = transform(record)
+        if record is None:
+            return None
+    return record
+
+
+def transform_chunk(chunk):
+    """(in a worker process) parse, transform and re-serialize a chunk of MARCXML records (None for dropped ones)"""
+    results = []
+    for record_xml in chunk:
+        record = apply_transforms(etree.fromstring(record_xml), _worker_transforms)
+        results.append(etree.tostring(record, encoding='utf-8') if record is not None else None)
+    return results
+
+
+def transform_collection_chunk(collection_xml):
+    """(in a worker process) parse a chunk of records sliced out of a MARCXML file (see `iter_marcxml_chunks`), then
+    transform and re-serialize the MARC ones (None for dropped ones)"""
+    results = []
+    for record in list(etree.fromstring(collection_xml)):
+        if record.tag in MARC_RECORD_TAGS:
+            record = apply_transforms(record, _worker_transforms)
+            results.append(etree.tostring(record, encoding='utf-8') if record is not None else None)
+    return results
+
+
+def find_markup(buffer, start, end):
+    """the position of the first comment, CDATA section or processing instruction in buffer[start:end], or -1"""
+    first = -1
+    for marker in MARKUP_MARKERS:
+        # look for the '!' or '?' alone, which (unlike '<') is rare in a record, then check it follows a '<'
+        position = buffer.find(marker, start + 1, end)
+        while position != -1 and buffer[position - 1] != LESS_THAN:
+            position = buffer.find(marker, position + 1, end)
+        if position != -1 and (first == -1 or position - 1 < first):
+            first = position - 1
+    return first
+
+
+def skip_markup(buffer, position):
+    """the position just past the comment, CDATA section or processing instruction at `position`, or -1 if it carries
+    on past the end of the buffer"""
+    for opener, closer in SKIPPED_MARKUP:
+        if buffer.startswith(opener, position):
+            end = buffer.find(closer, position + len(opener))
+            return end + len(closer) if end != -1 else -1
+    # the buffer may end part-way through the opener
+    return -1 if len(buffer) - position < LONGEST_MARKUP_OPENER else position + 2
+
+
+def find_end_tag(buffer, position, end_tag, skip_markup_before=False):
+    """the position just past `end_tag` (skipping any longer tag name that merely starts with it and, when asked to,
+    anything inside comments, CDATA sections and processing instructions), or -1 if it isn't in the buffer"""
+    while True:
+        end = buffer.find(end_tag, position)
+        while end != -1 and buffer[end + len(end_tag):end + len(end_tag) + 1] not in END_TAG_FOLLOWERS:
+            end = buffer.find(end_tag, end + 1)
+        if end == -1:
+            return -1
+        markup = find_markup(buffer, position, end) if skip_markup_before else -1
+        if markup == -1:
+            return buffer.find(b">", end) + 1 or -1
+        position = skip_markup(buffer, markup)
+        if position == -1:
+            return -1
+
+
+def iter_record_elements(buffer, position=0):
+    """yields (start, end) for each complete record element in `buffer` (found with `bytes.find`, much faster than
+    matching whole records with a regex), passing over any comments, CDATA sections and processing instructions"""
+    while True:
+        start_tag = RECORD_START_TAG.search(buffer, position)
+        if start_tag is None:
+            return
+        end_tag = b"</" + start_tag.group(1)
+        end = start_tag.end() if start_tag.group().endswith(b"/>") else find_end_tag(buffer, start_tag.end(), end_tag)
+        if end == -1:
+            return  # the record carries on past the end of the buffer
+
+        # rarely, there's markup that could hide a record's tags: look again, more carefully
+        markup = find_markup(buffer, position, end)
+        if markup != -1 and markup < start_tag.start():
+            # (the start tag may be inside it, e.g. a commented-out record)
+            position = skip_markup(buffer, markup)
+            if position == -1:
+                return
+            continue
+        if markup != -1 and end != start_tag.end():
+            end = find_end_tag(buffer, start_tag.end(), end_tag, skip_markup_before=True)
+            if end == -1:
+                return
+        yield start_tag.start(), end
+        position = end
+
+
+def iter_marcxml_chunks(source, chunk_size, block_size=DEFAULT_BLOCK_SIZE):
+    """iter_marcxml_chunks(source, chunk_size, block_size):
+    slices the record elements out of a MARCXML file as raw bytes, without parsing them
+    Requires source - a file name or a binary file object
+    yields documents of up to `chunk_size` records each: the file's prolog and root start tag (so its encoding and
+      namespace prefixes still apply), the records, and the root's end tag
+    """
+    with open(source, 'rb') if isinstance(source, str) else nullcontext(source) as source_file:
+        buffer = b""
+        header = end_tag = None
+        records = []
+        while True:
+            block = source_file.read(block_size)
+            buffer += block
+            position = 0
+            if header is None:
+                root = ROOT_START_TAG.match(buffer, PROLOG.match(buffer).end())
+                if root is None and block:
+                    continue
+                if root is None:
+                    return
+                header, end_tag = buffer[:root.end()], b"</" + root.group(1) + b">"
+                position = root.start()  # the root may itself be a (lone) record
+
+            for start, end in iter_record_elements(buffer, position):
+                records.append(buffer[start:end])
+                position = end
+                if len(records) == chunk_size:
+                    yield header + b"".join(records) + end_tag
+                    records = []
+            buffer = buffer[position:]  # keep whatever record the block ended part-way through
+            if not block:
+                break
+        if records:
+            yield header + b"".join(records) + end_tag
+
+
+def iter_serialized_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record if isinstance(record, bytes) else etree.tostring(record, encoding='utf-8'))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_pipeline(records, transforms, processes=None, chunk_size=DEFAULT_CHUNK_SIZE, as_bytes=False):
+    """run_pipeline(records, transforms, processes, chunk_size, as_bytes):
+    applies a chain of record functions to every record on a pool of `processes` processes (one per core by default)
+    Requires:
+        records - any iterable of <record> elements or their MARCXML bytes, e.g. `iter_marcxml_records(path)`
+        transforms - functions taking a <record> element and returning the (changed or new) element to pass on, or None
+          to drop the record. They're sent to the worker processes, so they must be picklable: module-level functions,
+          or `functools.partial`s of them (not lambdas)
+    Only a couple of chunks per process are in flight at once, so `records` can be a stream of any length
+    Yields the transformed records in their original order, as elements (or as MARCXML bytes with `as_bytes`)
+    """
+    for record_xml in run_chunks(iter_serialized_chunks(records, chunk_size), transform_chunk, transforms, processes):
+        yield record_xml if as_bytes else etree.fromstring(record_xml)
+
+
+def run_chunks(chunks, worker, transforms, processes=None):
+    """hands each chunk to `worker(chunk)` on a pool of processes set up with `transforms`, keeping only a couple of
+    chunks per process in flight. Yields the serialized records the workers return, in order, leaving out dropped ones
+    """
+    processes = processes if processes else cpu_count()
+    transforms = tuple(transforms)
+    max_pending = processes * 2
+
+    with Pool(processes, initializer=init_worker, initargs=(transforms,)) as pool:
+        pending = deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                pending.append(pool.apply_async(worker, (chunk,)))
+
+            if not pending:
+                return
+
+            # always wait on the oldest chunk, so results come back in the order the records went in
+            for record_xml in pending.popleft().get():
+                if record_xml is not None:
+                    yield record_xml
+
+
+def transform_marcxml_file_in_parallel(source, target, transforms, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """transform_marcxml_file_in_parallel(source, target, transforms, processes, chunk_size):
+    the multi-process version of `record_utils.transform_marcxml_file`: streams every record in a MARCXML file through
+      `transforms` (see `run_pipeline`) and writes the results, in order, to a new MARCXML collection. The records are
+      parsed in the worker processes, leaving this one only to slice them out of the file and write the results
+    returns the number of records written
+    """
+    count = 0
+    with open(target, 'wb') as output:
+        output.write("<?xml version='1.0' encoding='utf-8'?>\n<collection xmlns=\"{}\">".format(MARC_NAMESPACE)
+                     .encode('utf-8'))
+        # the serialized records are written as they are, skipping a parse and re-serialize in this process
+        for record_xml in run_chunks(iter_marcxml_chunks(source, chunk_size), transform_collection_chunk, transforms,
+                                     processes):
+            output.write(record_xml)
+            count += 1
+        output.write(b"</collection>")
+    return count
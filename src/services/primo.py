@@ -4,9 +4,72 @@
 ## September 2019
 """
 
+from collections import namedtuple
+from http.client import HTTPException
+from json import loads
 from urllib.request import Request, urlopen
 from urllib.parse import quote_plus
 
+from .concurrency import fetch_concurrently, RequestPacer, DEFAULT_MAX_WORKERS
+from .logs import get_logger
+from .rate_limit import DEFAULT_REQUESTS_PER_SECOND
+from .transport import get_default_transport
+
+PRIMO_SEARCH_URL = 'http://bu-primo.hosted.exlibrisgroup.com/PrimoWebServices/xservice/search/brief'
+DEFAULT_BULK_SIZE = 50
+DEFAULT_MAX_RESULTS = 200
+
+logger = get_logger("primo.py")
+
+# the fields of a primo result we use when matching titles
+PrimoRecord = namedtuple("PrimoRecord", ["sourceid", "delcategory", "recordid", "title", "creators", "creationdate"])
+
+
+class PrimoSearchError(Exception):
+    pass
+
+
+def get_docset(json_str):
+    return json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']
+
+
+def get_total_hits(json_str):
+    return get_docset(json_str)['@TOTALHITS']
+
+
+def get_primo_docs(json_str):
+    """the result docs of a search as a list (primo returns a lone doc as an object rather than a list)"""
+    docs = get_docset(json_str).get('DOC', [])
+    return docs if isinstance(docs, list) else [docs]
+
+
+def get_primo_doc_fields(doc):
+    """-> (sourceid, delcategory, recordid, title, creators, creationdate) exactly as primo returned them"""
+    record = doc['PrimoNMBib']['record']
+    search = record['search']
+    recordid = search['addsrcrecordid'] if 'addsrcrecordid' in search else search['recordid']
+    return (record['control']['sourceid'], record['delivery']['delcategory'], recordid, search['title'],
+            search['creatorcontrib'], search['creationdate'])
+
+
+def first_value(value):
+    return value[0] if isinstance(value, list) else value
+
+
+def parse_primo_doc(doc):
+    """a compact `PrimoRecord` for a result doc (missing fields are `None`, creators are always a tuple)"""
+    record = doc['PrimoNMBib']['record']
+    control, delivery, search = record.get('control', {}), record.get('delivery', {}), record.get('search', {})
+    creators = search.get('creatorcontrib', ())
+    return PrimoRecord(
+        first_value(control.get('sourceid')),
+        first_value(delivery.get('delcategory')),
+        first_value(search.get('addsrcrecordid', search.get('recordid'))),
+        first_value(search.get('title')),
+        tuple(creators) if isinstance(creators, list) else (creators,),
+        first_value(search.get('creationdate'))
+    )
+
 
 class Primo:
     '''
@@ -17,7 +80,7 @@ class Primo:
         pass
         return
 
-    def build_url(search_string, bulkSize):
+    def build_url(search_string, bulkSize, indx=1):
         '''
         Function: build_url
 
@@ -31,11 +94,12 @@ class Primo:
 
          Parameter:  search_string
                      This is typically passed from a list of search strings
+                     indx (optional) the position of the first result to return, for paging through results
 
         '''
-        url_base = 'http://bu-primo.hosted.exlibrisgroup.com/PrimoWebServices/xservice/search/brief'
+        url_base = PRIMO_SEARCH_URL
         query_Params1 = '?institution=BOSU&query=any,contains,'
-        query_Params2 = '&indx=1&bulkSize=' + bulkSize
+        query_Params2 = '&indx=' + str(indx) + '&bulkSize=' + str(bulkSize)
         query_Params3 = '&loc=local,scope:(ALMA_BOSU1)&loc=adaptor,primo_central_multiple_fe&onCampus=true&json=true'
         url = url_base + query_Params1 + quote_plus(search_string.replace('  ', ' ')) + query_Params2 + query_Params3
         return (url)
@@ -52,76 +116,72 @@ class Primo:
 
     def get_primo_json(json_str):
         '''get_primo_json parses the primo result string'''
-        total_hits = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['@TOTALHITS']
+        total_hits = get_total_hits(json_str)
         if total_hits == '0':
             return (total_hits)
             # return('none')
-        if int(total_hits) == 1:
-            # print(total_hits)
-            num_recs = 1
-            sourceID = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC']['PrimoNMBib']['record']['control'][
-                'sourceid']
-            delCat = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC']['PrimoNMBib']['record']['delivery'][
-                'delcategory']
-            try:
-                recordid = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC']['PrimoNMBib']['record']['search'][
-                    'addsrcrecordid']  # .keys()
-            except KeyError as e:
-                recordid = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC']['PrimoNMBib']['record']['search'][
-                    'recordid']  # .keys()
-            #        almaMMS_ID = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC']['PrimoNMBib']['record']['search']['addsrcrecordid'] #.keys()
-            title = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC']['PrimoNMBib']['record']['search'][
-                'title']
-            creationDate = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC']['PrimoNMBib']['record']['search'][
-                'creationdate']  # .keys()
-            creators = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC']['PrimoNMBib']['record']['search'][
-                'creatorcontrib']
-            # print(num_recs)
-            # print(sourceID)
-            # print(delCat)
-            # print(recordid)
-            # print(title)
-            # print(creators)
-            # print(creationDate)
-            # print()
-        else:
-            try:
-                num_recs = len(json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC'])
-            except Exception as e:
-                print(e)
-                print(total_hits)
-
-            for i in range(0, num_recs):
-
-                sourceID = \
-                json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC'][i]['PrimoNMBib']['record']['control'][
-                    'sourceid']
-                delCat = \
-                json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC'][i]['PrimoNMBib']['record']['delivery'][
-                    'delcategory']
-                try:
-                    recordid = \
-                    json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC'][i]['PrimoNMBib']['record']['search'][
-                        'addsrcrecordid']  # .keys()
-                except KeyError as e:
-                    recordid = \
-                    json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC'][i]['PrimoNMBib']['record']['search'][
-                        'recordid']  # .keys()
-
-                title = json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC'][i]['PrimoNMBib']['record']['search'][
-                    'title']
-                creationDate = \
-                json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC'][i]['PrimoNMBib']['record']['search'][
-                    'creationdate']  # .keys()
-                creators = \
-                json_str['SEGMENTS']['JAGROOT']['RESULT']['DOCSET']['DOC'][i]['PrimoNMBib']['record']['search'][
-                    'creatorcontrib']
-                # print(num_recs)
-                # print(sourceID)
-                # print(delCat)
-                # print(almaMMS_ID)
-                # print(title)
-                # print(creators)
-                # print(creationDate)
-                # print()
+
+        docs = get_primo_docs(json_str)
+        num_recs = len(docs)
+        for doc in docs:
+            sourceID, delCat, recordid, title, creators, creationDate = get_primo_doc_fields(doc)
         return (num_recs, sourceID, delCat, recordid, title, creators, creationDate)
+
+    @staticmethod
+    def fetch_primo_json(url, transport=None, pacer=None):
+        '''fetch_primo_json executes the search over a pooled connection and returns the decoded JSON
+           (unlike `get_primo_results`, a failed search raises a `PrimoSearchError` rather than returning nothing)
+           Given a `RequestPacer`, waits on it before sending the request'''
+        transport = transport if transport else get_default_transport()
+        if pacer is not None:
+            pacer.wait()
+        try:
+            response = transport.request('GET', url)
+        except (OSError, HTTPException) as e:
+            raise PrimoSearchError("unable to search primo: {}".format(e))
+        if response.status >= 400:
+            raise PrimoSearchError("primo responded '{} {}'".format(response.status, response.reason))
+        return loads(response.body)
+
+    @staticmethod
+    def search_primo(search_string, bulk_size=DEFAULT_BULK_SIZE, max_results=DEFAULT_MAX_RESULTS, transport=None,
+                     pacer=None):
+        '''search_primo pages through the results for one search string (`bulk_size` at a time, up to `max_results`)
+           and returns them as a list of `PrimoRecord`s (every page waits its turn on `pacer`, if given)'''
+        records = []
+        indx = 1
+        while True:
+            json_str = Primo.fetch_primo_json(Primo.build_url(search_string, bulk_size, indx), transport, pacer)
+            docs = get_primo_docs(json_str)
+            records.extend(parse_primo_doc(doc) for doc in docs)
+
+            total_hits = int(get_total_hits(json_str))
+            indx += len(docs)
+            if not docs or indx > total_hits or (max_results and len(records) >= max_results):
+                return records[:max_results] if max_results else records
+
+    @staticmethod
+    def search_many(search_strings, bulk_size=DEFAULT_BULK_SIZE, max_results=DEFAULT_MAX_RESULTS,
+                    max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, transport=None):
+        '''search_many runs many searches concurrently, yielding a (search_string, PrimoRecord) pair for each doc found
+           (or a (search_string, PrimoSearchError) pair for each search that failed) as each search completes
+           `requests_per_second` paces every request sent, including those for the later pages of a search'''
+        pacer = RequestPacer(requests_per_second)
+
+        def search(search_string):
+            return Primo.search_primo(search_string, bulk_size, max_results, transport, pacer)
+
+        for search_string, records in fetch_concurrently(search, search_strings, max_workers, None):
+            if isinstance(records, Exception):
+                yield (search_string, records)
+                continue
+            for record in records:
+                yield (search_string, record)
+
+
+def __getattr__(name):
+    # `AsyncPrimo` lives in its own module so that importing this one doesn't import asyncio (see async_primo.py)
+    if name == "AsyncPrimo":
+        from .async_primo import AsyncPrimo
+        return AsyncPrimo
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
@@ -0,0 +1,216 @@
+"""
+## memoized Primo title matching: search strings are normalized so near-identical ones share a single search, results
+##   are remembered (in memory, and optionally on disk), and an inverted index of every record retrieved so far
+##   answers lookups for titles it already knows about without going back to Primo
+## (the normalized string is only ever a memo key: Primo is always sent the search string as it was given)
+"""
+
+from collections import OrderedDict
+from json import dumps, loads
+from os import makedirs
+from os.path import dirname, join
+from re import compile as compile_regex
+from sqlite3 import connect
+from threading import Lock
+from time import time
+from unicodedata import combining, normalize
+
+from . import OUTPUT_DIRECTORY
+from .concurrency import fetch_concurrently, RequestPacer, DEFAULT_MAX_WORKERS
+from .primo import Primo, PrimoRecord, DEFAULT_BULK_SIZE, DEFAULT_MAX_RESULTS
+from .rate_limit import DEFAULT_REQUESTS_PER_SECOND
+
+DEFAULT_MAX_CACHED_SEARCHES = 10000
+DEFAULT_STORE_PATH = join(OUTPUT_DIRECTORY, "cache", "primo_searches.sqlite")
+
+NON_WORD_CHARACTERS = compile_regex(r"[^\w\s]+")
+
+
+def normalize_search_string(search_string):
+    """fold case, accents, punctuation and runs of whitespace: 'The  Odyssey : a Poem.' -> 'the odyssey a poem'"""
+    decomposed = normalize("NFKD", search_string.casefold())
+    without_accents = "".join(character for character in decomposed if not combining(character))
+    return " ".join(NON_WORD_CHARACTERS.sub(" ", without_accents).split())
+
+
+class PrimoRecordIndex:
+    """an inverted index (normalized title word -> records) over every Primo record retrieved so far"""
+
+    def __init__(self):
+        self.records = {}
+        self.normalized_titles = {}
+        self.records_by_word = {}
+        self._lock = Lock()
+
+    def add(self, record):
+        if record.recordid is None or record.title is None:
+            return
+        normalized_title = normalize_search_string(record.title)
+        with self._lock:
+            self.records[record.recordid] = record
+            self.normalized_titles[record.recordid] = normalized_title
+            for word in set(normalized_title.split()):
+                self.records_by_word.setdefault(word, set()).add(record.recordid)
+
+    def find_titles(self, normalized_search, match_prefix=False):
+        """records whose (normalized) title is the (normalized) search or, with `match_prefix`, merely starts with it
+        (e.g. a title without its subtitle - but also 'war' for 'war and peace')"""
+        words = normalized_search.split()
+        if not words:
+            return []
+        with self._lock:
+            candidates = set.intersection(*(self.records_by_word.get(word, set()) for word in words))
+            return [self.records[recordid] for recordid in sorted(candidates)
+                    if self.normalized_titles[recordid] == normalized_search
+                    or (match_prefix and self.normalized_titles[recordid].startswith(normalized_search))]
+
+    def __len__(self):
+        return len(self.records)
+
+
+def load_primo_record(fields):
+    """a `PrimoRecord` from its JSON array (which holds the creators as a list rather than a tuple)"""
+    record = PrimoRecord(*fields)
+    return record._replace(creators=tuple(record.creators))
+
+
+class PrimoSearchStore:
+    """results of past searches, kept in a SQLite file so they survive between runs"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        makedirs(dirname(path), exist_ok=True)
+        self._lock = Lock()
+        self._db = connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS searches (search TEXT PRIMARY KEY, records TEXT NOT NULL, "
+                         "stored_at REAL NOT NULL)")
+
+    def get(self, normalized_search):
+        with self._lock:
+            row = self._db.execute("SELECT records FROM searches WHERE search = ?", (normalized_search,)).fetchone()
+        return [load_primo_record(fields) for fields in loads(row[0])] if row else None
+
+    def put(self, normalized_search, records):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO searches (search, records, stored_at) VALUES (?, ?, ?)",
+                             (normalized_search, dumps(records), time()))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class PrimoMatcher:
+    """PrimoMatcher answers title searches from memory, disk or its index when it can, and from Primo when it can't"""
+
+    def __init__(self, max_cached_searches=DEFAULT_MAX_CACHED_SEARCHES, store=None, use_index=True,
+                 bulk_size=DEFAULT_BULK_SIZE, max_results=DEFAULT_MAX_RESULTS, match_title_prefixes=False):
+        self.max_cached_searches = max_cached_searches
+        self.store = store  # an optional `PrimoSearchStore`
+        self.index = PrimoRecordIndex() if use_index else None
+        self.match_title_prefixes = match_title_prefixes  # let the index answer with titles that only start with a search
+        self.bulk_size = bulk_size
+        self.max_results = max_results
+        self._searches = OrderedDict()  # normalized search -> records, least recently used first
+        self._lock = Lock()
+
+        # counters
+        self.lookups = 0
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.index_hits = 0
+        self.primo_searches = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _remember(self, normalized_search, records):
+        with self._lock:
+            self._searches[normalized_search] = records
+            self._searches.move_to_end(normalized_search)
+            while len(self._searches) > self.max_cached_searches:
+                self._searches.popitem(last=False)
+        if self.index is not None:
+            for record in records:
+                self.index.add(record)
+
+    def find_locally(self, normalized_search):
+        """the records for a search if they're known without asking Primo (`None` otherwise)"""
+        with self._lock:
+            records = self._searches.get(normalized_search)
+            if records is not None:
+                self._searches.move_to_end(normalized_search)
+                self.memory_hits += 1
+                return records
+
+        if self.store is not None:
+            records = self.store.get(normalized_search)
+            if records is not None:
+                self._count("store_hits")
+                self._remember(normalized_search, records)
+                return records
+
+        if self.index is not None:
+            records = self.index.find_titles(normalized_search, self.match_title_prefixes)
+            if records:
+                self._count("index_hits")
+                return records
+        return None
+
+    def search_primo(self, search_string, normalized_search=None, pacer=None):
+        """search Primo for the search string as given, remembering the results under its normalized form
+        (every request for a page of results waits its turn on `pacer`, if given)"""
+        normalized_search = normalized_search or normalize_search_string(search_string)
+        self._count("primo_searches")
+        records = Primo.search_primo(search_string, self.bulk_size, self.max_results, pacer=pacer)
+        self._remember(normalized_search, records)
+        if self.store is not None:
+            self.store.put(normalized_search, records)
+        return records
+
+    def search(self, search_string):
+        """the `PrimoRecord`s matching a search string"""
+        self._count("lookups")
+        normalized_search = normalize_search_string(search_string)
+        records = self.find_locally(normalized_search)
+        return records if records is not None else self.search_primo(search_string, normalized_search)
+
+    def search_many(self, search_strings, max_workers=DEFAULT_MAX_WORKERS,
+                    requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+        """yields (search_string, records) pairs, answering what it can locally and sending each distinct remaining
+        search to Primo once (concurrently). A failed search yields its `PrimoSearchError` in place of the records"""
+        waiting = OrderedDict()  # normalized search -> the original search strings waiting on it
+        for search_string in search_strings:
+            self._count("lookups")
+            normalized_search = normalize_search_string(search_string)
+            if normalized_search in waiting:
+                self._count("memory_hits")
+                waiting[normalized_search].append(search_string)
+                continue
+            records = self.find_locally(normalized_search)
+            if records is not None:
+                yield (search_string, records)
+            else:
+                waiting[normalized_search] = [search_string]
+
+        pacer = RequestPacer(requests_per_second)  # paces each page requested, not just each search
+
+        def search_primo(normalized_search):
+            return self.search_primo(waiting[normalized_search][0], normalized_search, pacer)  # as first asked for
+
+        for normalized_search, records in fetch_concurrently(search_primo, list(waiting), max_workers, None):
+            for search_string in waiting[normalized_search]:
+                yield (search_string, records)
+
+    def stats(self):
+        with self._lock:
+            local_hits = self.memory_hits + self.store_hits + self.index_hits
+            return {
+                "lookups": self.lookups,
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "index_hits": self.index_hits,
+                "primo_searches": self.primo_searches,
+                "indexed_records": len(self.index) if self.index is not None else 0,
+                "hit_ratio": round(local_hits / self.lookups, 3) if self.lookups else 0.0
+            }
@@ -0,0 +1,200 @@
+"""
+## client-side rate limiting and retry/backoff for the ExLibris APIs
+## one token bucket is shared by every `Service` using the same API key, so concurrent jobs can't trip the limit together
+"""
+
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+from random import uniform
+from threading import Lock
+from time import monotonic, sleep
+
+from . import HTTP_TOO_MANY_REQUESTS
+from .transport import is_idempotent
+
+# Alma allows 25 API calls per second per institution; stay safely beneath that by default
+DEFAULT_REQUESTS_PER_SECOND = 20
+DEFAULT_DAILY_QUOTA = None  # no client-side daily budget unless one is configured
+
+# statuses worth retrying (after waiting), and how to wait between retries. Apart from 429 (the request was turned
+#   away unprocessed), these are only retried for idempotent methods: a POST that failed may still have been acted on
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 1.0  # seconds; doubled after every attempt
+DEFAULT_MAX_BACKOFF = 120
+
+# the header Alma uses to report how many calls are left in today's quota
+QUOTA_REMAINING_HEADER = "X-Exl-Api-Remaining"
+
+# after a 429 the allowed rate is halved, then recovers by this fraction of the configured rate per successful call
+RATE_RECOVERY_STEP = 0.05
+MINIMUM_RATE_FRACTION = 0.1
+
+
+class QuotaExceededError(Exception):
+    """raised when the client-side daily quota budget for an API key has been spent"""
+    pass
+
+
+class RateLimiter:
+    """RateLimiter is a thread-safe token bucket with an optional daily quota budget and usage counters"""
+
+    def __init__(self, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, daily_quota=DEFAULT_DAILY_QUOTA):
+        self.requests_per_second = requests_per_second
+        self.daily_quota = daily_quota
+        self.current_rate = requests_per_second
+        self.capacity = max(1.0, float(requests_per_second))
+        self._tokens = self.capacity
+        self._last_refill = monotonic()
+        self._paused_until = 0.0
+        self._quota_day = date.today()
+        self._lock = Lock()
+
+        # counters
+        self.requests = 0
+        self.throttled_waits = 0
+        self.throttled_seconds = 0.0
+        self.retries = 0
+        self.quota_used = 0
+        self.server_quota_remaining = None
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.current_rate)
+        self._last_refill = now
+
+    def _reset_quota_if_new_day(self):
+        today = date.today()
+        if today != self._quota_day:
+            self._quota_day = today
+            self.quota_used = 0
+
+    def acquire(self):
+        """block until a request may be sent, then take a token (raising `QuotaExceededError` if the budget is spent)"""
+        waited = 0.0
+        delay = self.try_acquire(waited)
+        while delay:
+            sleep(delay)
+            waited += delay
+            delay = self.try_acquire(waited)
+
+    def try_acquire(self, waited=0.0):
+        """take a token if one is available and return 0, otherwise return how many seconds to wait before trying again
+        (`waited` is how long the caller has waited so far, for the counters)"""
+        with self._lock:
+            self._reset_quota_if_new_day()
+            if self.daily_quota is not None and self.quota_used >= self.daily_quota:
+                raise QuotaExceededError("daily quota of {} requests has been used".format(self.daily_quota))
+
+            now = monotonic()
+            self._refill(now)
+            if now >= self._paused_until and self._tokens >= 1:
+                self._tokens -= 1
+                self.requests += 1
+                self.quota_used += 1
+                if waited:
+                    self.throttled_waits += 1
+                    self.throttled_seconds += waited
+                return 0
+            return max(self._paused_until - now, (1 - self._tokens) / self.current_rate)
+
+    def record_success(self):
+        """let the allowed rate creep back up towards the configured rate after a throttled response"""
+        with self._lock:
+            if self.current_rate < self.requests_per_second:
+                step = self.requests_per_second * RATE_RECOVERY_STEP
+                self.current_rate = min(self.requests_per_second, self.current_rate + step)
+
+    def record_throttled(self, pause_seconds):
+        """the server said 'Too Many Requests': halve the allowed rate and hold every caller for `pause_seconds`"""
+        with self._lock:
+            floor = self.requests_per_second * MINIMUM_RATE_FRACTION
+            self.current_rate = max(floor, self.current_rate / 2)
+            self._paused_until = max(self._paused_until, monotonic() + pause_seconds)
+            self._tokens = 0
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def update_from_headers(self, headers):
+        """keep track of the remaining daily quota reported by the server (if it reports one)"""
+        remaining = headers.get(QUOTA_REMAINING_HEADER) if headers else None
+        if remaining is not None and remaining.strip().isdigit():
+            with self._lock:
+                self.server_quota_remaining = int(remaining)
+
+    @property
+    def quota_remaining(self):
+        """the smaller of the client-side budget left and what the server last reported (None if neither is known)"""
+        candidates = []
+        if self.daily_quota is not None:
+            candidates.append(max(0, self.daily_quota - self.quota_used))
+        if self.server_quota_remaining is not None:
+            candidates.append(self.server_quota_remaining)
+        return min(candidates) if candidates else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled_waits": self.throttled_waits,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "retries": self.retries,
+                "current_rate": self.current_rate,
+                "quota_used": self.quota_used,
+                "quota_remaining": self.quota_remaining
+            }
+
+
+class RetryPolicy:
+    """RetryPolicy decides whether (and how long to wait before) a failed request is sent again"""
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 max_backoff=DEFAULT_MAX_BACKOFF, retry_statuses=RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+
+    def should_retry(self, status, attempt, method="GET"):
+        if status not in self.retry_statuses or attempt >= self.max_retries:
+            return False
+        return status == HTTP_TOO_MANY_REQUESTS or is_idempotent(method)
+
+    def get_delay(self, attempt, retry_after=None):
+        """exponential backoff with 'full jitter', unless the server told us how long to wait via 'Retry-After'"""
+        requested_wait = parse_retry_after(retry_after)
+        if requested_wait is not None:
+            return min(requested_wait, self.max_backoff)
+        return uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+
+def parse_retry_after(value):
+    """convert a 'Retry-After' header (either a number of seconds or an HTTP date) into seconds to wait"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+# one limiter per API key, shared across every service (and thread) using that key
+_rate_limiters = {}
+_rate_limiters_lock = Lock()
+
+
+def get_rate_limiter(api_key, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, daily_quota=DEFAULT_DAILY_QUOTA):
+    """return the `RateLimiter` shared by everything using `api_key` (the rate/quota only apply when it's first created)"""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(api_key)
+        if limiter is None:
+            limiter = RateLimiter(requests_per_second, daily_quota)
+            _rate_limiters[api_key] = limiter
+        return limiter
@@ -1,27 +1,67 @@
-from lxml import etree
+from collections import Counter
+from copy import deepcopy
+from hashlib import sha256
+
+from .lazy import lazy_import
+
+etree = lazy_import("lxml.etree")
+
+MARC_NAMESPACE = 'http://www.loc.gov/MARC21/slim'
+MARC_RECORD_TAGS = ('{%s}record' % MARC_NAMESPACE, 'record')
+
+# ISO 2709 ("binary marc") delimiters and layout
+SUBFIELD_DELIMITER = b'\x1f'
+FIELD_TERMINATOR = b'\x1e'
+RECORD_TERMINATOR = b'\x1d'
+LEADER_LENGTH = 24
+DIRECTORY_ENTRY_LENGTH = 12
+MAX_FIELD_LENGTH = 9999  # the directory has four digits for a field's length...
+MAX_RECORD_LENGTH = 99999  # ...and the leader five for the record's
+DEFAULT_LEADER = '00000nam a2200000   4500'
+ISO2709_BUFFER_SIZE = 1024 * 1024
+
+
+def get_marc_record(bib):
+    """get_marc_record():
+    finds the marc record in a bib record from the Alma API (or passes a bare marc record straight through).
+    Require:
+        bib - a <bib> element wrapping a <record>, or a <record> itself (in the MARC21 slim namespace or none)
+    returns the <record> element, or None if there isn't one
+    """
+    if etree.QName(bib).localname == 'record':
+        return bib
+    return bib.find('{*}record')
+
+
+def marc_sort_key(element):
+    """the key a field sorts by: its tag, with the leader first (as '000') and anything untagged last"""
+    tag = element.get('tag')
+    if tag is not None:
+        return tag
+    return '000' if isinstance(element.tag, str) and element.tag.endswith('leader') else '~'
 
 
 def sort_marc_tags(record):
     """sort_marc_tags(record):
-    sorts the marc tags in a record in numerical order.
+    sorts the marc tags in a record in numerical order, in place: the leader comes first and fields with the same tag
+      keep their order. The record's namespace and attributes (and anything without a tag) are left as they were.
     Requires:
-        marc_xml bib record
-    Returns the sorted marc_xml bib record
+        marc_xml bib record (a <record>, or a <bib> wrapping one)
+    Returns the (same, now sorted) marc_xml bib record
     """
-    data = []
-    for elem in record.getchildren():
-        if 'leader' in elem.tag:  # == 'http://www.loc.gov/MARC21/slim}leader':
-            data.append(('000', elem))
-        else:
-            attrib = elem.attrib
-            for k, v in attrib.items():
-                if k == 'tag':
-                    data.append((v, elem))
-    data = sorted(data, key=lambda x: x[0])
-    new_rec = etree.Element('record')
-    for i in data:
-        new_rec.append(i[1])
-    return new_rec
+    marc_record = get_marc_record(record)
+    if marc_record is not None:
+        marc_record[:] = sorted(marc_record, key=marc_sort_key)
+    return record
+
+
+def sort_marc_tags_in_batch(records):
+    """sort_marc_tags_in_batch(records):
+    sorts each record in a stream (e.g. from `iter_marcxml_records`) as it passes through
+    Yields the sorted records
+    """
+    for record in records:
+        yield sort_marc_tags(record)
 
 
 def make_field(d, subfields):
@@ -55,10 +95,15 @@ def get_marc_fields(tag, bib):
     retrieves all instances of a marc tag from a bib record.
     Require:
         tag - as a string (ex: '008', '020', '650')
-        bib - the bibliographic record as an xml object
+        bib - the bibliographic record as an xml object (or a `MarcRecordIndex` of it, for many lookups on one record)
     returns a list of xml elements containing the marc tag
     """
-    fields = bib.findall("*/[@tag='" + tag + "']")
+    if isinstance(bib, MarcRecordIndex):
+        return bib.get_fields(tag)
+    record = get_marc_record(bib)
+    if record is None:
+        return []
+    fields = record.findall("*[@tag='" + tag + "']")
     return fields
 
 
@@ -67,8 +112,482 @@ def has_marc_field(tag, bib):
     Verifies the presence of a marc field.
     Require:
         tag - as a string (ex: '008', '020', '650')
-        bib - the bibliographic record as an xml object
+        bib - the bibliographic record as an xml object (or a `MarcRecordIndex` of it, for many lookups on one record)
     returns True if the tag exists, False if the tag does not exist
     """
-    field = bib.find("*/[@tag='" + tag + "']")
-    return type(field) == etree.Element
+    if isinstance(bib, MarcRecordIndex):
+        return bib.has_field(tag)
+    record = get_marc_record(bib)
+    return record is not None and record.find("*[@tag='" + tag + "']") is not None
+
+
+class MarcRecordIndex:
+    """MarcRecordIndex indexes a marc record's fields by tag (and their subfield values by tag and code) in a single
+    pass, so that checking many tags on one record doesn't mean a fresh scan of the record for every tag.
+    Add and remove fields through the index to keep it current; after changing the record any other way, call
+    `invalidate()` and the index is rebuilt on the next lookup.
+    Require:
+        bib - a <bib> element wrapping a <record>, or a <record> itself
+    """
+
+    __slots__ = ('record', '_fields_by_tag', '_values_by_tag_and_code')
+
+    def __init__(self, bib):
+        self.record = get_marc_record(bib)
+        if self.record is None:
+            raise ValueError("no marc record found in <{}>".format(etree.QName(bib).localname))
+        self._fields_by_tag = None
+        self._values_by_tag_and_code = None
+
+    def invalidate(self):
+        self._fields_by_tag = None
+        self._values_by_tag_and_code = None
+
+    def _build(self):
+        fields_by_tag = {}
+        values_by_tag_and_code = {}
+        for field in self.record:
+            tag = field.get('tag')
+            if tag is None:
+                if etree.QName(field).localname == 'leader':
+                    fields_by_tag.setdefault('000', []).append(field)
+                continue
+            fields_by_tag.setdefault(tag, []).append(field)
+            for subfield in field:
+                values_by_tag_and_code.setdefault((tag, subfield.get('code')), []).append(subfield.text)
+        self._fields_by_tag = fields_by_tag
+        self._values_by_tag_and_code = values_by_tag_and_code
+
+    @property
+    def fields_by_tag(self):
+        if self._fields_by_tag is None:
+            self._build()
+        return self._fields_by_tag
+
+    @property
+    def values_by_tag_and_code(self):
+        if self._values_by_tag_and_code is None:
+            self._build()
+        return self._values_by_tag_and_code
+
+    def get_fields(self, tag):
+        """the same list of elements as `get_marc_fields(tag, bib)` (the leader is tag '000')"""
+        return list(self.fields_by_tag.get(tag, ()))
+
+    def has_field(self, tag):
+        return tag in self.fields_by_tag
+
+    def get_subfield_values(self, tag, code):
+        """the text of every $code subfield in every `tag` field, in record order"""
+        return list(self.values_by_tag_and_code.get((tag, code), ()))
+
+    def get_first_subfield_value(self, tag, code, default=None):
+        values = self.values_by_tag_and_code.get((tag, code))
+        return values[0] if values else default
+
+    def tags(self):
+        return list(self.fields_by_tag)
+
+    def add_field(self, field):
+        """append a field (e.g. from `make_field`) to the record, keeping the index current"""
+        self.record.append(field)
+        if self._fields_by_tag is not None:
+            tag = field.get('tag')
+            self._fields_by_tag.setdefault(tag, []).append(field)
+            for subfield in field:
+                self._values_by_tag_and_code.setdefault((tag, subfield.get('code')), []).append(subfield.text)
+        return field
+
+    def remove_field(self, field):
+        self.record.remove(field)
+        self.invalidate()
+
+    def remove_fields(self, tag):
+        """remove every `tag` field from the record -> the number removed"""
+        fields = self.fields_by_tag.get(tag, ())
+        for field in fields:
+            self.record.remove(field)
+        self.invalidate()
+        return len(fields)
+
+
+class ControlField:
+    """a compact control field (001-009): just its tag and value"""
+
+    __slots__ = ('tag', 'value')
+
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, ControlField) and (self.tag, self.value) == (other.tag, other.value)
+
+    def __repr__(self):
+        return 'ControlField({!r}, {!r})'.format(self.tag, self.value)
+
+
+class DataField:
+    """a compact data field: its tag, indicators and a list of (code, value) subfield tuples"""
+
+    __slots__ = ('tag', 'ind1', 'ind2', 'subfields')
+
+    def __init__(self, tag, ind1=' ', ind2=' ', subfields=None):
+        self.tag = tag
+        self.ind1 = ind1
+        self.ind2 = ind2
+        self.subfields = subfields if subfields is not None else []
+
+    def get_values(self, code):
+        return [value for subfield_code, value in self.subfields if subfield_code == code]
+
+    def __eq__(self, other):
+        return isinstance(other, DataField) and \
+            (self.tag, self.ind1, self.ind2, self.subfields) == (other.tag, other.ind1, other.ind2, other.subfields)
+
+    def __repr__(self):
+        return 'DataField({!r}, {!r}, {!r}, {!r})'.format(self.tag, self.ind1, self.ind2, self.subfields)
+
+
+class MarcRecord:
+    """MarcRecord is a light-weight marc record (a leader plus a list of `ControlField`s and `DataField`s) for holding
+    many records in memory and transforming them in bulk; convert to and from lxml elements or MARCXML at the edges.
+    Round-trips are lossless for MARCXML: the record's namespace and 'type' attribute are kept, and text is kept
+    exactly as it was (None for an empty element)
+    """
+
+    __slots__ = ('leader', 'fields', 'namespace', 'record_type')
+
+    def __init__(self, leader=None, fields=None, namespace=None, record_type=None):
+        self.leader = leader
+        self.fields = fields if fields is not None else []
+        self.namespace = namespace
+        self.record_type = record_type
+
+    @classmethod
+    def from_element(cls, bib):
+        """from_element():
+        Require:
+            bib - a <bib> element wrapping a <record>, or a <record> itself
+        returns a `MarcRecord` holding the same data
+        """
+        record = get_marc_record(bib)
+        if record is None:
+            raise ValueError("no marc record found in <{}>".format(etree.QName(bib).localname))
+        leader = None
+        fields = []
+        for element in record:
+            name = etree.QName(element).localname
+            if name == 'datafield':
+                fields.append(DataField(element.get('tag'), element.get('ind1', ' '), element.get('ind2', ' '),
+                                        [(subfield.get('code'), subfield.text) for subfield in element]))
+            elif name == 'controlfield':
+                fields.append(ControlField(element.get('tag'), element.text))
+            elif name == 'leader':
+                leader = element.text
+        return cls(leader, fields, etree.QName(record).namespace, record.get('type'))
+
+    @classmethod
+    def from_marcxml(cls, marcxml):
+        return cls.from_element(etree.fromstring(marcxml))
+
+    def to_element(self, namespace=None):
+        """an lxml <record> element holding the same data (in `namespace`, when given, rather than the record's own)"""
+        namespace = namespace if namespace is not None else self.namespace
+        prefix = '{%s}' % namespace if namespace else ''
+        record = etree.Element(prefix + 'record', nsmap={None: namespace} if namespace else None)
+        if self.record_type is not None:
+            record.set('type', self.record_type)
+        if self.leader is not None:
+            etree.SubElement(record, prefix + 'leader').text = self.leader
+        for field in self.fields:
+            if isinstance(field, ControlField):
+                element = etree.SubElement(record, prefix + 'controlfield', tag=field.tag)
+                element.text = field.value
+            else:
+                element = etree.SubElement(record, prefix + 'datafield', tag=field.tag, ind1=field.ind1, ind2=field.ind2)
+                for code, value in field.subfields:
+                    etree.SubElement(element, prefix + 'subfield', code=code).text = value
+        return record
+
+    def to_marcxml(self, namespace=None):
+        return etree.tostring(self.to_element(namespace), encoding='utf-8')
+
+    def get_fields(self, *tags):
+        """every field with one of `tags` (every field, if none are given), in record order"""
+        return [field for field in self.fields if not tags or field.tag in tags]
+
+    def has_field(self, tag):
+        return any(field.tag == tag for field in self.fields)
+
+    def add_field(self, field):
+        self.fields.append(field)
+        return field
+
+    def remove_fields(self, *tags):
+        """remove every field with one of `tags` -> the number removed"""
+        kept = [field for field in self.fields if field.tag not in tags]
+        removed = len(self.fields) - len(kept)
+        self.fields = kept
+        return removed
+
+    def sort_fields(self):
+        """put the fields in tag order (keeping the original order among fields with the same tag)"""
+        self.fields.sort(key=lambda field: field.tag)
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, MarcRecord) and (self.leader, self.fields, self.namespace, self.record_type) == \
+            (other.leader, other.fields, other.namespace, other.record_type)
+
+    def __repr__(self):
+        return 'MarcRecord({!r}, <{} fields>)'.format(self.leader, len(self.fields))
+
+
+def iter_marcxml_records(source, as_model=False):
+    """iter_marcxml_records():
+    streams the records out of a MARCXML file (a <collection>, however large) one at a time, in constant memory.
+    Each record element is cleared once the next one is asked for, so take what you need from it (or pass
+      `as_model=True` and get `MarcRecord`s, which are safe to keep) before moving on.
+    Require:
+        source - a file name or a binary file object
+    yields the <record> elements (in the MARC21 slim namespace or none), or `MarcRecord`s
+    """
+    for _, record in etree.iterparse(source, events=('end',), tag=MARC_RECORD_TAGS):
+        yield MarcRecord.from_element(record) if as_model else record
+        record.clear()
+        while record.getprevious() is not None:
+            del record.getparent()[0]
+
+
+class MarcCollectionWriter:
+    """MarcCollectionWriter writes records into a MARCXML <collection> as they come, without ever building the whole
+    tree (use it as a context manager). `write` takes lxml <record> elements or `MarcRecord`s; the latter are written
+    in the collection's namespace
+    """
+
+    def __init__(self, target, namespace=MARC_NAMESPACE):
+        self.target = target  # a file name or a binary file object
+        self.namespace = namespace
+        self.records_written = 0
+
+    def __enter__(self):
+        self._file = etree.xmlfile(self.target, encoding='utf-8')
+        self._xf = self._file.__enter__()
+        self._xf.write_declaration()
+        self._collection = self._xf.element('{%s}collection' % self.namespace, nsmap={None: self.namespace})
+        self._collection.__enter__()
+        return self
+
+    def write(self, record):
+        self._xf.write(record.to_element(self.namespace) if isinstance(record, MarcRecord) else record)
+        self.records_written += 1
+
+    def __exit__(self, *exc_info):
+        self._collection.__exit__(*exc_info)
+        return self._file.__exit__(*exc_info)
+
+
+def transform_marcxml_file(source, target, *transforms):
+    """transform_marcxml_file():
+    streams every record in a MARCXML file through one or more functions and writes the results to a new file.
+    Require:
+        source, target - file names or binary file objects
+        transforms - functions taking a <record> element and returning the (changed or new) element to pass on,
+          e.g. `sort_marc_tags`; a record is dropped if any of them returns None
+    returns the number of records written
+    """
+    with MarcCollectionWriter(target) as writer:
+        for record in iter_marcxml_records(source):
+            for transform in transforms:
+                record = transform(record)
+                if record is None:
+                    break
+            else:
+                writer.write(record)
+    return writer.records_written
+
+
+def decode_iso2709(data, encoding='utf-8'):
+    """decode_iso2709():
+    parses one binary (ISO 2709) marc record, using the directory's offsets to slice out each field.
+    Require:
+        data - the record's bytes, from its leader up to and including the record terminator
+        encoding - of the field data; Alma exports UTF-8 (MARC-8 isn't supported)
+    returns a `MarcRecord`
+    """
+    leader = data[:LEADER_LENGTH].decode('ascii')
+    base_address = int(leader[12:17])
+    directory_end = data.index(FIELD_TERMINATOR, LEADER_LENGTH)
+    fields = []
+    for entry_start in range(LEADER_LENGTH, directory_end, DIRECTORY_ENTRY_LENGTH):
+        entry = data[entry_start:entry_start + DIRECTORY_ENTRY_LENGTH]
+        tag = entry[:3].decode('ascii')
+        field_length = int(entry[3:7])
+        field_start = base_address + int(entry[7:12])
+        # the field's length includes its terminator
+        field_data = data[field_start:field_start + field_length - 1]
+        if tag < '010' and tag.isdigit():
+            fields.append(ControlField(tag, field_data.decode(encoding)))
+            continue
+        indicators = field_data[:2].decode(encoding).ljust(2)
+        subfields = [(subfield[:1].decode(encoding), subfield[1:].decode(encoding))
+                     for subfield in field_data.split(SUBFIELD_DELIMITER)[1:] if subfield]
+        fields.append(DataField(tag, indicators[0], indicators[1], subfields))
+    return MarcRecord(leader, fields)
+
+
+def encode_iso2709(record, encoding='utf-8'):
+    """encode_iso2709():
+    serializes a record as binary (ISO 2709) marc, recomputing the leader's record length and base address.
+    Require:
+        record - a `MarcRecord`, or a <bib>/<record> element
+    returns the record's bytes (raises a `ValueError` for a field or record too long for the format to describe)
+    """
+    if not isinstance(record, MarcRecord):
+        record = MarcRecord.from_element(record)
+    directory = []
+    field_data = []
+    offset = 0
+    for field in record.fields:
+        if isinstance(field, ControlField):
+            data = (field.value or '').encode(encoding)
+        else:
+            data = (field.ind1 + field.ind2).encode(encoding) + b''.join(
+                SUBFIELD_DELIMITER + (code + (value or '')).encode(encoding) for code, value in field.subfields)
+        data += FIELD_TERMINATOR
+        if len(data) > MAX_FIELD_LENGTH:
+            raise ValueError("field {} is {} bytes long, more than binary marc allows ({})".format(
+                field.tag, len(data), MAX_FIELD_LENGTH))
+        directory.append('{:0>3.3}{:04d}{:05d}'.format(field.tag, len(data), offset).encode('ascii'))
+        field_data.append(data)
+        offset += len(data)
+
+    base_address = LEADER_LENGTH + DIRECTORY_ENTRY_LENGTH * len(directory) + 1
+    record_length = base_address + offset + 1
+    if record_length > MAX_RECORD_LENGTH:
+        raise ValueError("record is {} bytes long, more than binary marc allows ({})".format(
+            record_length, MAX_RECORD_LENGTH))
+    leader = record.leader if record.leader and len(record.leader) == LEADER_LENGTH else DEFAULT_LEADER
+    # positions 9 ('a': unicode), 10-11 (indicator and subfield code counts) and 20-23 (entry map) are fixed
+    leader = '{:05d}{}a22{:05d}{}4500'.format(record_length, leader[5:9], base_address, leader[17:20])
+    return leader.encode('ascii') + b''.join(directory) + FIELD_TERMINATOR + b''.join(field_data) + RECORD_TERMINATOR
+
+
+def iter_iso2709_records(source, as_model=False, encoding='utf-8'):
+    """iter_iso2709_records():
+    streams the records out of a binary (ISO 2709) marc file one at a time, reading each by the length in its leader.
+    Require:
+        source - a file name or a binary file object
+    yields lxml <record> elements (as `get_marc_fields`, `sort_marc_tags` etc. expect), or `MarcRecord`s
+    """
+    marc_file = open(source, 'rb', buffering=ISO2709_BUFFER_SIZE) if isinstance(source, str) else source
+    try:
+        while True:
+            length_digits = marc_file.read(5)
+            if not length_digits.strip(b'\r\n \x00'):
+                return
+            # tolerate line breaks between records, which some tools add
+            length_digits = length_digits.lstrip(b'\r\n')
+            length_digits += marc_file.read(5 - len(length_digits))
+            data = length_digits + marc_file.read(int(length_digits) - 5)
+            if not data.endswith(RECORD_TERMINATOR):
+                raise ValueError("malformed marc record (length {} doesn't end at a record terminator)"
+                                 .format(int(length_digits)))
+            record = decode_iso2709(data, encoding)
+            yield record if as_model else record.to_element()
+    finally:
+        if marc_file is not source:
+            marc_file.close()
+
+
+def write_iso2709_records(records, target, encoding='utf-8'):
+    """write_iso2709_records():
+    writes records (`MarcRecord`s or <bib>/<record> elements) to a binary marc file.
+    Require:
+        target - a file name or a binary file object
+    returns the number of records written (raises a `ValueError` at the first record too long to write, see
+      `encode_iso2709`)
+    """
+    marc_file = open(target, 'wb', buffering=ISO2709_BUFFER_SIZE) if isinstance(target, str) else target
+    count = 0
+    try:
+        for record in records:
+            marc_file.write(encode_iso2709(record, encoding))
+            count += 1
+    finally:
+        if marc_file is not target:
+            marc_file.close()
+    return count
+
+
+def canonicalize_bib(bib):
+    """canonicalize_bib():
+    serializes a bib (or bare marc record) so that two that hold the same data come out byte-for-byte the same:
+      fields are put in `sort_marc_tags` order, whitespace-only text between elements is dropped and the XML is in
+      canonical (C14N) form. The bib itself isn't changed.
+    Require:
+        bib - a <bib> element wrapping a <record>, or a <record> itself
+    returns the canonical bytes
+    """
+    bib = sort_marc_tags(deepcopy(bib))
+    for element in bib.iter():
+        if element.text is not None and not element.text.strip() and len(element):
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    return etree.tostring(bib, method='c14n')
+
+
+def digest_bib(bib):
+    """a fingerprint of a bib's canonical form (see `canonicalize_bib`)"""
+    return sha256(canonicalize_bib(bib)).hexdigest()
+
+
+def describe_field(field):
+    """a `ControlField` or `DataField` in the familiar line-per-field form, e.g. '=245  10$aTitle :$bsubtitle'"""
+    if isinstance(field, ControlField):
+        return '={}  {}'.format(field.tag, field.value or '')
+    indicators = (field.ind1 + field.ind2).replace(' ', '\\')
+    return '={}  {}{}'.format(field.tag, indicators,
+                              ''.join('${}{}'.format(code, value or '') for code, value in field.subfields))
+
+
+def is_bib_wrapper(bib):
+    return not isinstance(bib, MarcRecord) and etree.QName(bib).localname != 'record'
+
+
+def diff_marc_records(before, after):
+    """diff_marc_records():
+    compares two versions of a record field by field (ignoring field order).
+    Require:
+        before, after - <bib>/<record> elements or `MarcRecord`s
+    returns a dictionary of the changes - 'added' and 'removed' fields (see `describe_field`), 'leader' as an
+      (old, new) pair if it changed and, for <bib>s, the names of any other 'bib_elements' that changed - with only
+      the kinds of change that happened (so an empty dictionary means the records match)
+    """
+    changes = {}
+    before_record = before if isinstance(before, MarcRecord) else MarcRecord.from_element(before)
+    after_record = after if isinstance(after, MarcRecord) else MarcRecord.from_element(after)
+    if before_record.leader != after_record.leader:
+        changes['leader'] = (before_record.leader, after_record.leader)
+
+    before_fields = Counter(describe_field(field) for field in before_record.fields)
+    after_fields = Counter(describe_field(field) for field in after_record.fields)
+    removed = sorted((before_fields - after_fields).elements())
+    added = sorted((after_fields - before_fields).elements())
+    if removed:
+        changes['removed'] = removed
+    if added:
+        changes['added'] = added
+
+    if is_bib_wrapper(before) and is_bib_wrapper(after):
+        before_elements = {etree.QName(element).localname: canonicalize_bib(element) for element in before
+                           if isinstance(element.tag, str) and etree.QName(element).localname != 'record'}
+        after_elements = {etree.QName(element).localname: canonicalize_bib(element) for element in after
+                          if isinstance(element.tag, str) and etree.QName(element).localname != 'record'}
+        bib_elements = sorted(name for name in set(before_elements) | set(after_elements)
+                              if before_elements.get(name) != after_elements.get(name))
+        if bib_elements:
+            changes['bib_elements'] = bib_elements
+    return changes
@@ -0,0 +1,200 @@
+"""
+## pooled, keep-alive HTTP transport shared by the `Service` classes
+## reuses TCP/TLS connections per host instead of opening a new one for every request
+"""
+
+from collections import deque
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from select import select
+from threading import Lock
+from time import monotonic
+from urllib.parse import urlsplit
+
+# defaults for the pools (can be overridden per transport)
+DEFAULT_POOL_SIZE = 10        # maximum number of idle connections kept open per host
+DEFAULT_IDLE_TIMEOUT = 30     # seconds an idle connection may sit in the pool before it's discarded
+DEFAULT_TIMEOUT = 60          # socket timeout (in seconds) for each connection
+
+# errors indicating that a re-used connection was closed by the server while it sat idle
+STALE_CONNECTION_ERRORS = (ConnectionResetError, BrokenPipeError, ConnectionAbortedError, HTTPException)
+
+# methods that can safely be sent twice: anything else (a POST) may have been acted on even if its response was lost
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+
+
+def is_idempotent(method):
+    return method.upper() in IDEMPOTENT_METHODS
+
+
+def is_connection_dropped(connection):
+    """an idle keep-alive connection has nothing to read, so if its socket is readable the server has closed it"""
+    if connection.sock is None:
+        return False  # not connected yet
+    readable, _, _ = select([connection.sock], [], [], 0)
+    return bool(readable)
+
+
+class TransportResponse:
+    """the fully-read response to a request made through an `HttpTransport`"""
+
+    __slots__ = ("status", "reason", "headers", "body")
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def text(self, default_charset="utf-8"):
+        """decode the body using the charset given in the 'Content-Type' header (falling back on `default_charset`)"""
+        charset = self.headers.get_content_charset() or default_charset
+        return self.body.decode(charset)
+
+
+class HostConnectionPool:
+    """a pool of idle keep-alive connections to a single (scheme, host, port)"""
+
+    def __init__(self, scheme, host, port, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 timeout=DEFAULT_TIMEOUT):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = deque()  # (connection, time_released) pairs, most recently released on the right
+        self._lock = Lock()
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    def new_connection(self):
+        connection_class = HTTPSConnection if self.scheme == "https" else HTTPConnection
+        self.connections_created += 1
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """return an idle connection if one is still fresh, otherwise open a new one. -> (connection, was_reused)"""
+        now = monotonic()
+        stale = []
+        connection, reused = None, False
+        with self._lock:
+            while self._idle:
+                candidate, released_at = self._idle.pop()
+                if now - released_at <= self.idle_timeout and not is_connection_dropped(candidate):
+                    connection, reused = candidate, True
+                    self.connections_reused += 1
+                    break
+                stale.append(candidate)
+            if connection is None:
+                connection = self.new_connection()
+        for old_connection in stale:
+            old_connection.close()
+        return connection, reused
+
+    def release(self, connection):
+        """hand a connection back to the pool (closing it instead if the pool is already full)"""
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((connection, monotonic()))
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            connection.close()
+
+
+class HttpTransport:
+    """HttpTransport sends requests over per-host pools of persistent (keep-alive) connections"""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._pools = {}
+        self._lock = Lock()
+
+    def get_pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = HostConnectionPool(scheme, host, port, self.pool_size, self.idle_timeout, self.timeout)
+                self._pools[key] = pool
+        return pool
+
+    def request(self, method, url, body=None, headers=None):
+        """send a request to `url` and return the fully-read `TransportResponse`"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        pool = self.get_pool(scheme, parts.hostname, port)
+        connection, reused = pool.acquire()
+        try:
+            response = self._send(connection, method, target, body, headers)
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused or not is_idempotent(method):
+                raise  # (connections the server closed while idle are weeded out in `acquire`, before anything is sent)
+            # the server dropped the idle connection as we used it; retry once on a brand new one
+            connection = pool.new_connection()
+            try:
+                response = self._send(connection, method, target, body, headers)
+            except BaseException:
+                connection.close()
+                raise
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            pool.release(connection)
+        return TransportResponse(response.status, response.reason, response.headers, response.data)
+
+    @staticmethod
+    def _send(connection, method, target, body, headers):
+        connection.request(method, target, body=body, headers=headers or {})
+        response = connection.getresponse()
+        response.data = response.read()  # the body must be fully read before the connection can be re-used
+        return response
+
+    def stats(self):
+        """counts of connections opened and re-used, per host"""
+        with self._lock:
+            pools = list(self._pools.values())
+        return {
+            "{}://{}:{}".format(pool.scheme, pool.host, pool.port): {
+                "connections_created": pool.connections_created,
+                "connections_reused": pool.connections_reused,
+                "idle_connections": len(pool._idle)
+            } for pool in pools
+        }
+
+    def close(self):
+        """close every idle connection in every pool"""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+
+# the transport shared by every `Service` that isn't given one explicitly
+_default_transport = None
+_default_transport_lock = Lock()
+
+
+def get_default_transport():
+    """return the process-wide `HttpTransport` (creating it on first use)"""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HttpTransport()
+        return _default_transport
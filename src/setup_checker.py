@@ -5,8 +5,9 @@ SCRIPT_NAME = basename(__file__)  # name of the current script, for use in loggi
 
 def try_log_message(message, lvl="INFO"):
     try:
-        from services import construct_log_message
-        print(construct_log_message(SCRIPT_NAME, message, level=lvl) + "\n")
+        from src.services.logs import get_logger
+        get_logger(SCRIPT_NAME).log(lvl, message)
+        print()
         return True
     except ImportError:
         message = "! --- Unable to access item from within 'services' module. --- !"
@@ -0,0 +1,37 @@
+"""
+## a stub Alma API for the tests: like the real one, every XML response starts with an XML declaration
+"""
+
+from unittest import TestCase
+
+from src.services.bibs import AlmaBibs
+from src.services.rate_limit import RateLimiter, RetryPolicy
+from src.services.transport import HttpTransport
+from src.tests.http_stub import StubServer, XML_DECLARATION
+
+ALMA_PATH = "/almaws/v1"
+
+
+def xml_response(body, status=200):
+    return status, XML_DECLARATION + body, {"Content-Type": "application/xml;charset=UTF-8"}
+
+
+class AlmaStubTestCase(TestCase):
+    """runs each test against a fresh stub server, with an `AlmaBibs` service (`self.alma`) pointed at it"""
+
+    def setUp(self):
+        self.server = StubServer().__enter__()
+        self.transport = HttpTransport()
+        self.alma = AlmaBibs(logging=False, transport=self.transport, rate_limiter=RateLimiter(1000),
+                             retry_policy=RetryPolicy(backoff_factor=0))
+        self.alma.base_url = self.server.url + ALMA_PATH
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.__exit__(None, None, None)
+
+    def route(self, method, path_pattern, handler):
+        self.server.route(method, ALMA_PATH + path_pattern, handler)
+
+    def count_requests(self, method, path_pattern):
+        return self.server.count_requests(method, ALMA_PATH + path_pattern)
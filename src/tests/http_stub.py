@@ -0,0 +1,105 @@
+"""
+## a local stand-in for the HTTP APIs the services talk to: register handlers for (method, path pattern) routes and
+##   point a service (or transport) at `StubServer.url`. Speaks keep-alive HTTP/1.1 and counts the connections made
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from re import fullmatch
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+
+class StubRequest:
+    """what a route handler is given: the method, path, query parameters, body, headers and the path pattern's groups.
+    Setting `hang_up_after_response` closes the connection once the response is sent (without telling the client)"""
+
+    def __init__(self, method, path, query, body, groups=(), headers=None):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.headers = headers or {}
+        self.groups = groups
+        self.hang_up_after_response = False
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections open between requests
+    disable_nagle_algorithm = True  # the headers and body are written separately: send both without waiting
+
+    def setup(self):
+        super().setup()
+        self.server.stub.count_connection()
+
+    def handle_request(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        request = StubRequest(self.command, parts.path, parse_qs(parts.query), body, headers=self.headers)
+        response = self.server.stub.respond(request)
+        if response is None:  # hang up without responding
+            self.close_connection = True
+            return
+        status, response_body, headers = response
+        if isinstance(response_body, str):
+            response_body = response_body.encode("utf-8")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+        self.close_connection = request.hang_up_after_response
+
+    do_GET = do_PUT = do_POST = do_DELETE = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer:
+    """StubServer serves registered routes from a background thread (use it as a context manager)"""
+
+    def __init__(self):
+        self.routes = []
+        self.requests = []  # (method, path, query) for every request received, in order
+        self.connections = 0
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self.url = "http://127.0.0.1:{}".format(self._server.server_address[1])
+
+    def __enter__(self):
+        Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def route(self, method, pattern, handler):
+        """`handler(request)` -> (status, body) or (status, body, headers), for requests whose path matches `pattern`
+        (or None to hang up without responding)"""
+        self.routes.append((method, pattern, handler))
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def count_requests(self, method, pattern):
+        with self._lock:
+            return sum(1 for request in self.requests if request[0] == method and fullmatch(pattern, request[1]))
+
+    def respond(self, request):
+        with self._lock:
+            self.requests.append((request.method, request.path, request.query))
+        for route_method, pattern, handler in self.routes:
+            match = fullmatch(pattern, request.path)
+            if route_method == request.method and match:
+                request.groups = match.groups()
+                response = handler(request)
+                return response if response is None or len(response) == 3 else (response[0], response[1], {})
+        return 404, "no route for {} {}".format(request.method, request.path), {}
@@ -0,0 +1,157 @@
+import asyncio
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Barrier
+from unittest import TestCase
+
+from src.analytics.run_weekly_alma_reports import run_reports_from_dictionary
+from src.services.analytics import AlmaAnalytics, PrimoAnalytics, ReportFrameBuilder, ROWSET_NAMESPACE
+from src.services.async_analytics import AsyncPrimoAnalytics
+from src.services.async_transport import AsyncHttpTransport
+from src.services.rate_limit import RateLimiter
+from src.services.transport import HttpTransport
+from src.tests.http_stub import StubServer, XML_DECLARATION
+
+REPORT_SCHEMA = ('<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:saw-sql="urn:saw-sql">'
+                 '<xsd:complexType name="Row"><xsd:sequence>'
+                 '<xsd:element name="Column0" saw-sql:type="integer" saw-sql:columnHeading="Loans"/>'
+                 '<xsd:element name="Column1" saw-sql:type="varchar" saw-sql:columnHeading="Library Name)"/>'
+                 '</xsd:sequence></xsd:complexType></xsd:schema>')
+
+
+def report_page(loans, finished, resumption_token=None, with_schema=True):
+    """a page of an Analytics report with a row per number in `loans`"""
+    rows = "".join("<Row><Column0>{}</Column0><Column1>Mugar</Column1></Row>".format(count) for count in loans)
+    token = "<ResumptionToken>{}</ResumptionToken>".format(resumption_token) if resumption_token else ""
+    return (XML_DECLARATION + '<report><QueryResult>{}<IsFinished>{}</IsFinished><ResultXml>'
+            '<rowset xmlns="urn:schemas-microsoft-com:xml-analysis:rowset">{}{}</rowset>'
+            '</ResultXml></QueryResult></report>').format(token, "true" if finished else "false",
+                                                          REPORT_SCHEMA if with_schema else "", rows)
+
+
+class AnalyticsStubTestCase(TestCase):
+    """serves `self.path_pages` in turn to requests by path and `self.token_pages` to requests by token"""
+    api_path = "/almaws/v1"
+
+    def setUp(self):
+        self.path_pages = []
+        self.token_pages = []
+        self.server = StubServer().__enter__()
+        self.server.route("GET", self.api_path + "/analytics/reports", self.serve_page)
+        self.transport = HttpTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.__exit__(None, None, None)
+
+    def serve_page(self, request):
+        pages = self.token_pages if "token" in request.query else self.path_pages
+        return 200, pages.pop(0) if len(pages) > 1 else pages[0]
+
+    def make_service(self, service_class, **kwargs):
+        service = service_class(logging=False, rate_limiter=RateLimiter(1000), **kwargs)
+        service.base_url = self.server.url + self.api_path
+        return service
+
+
+class AlmaAnalyticsTest(AnalyticsStubTestCase):
+
+    def test_rows_of_every_page_are_kept(self):
+        self.path_pages = [report_page([1, 2], finished=False, resumption_token="T")]
+        self.token_pages = [report_page([3], finished=False, with_schema=False),
+                            report_page([4], finished=True, with_schema=False)]
+        alma = self.make_service(AlmaAnalytics, transport=self.transport)
+
+        data_frame = alma.prepare_df_from_report_path("/shared/report", secondsBetweenRequests=0.01)
+
+        self.assertEqual(list(data_frame.columns), ["Loans", "Library"])
+        self.assertEqual(list(data_frame["Loans"]), [1, 2, 3, 4])
+
+    def test_rows_are_streamed_into_the_builder(self):
+        self.path_pages = [report_page([1, 2], finished=False, resumption_token="T")]
+        self.token_pages = [report_page([3], finished=True, with_schema=False)]
+        alma = self.make_service(AlmaAnalytics, transport=self.transport)
+        builder = ReportFrameBuilder()
+
+        pages = list(alma.iter_report_pages("/shared/report", 0.01, builder=builder))
+
+        self.assertEqual(len(pages), 2)
+        self.assertEqual([page.findall(".//{%s}Row" % ROWSET_NAMESPACE) for page in pages], [[], []])
+        self.assertEqual(list(builder.to_data_frame()["Loans"]), [1, 2, 3])
+
+
+class PrimoAnalyticsTest(AnalyticsStubTestCase):
+    api_path = "/primo/v1"
+
+    def setUp(self):
+        super().setUp()
+        # no 'ResumptionToken' at all: every re-request by path starts the report over
+        self.path_pages = [report_page([1], finished=False), report_page([1, 2], finished=False),
+                           report_page([1, 2, 3], finished=True)]
+
+    def test_only_the_last_response_by_path_is_kept(self):
+        primo = self.make_service(PrimoAnalytics, transport=self.transport)
+
+        data_frame = primo.prepare_df_from_report_path("/shared/report", secondsBetweenRequests=0.01)
+
+        self.assertEqual(list(data_frame["Loans"]), [1, 2, 3])
+        self.assertEqual(self.server.count_requests("GET", self.api_path + "/analytics/reports"), 3)
+
+    def test_only_the_last_response_by_path_is_written(self):
+        primo = self.make_service(PrimoAnalytics, transport=self.transport)
+        with TemporaryDirectory() as directory:
+            output_path = join(directory, "report.tsv")
+            row_count = primo.write_report_to_tsv("/shared/report", output_path, secondsBetweenRequests=0.01)
+            with open(output_path, encoding="utf-8") as output_file:
+                lines = output_file.read().splitlines()
+
+        self.assertEqual(row_count, 3)
+        self.assertEqual(lines, ["\tLoans\tLibrary", "0\t1\tMugar", "1\t2\tMugar", "2\t3\tMugar"])
+
+    def test_only_the_last_response_by_path_is_kept_async(self):
+        async def prepare_df():
+            transport = AsyncHttpTransport()
+            try:
+                primo = self.make_service(AsyncPrimoAnalytics, transport=transport)
+                return await primo.prepare_df_from_report_path("/shared/report", secondsBetweenRequests=0.01)
+            finally:
+                transport.close()
+
+        self.assertEqual(list(asyncio.run(prepare_df())["Loans"]), [1, 2, 3])
+
+
+class RunReportsFromDictionaryTest(AnalyticsStubTestCase):
+    reports = {
+        "loans": {"path": "/shared/loans", "output": "loans.tsv"},
+        "renewals": {"path": "/shared/renewals", "output": "renewals.tsv"},
+        "missing": {"path": "/shared/missing", "output": "missing.tsv"}
+    }
+
+    def setUp(self):
+        super().setUp()
+        # the two reports that exist are only answered once both have been asked for: run one after the other, they'd fail
+        self.both_requested = Barrier(2, timeout=5)
+
+    def serve_page(self, request):
+        path = request.query["path"][0]
+        if path == "/shared/missing":
+            return 400, XML_DECLARATION + "<web_service_result><errorsExist>true</errorsExist></web_service_result>"
+        self.both_requested.wait()
+        return 200, report_page([1, 2] if path == "/shared/loans" else [3], finished=True)
+
+    def test_reports_run_side_by_side_and_are_summarized(self):
+        alma = self.make_service(AlmaAnalytics, transport=self.transport)
+        with TemporaryDirectory() as directory:
+            summary = run_reports_from_dictionary(alma, self.reports, output_dir=directory, max_concurrent_reports=3)
+            written = sorted(listdir(directory))
+            with open(join(directory, "loans.tsv"), encoding="utf-8") as output_file:
+                loans = output_file.read().splitlines()
+
+        self.assertEqual({report: summary[report][1:] for report in summary}, {
+            "loans": (2, "written to 'loans.tsv'"),
+            "renewals": (1, "written to 'renewals.tsv'"),
+            "missing": ("-", "failed")
+        })
+        self.assertEqual(written, ["loans.tsv", "renewals.tsv"])  # no '.part' file is left behind by the failed report
+        self.assertEqual(loans, ["\tLoans\tLibrary", "0\t1\tMugar", "1\t2\tMugar"])
@@ -0,0 +1,151 @@
+import asyncio
+from socket import socket
+from unittest import TestCase
+
+from src.services.async_transport import AsyncHttpTransport
+
+
+class RawHttpServer:
+    """a keep-alive HTTP/1.1 server on `asyncio.start_server` that answers '/chunked' with a chunked body and anything
+    else with a 'Content-Length' one, echoing the request's method, path and body. It hangs up without answering the
+    next `hang_ups[path]` requests for a path, and sends only part of the body promised for '/truncated'"""
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+        self.hang_ups = {}
+        self.url = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        self.url = "http://127.0.0.1:{}".format(self._server.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+
+                if self.hang_ups.get(target):
+                    self.hang_ups[target] -= 1
+                    break
+                echo = "{} {} {}".format(method, target, body.decode("utf-8")).encode("utf-8")
+                if target == "/truncated":
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n" + echo)
+                    break
+                if target.split("?")[0] == "/chunked":
+                    # split into several chunks, with a chunk extension and a trailer for good measure
+                    chunks = [echo[:3], echo[3:10], echo[10:]]
+                    writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" + b"".join(
+                        b"%x;note=1\r\n%s\r\n" % (len(chunk), chunk) for chunk in chunks if chunk
+                    ) + b"0\r\nX-Trailer: yes\r\n\r\n")
+                else:
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(echo), echo))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def get_closed_port():
+    """a local port nothing is listening on"""
+    with socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        return unused.getsockname()[1]
+
+
+class AsyncHttpTransportTest(TestCase):
+
+    def run_with_server(self, requests):
+        """-> (the bodies of the responses to `requests(transport, url)`, the server (also `self.server` meanwhile), the
+        transport's stats)"""
+        async def run():
+            server = self.server = RawHttpServer()
+            await server.start()
+            transport = AsyncHttpTransport()
+            try:
+                responses = await requests(transport, server.url)
+                return [response.body for response in responses], server, transport.stats()[server.url]
+            finally:
+                transport.close()
+                await server.stop()
+
+        return asyncio.run(run())
+
+    def test_content_length_and_chunked_bodies(self):
+        async def requests(transport, url):
+            return [await transport.request("GET", url + "/length"),
+                    await transport.request("GET", url + "/chunked"),
+                    await transport.request("POST", url + "/length", body="<bib/>"),
+                    await transport.request("PUT", url + "/chunked", body="<holding/>")]
+
+        bodies, server, stats = self.run_with_server(requests)
+
+        self.assertEqual(bodies, [b"GET /length ", b"GET /chunked ", b"POST /length <bib/>", b"PUT /chunked <holding/>"])
+        self.assertEqual(server.connections, 1)  # every response was read fully, leaving the connection reusable
+        self.assertEqual(stats["connections_created"], 1)
+        self.assertEqual(stats["connections_reused"], 3)
+
+    def test_concurrent_requests_reuse_pooled_connections(self):
+        async def requests(transport, url):
+            first = await asyncio.gather(*(transport.request("GET", url + "/chunked?n={}".format(n)) for n in range(5)))
+            second = await asyncio.gather(*(transport.request("GET", url + "/length?n={}".format(n)) for n in range(5)))
+            return first + second
+
+        bodies, server, stats = self.run_with_server(requests)
+
+        self.assertEqual(bodies, [b"GET /chunked?n=%d " % n for n in range(5)] + [b"GET /length?n=%d " % n for n in range(5)])
+        self.assertEqual(server.connections, 5)
+        self.assertEqual(stats["connections_created"], 5)
+        self.assertEqual(stats["connections_reused"], 5)
+
+    def test_dropped_reused_connection_is_retried_once_for_idempotent_requests(self):
+        async def requests(transport, url):
+            await transport.request("GET", url + "/length")
+            self.server.hang_ups["/dropped"] = 1
+            resent = await transport.request("GET", url + "/dropped")  # resent on a new connection
+            self.server.hang_ups["/dropped"] = 2
+            with self.assertRaises(ConnectionResetError):
+                await transport.request("GET", url + "/dropped")  # ...but only the once
+            await transport.request("GET", url + "/length")
+            self.server.hang_ups["/create"] = 1
+            with self.assertRaises(ConnectionResetError):
+                await transport.request("POST", url + "/create", body="<bib/>")  # never resent: it may have been made
+            return [resent, await transport.request("GET", url + "/length")]
+
+        bodies, server, stats = self.run_with_server(requests)
+
+        self.assertEqual(bodies, [b"GET /dropped ", b"GET /length "])
+        self.assertEqual(server.requests, 8)
+        self.assertEqual(stats["connections_created"], 5)
+
+    def test_transport_errors_are_raised(self):
+        async def requests(transport, url):
+            with self.assertRaises(asyncio.IncompleteReadError):
+                await transport.request("GET", url + "/truncated")
+            with self.assertRaises(ConnectionRefusedError):
+                await transport.request("GET", "http://127.0.0.1:{}/".format(get_closed_port()))
+            return [await transport.request("GET", url + "/length")]  # the broken connection wasn't put back in the pool
+
+        bodies, server, stats = self.run_with_server(requests)
+
+        self.assertEqual(bodies, [b"GET /length "])
+        self.assertEqual(server.connections, 2)
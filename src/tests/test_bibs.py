@@ -0,0 +1,143 @@
+from src.services import ServiceRequestError
+from src.services.bibs import BULK_BIBS_LIMIT
+from src.tests.alma_stub import AlmaStubTestCase, xml_response
+
+
+def holdings_list(request):
+    mms_id = request.groups[0]
+    return xml_response('<holdings total_record_count="2">'
+                        '<holding><holding_id>{0}1</holding_id></holding>'
+                        '<holding><holding_id>{0}2</holding_id></holding>'
+                        '</holdings>'.format(mms_id))
+
+
+def representations_list(request):
+    mms_id = request.groups[0]
+    return xml_response('<representations total_record_count="1"><representation><id>{}0</id>'
+                        '</representation></representations>'.format(mms_id))
+
+
+class BatchGetterTest(AlmaStubTestCase):
+
+    def test_holdings_lists_for_bibs(self):
+        self.route("GET", r"/bibs/(\d+)/holdings", holdings_list)
+
+        results = dict(self.alma.get_holdings_lists_for_bibs(["11", "22", "33"], max_workers=3))
+
+        self.assertEqual(set(results), {"11", "22", "33"})
+        for mms_id, holdings in results.items():
+            self.assertNotIsInstance(holdings, Exception)
+            self.assertEqual(holdings.xpath("holding/holding_id/text()"), [mms_id + "1", mms_id + "2"])
+
+    def test_representations_lists_for_bibs(self):
+        self.route("GET", r"/bibs/(\d+)/representations", representations_list)
+
+        results = dict(self.alma.get_representations_lists_for_bibs(["11", "22"], 10, 0, max_workers=2))
+
+        self.assertEqual({mms_id: representations.findtext("representation/id")
+                          for mms_id, representations in results.items()}, {"11": "110", "22": "220"})
+
+    def test_bib_records_by_mms_ids(self):
+        self.route("GET", r"/bibs/(\d+)", lambda request: xml_response(
+            "<bib><mms_id>{}</mms_id><record/></bib>".format(request.groups[0])))
+
+        results = dict(self.alma.get_bib_records_by_mms_ids(["11", "22"], max_workers=2))
+
+        self.assertEqual({mms_id: bib.findtext("mms_id") for mms_id, bib in results.items()}, {"11": "11", "22": "22"})
+
+    def test_bibs_alma_refuses_are_reported_with_the_status(self):
+        self.route("GET", r"/bibs/(\d+)", lambda request: xml_response(
+            "<bib><mms_id>11</mms_id><record/></bib>") if request.groups[0] == "11" else xml_response(
+            "<web_service_result><errorsExist>true</errorsExist></web_service_result>", status=400))
+
+        results = dict(self.alma.get_bib_records_by_mms_ids(["11", "22"], max_workers=2))
+
+        self.assertEqual(results["11"].findtext("mms_id"), "11")
+        self.assertIsInstance(results["22"], ServiceRequestError)
+        self.assertEqual(results["22"].status, 400)
+        self.assertIn("/bibs/22?", results["22"].url)
+
+
+def bibs_chunk(request):
+    """the '/bibs' endpoint: the requested bibs, in reverse order, leaving out any mms_id ending in '3' (not found)"""
+    mms_ids = request.query["mms_id"][0].split(",")
+    if "99" in mms_ids:
+        return xml_response("<web_service_result><errorsExist>true</errorsExist></web_service_result>", status=400)
+    return xml_response('<bibs total_record_count="{}">{}</bibs>'.format(len(mms_ids), "".join(
+        "<bib><mms_id>{}</mms_id><record/></bib>".format(mms_id) for mms_id in reversed(mms_ids)
+        if not mms_id.endswith("3"))))
+
+
+class BulkBibsTest(AlmaStubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.route("GET", "/bibs", bibs_chunk)
+
+    def requested_chunks(self):
+        return [query["mms_id"][0] for method, path, query in self.server.requests if path.endswith("/bibs")]
+
+    def test_one_request_for_a_chunk_of_mms_ids(self):
+        bibs = self.alma.get_bib_records_chunk([11, "22", "33", "44"])
+
+        self.assertEqual([(mms_id, bib if bib is None else bib.findtext("mms_id")) for mms_id, bib in bibs],
+                         [("11", "11"), ("22", "22"), ("33", None), ("44", "44")])
+        self.assertEqual(self.requested_chunks(), ["11,22,33,44"])
+
+    def test_mms_ids_are_requested_in_chunks(self):
+        mms_ids = [str(number) for number in range(10, 20)]
+
+        bibs_by_mms_id, missing_mms_ids = self.alma.get_bib_records_in_bulk(mms_ids, chunk_size=4, max_workers=2)
+
+        self.assertEqual(sorted(self.requested_chunks()), ["10,11,12,13", "14,15,16,17", "18,19"])
+        self.assertEqual(sorted(bibs_by_mms_id), [mms_id for mms_id in mms_ids if mms_id != "13"])
+        self.assertEqual(missing_mms_ids, ["13"])
+
+    def test_chunks_are_no_bigger_than_alma_allows(self):
+        mms_ids = [str(number) for number in range(1000, 1000 + BULK_BIBS_LIMIT + 1)]
+
+        bibs_by_mms_id, _ = self.alma.get_bib_records_in_bulk(mms_ids, chunk_size=500)
+
+        self.assertEqual([len(chunk.split(",")) for chunk in self.requested_chunks()], [BULK_BIBS_LIMIT, 1])
+        self.assertEqual(len(bibs_by_mms_id), len([mms_id for mms_id in mms_ids if not mms_id.endswith("3")]))
+
+    def test_mms_ids_of_a_refused_chunk_are_reported_missing(self):
+        bibs_by_mms_id, missing_mms_ids = self.alma.get_bib_records_in_bulk(["11", "99", "22", "44"], chunk_size=2)
+
+        self.assertEqual(sorted(bibs_by_mms_id), ["22", "44"])
+        self.assertEqual(missing_mms_ids, ["11", "99"])
+
+
+def items_page(request, total_record_count=5):
+    """a page of the items of a holdings record: item_pid '{holdings_id}-{n}' for n < `total_record_count`"""
+    holdings_id = request.groups[1]
+    offset, limit = int(request.query["offset"][0]), int(request.query["limit"][0])
+    items = "".join("<item><item_data><pid>{}-{}</pid></item_data></item>".format(holdings_id, number)
+                    for number in range(offset, min(offset + limit, total_record_count)))
+    return xml_response('<items total_record_count="{}">{}</items>'.format(total_record_count, items))
+
+
+class ItemPagesTest(AlmaStubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.route("GET", r"/bibs/(\d+)/holdings", holdings_list)
+        self.route("GET", r"/bibs/(\d+)/holdings/(\d+)/items", items_page)
+
+    def test_every_item_of_every_holdings_record(self):
+        items = list(self.alma.iter_items_for_bibs(["11", "22"], page_size=2, max_workers=3))
+
+        self.assertEqual(sorted((mms_id, holdings_id, item.findtext("item_data/pid")) for mms_id, holdings_id, item in items),
+                         [(mms_id, holdings_id, "{}-{}".format(holdings_id, number))
+                          for mms_id in ("11", "22") for holdings_id in (mms_id + "1", mms_id + "2")
+                          for number in range(5)])
+
+    def test_remaining_pages_are_fetched_as_soon_as_their_first_page_arrives(self):
+        holdings_keys = [("11", str(holdings_id)) for holdings_id in range(100, 120)]
+
+        pages = list(self.alma.get_item_pages(holdings_keys, page_size=2, max_workers=1))
+
+        self.assertEqual(len(pages), 60)
+        requested = [(path.rsplit("/", 2)[-2], query["offset"][0]) for _, path, query in self.server.requests]
+        # with a single worker, the first holdings record's last page comes well before the last one's first page
+        self.assertLess(requested.index(("100", "4")), requested.index(("119", "0")))
@@ -0,0 +1,169 @@
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from src.services.cache import ResponseCache
+from src.tests.alma_stub import AlmaStubTestCase, xml_response
+
+
+class Clock:
+    """stands in for the cache's `time()`, moving only when told to"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class ResponseCacheKeyTest(AlmaStubTestCase):
+    """sandbox and production share a host, so only the apikey tells their responses apart"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = TemporaryDirectory()
+        self.cache = ResponseCache(join(self.directory.name, "responses.sqlite"))
+        self.route("GET", r"/bibs/(\d+)", lambda request: xml_response(
+            "<bib><mms_id>{}</mms_id><environment>{}</environment></bib>".format(
+                request.groups[0], request.query["apikey"][0])))
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test_keys_differ_by_apikey_only(self):
+        url = "https://alma.example/almaws/v1/bibs/11?view=full&apikey={}"
+        key = self.cache.make_key("GET", url.format("sandbox-key"))
+
+        self.assertEqual(key, self.cache.make_key("GET", "https://alma.example/almaws/v1/bibs/11?apikey=sandbox-key&view=full"))
+        self.assertNotEqual(key, self.cache.make_key("GET", url.format("production-key")))
+        self.assertNotIn("sandbox-key", self.cache.split_url(url.format("sandbox-key"))[0])
+
+    def test_responses_are_not_shared_between_apikeys(self):
+        self.alma.cache = self.cache
+        self.alma.api_key = "sandbox-key"
+        sandbox_bib = self.alma.get_bib_record_by_mms_id("11")
+        self.alma.api_key = "production-key"
+        production_bib = self.alma.get_bib_record_by_mms_id("11")
+        self.alma.api_key = "sandbox-key"
+        cached_bib = self.alma.get_bib_record_by_mms_id("11")
+
+        self.assertEqual(sandbox_bib.findtext("environment"), "sandbox-key")
+        self.assertEqual(production_bib.findtext("environment"), "production-key")
+        self.assertEqual(cached_bib.findtext("environment"), "sandbox-key")
+        self.assertEqual(self.count_requests("GET", r"/bibs/11"), 2)
+
+
+class CachedServiceTest(AlmaStubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = TemporaryDirectory()
+        self.clock = Clock()
+        clock = patch("src.services.cache.time", self.clock)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.alma.cache = ResponseCache(join(self.directory.name, "responses.sqlite"), ttls=((r"/bibs", 60),))
+        self.version = 1
+
+    def tearDown(self):
+        self.alma.cache.close()
+        self.directory.cleanup()
+        super().tearDown()
+
+    def route_bibs(self, etag=False):
+        """bibs at `self.version`, with that version as their ETag (answering a matching 'If-None-Match' with a 304)"""
+        def get_bib(request):
+            if etag and request.headers.get("If-None-Match") == str(self.version):
+                return 304, "", {"ETag": str(self.version)}
+            status, body, headers = xml_response("<bib><mms_id>{}</mms_id><version>{}</version></bib>".format(
+                request.groups[0], self.version))
+            return status, body, dict(headers, ETag=str(self.version)) if etag else headers
+
+        self.route("GET", r"/bibs/(\d+)", get_bib)
+
+    def get_version(self):
+        return self.alma.get_bib_record_by_mms_id("11").findtext("version")
+
+    def test_responses_are_served_from_the_cache_until_they_expire(self):
+        self.route_bibs()
+        self.get_version()
+        self.version = 2
+        self.clock.now += 59
+        cached_version = self.get_version()
+        self.clock.now += 2
+        expired_version = self.get_version()
+
+        self.assertEqual((cached_version, expired_version), ("1", "2"))
+        self.assertEqual(self.count_requests("GET", r"/bibs/11"), 2)
+
+    def test_expired_responses_are_revalidated_with_their_etag(self):
+        self.route_bibs(etag=True)
+        self.get_version()
+        self.clock.now += 61
+        revalidated_version = self.get_version()
+        self.clock.now += 59
+        refreshed_version = self.get_version()  # the 304 started the entry's TTL again
+        self.version = 2
+        self.clock.now += 2
+        changed_version = self.get_version()
+
+        self.assertEqual((revalidated_version, refreshed_version, changed_version), ("1", "1", "2"))
+        self.assertEqual(self.count_requests("GET", r"/bibs/11"), 3)
+        self.assertEqual(self.alma.cache.stats()["revalidations"], 1)
+
+    def test_writes_invalidate_cached_responses(self):
+        self.route_bibs()
+        self.route("PUT", r"/bibs/(\d+)", lambda request: xml_response(request.body.decode("utf-8")))
+        self.route("GET", r"/bibs/(\d+)/representations", lambda request: xml_response(
+            '<representations total_record_count="{0}"><representation><id>{0}</id></representation>'
+            '</representations>'.format(self.version)))
+        self.route("POST", r"/bibs/(\d+)/representations", lambda request: xml_response(
+            "<representation><id>2</id></representation>"))
+
+        self.get_version()
+        self.alma.get_representations_list("11", 10, 0)
+        self.version = 2
+        self.alma.update_bib_record_by_mms_id("11", self.alma.get_bib_record_by_mms_id("11"))
+        updated_version = self.get_version()
+        self.alma.make_request("/bibs/11/representations", method="POST", requestBody=b"<representation/>")
+        representations = self.alma.get_representations_list("11", 10, 0)
+
+        self.assertEqual(updated_version, "2")
+        self.assertEqual(representations.findtext("representation/id"), "2")
+        self.assertEqual(self.count_requests("GET", r"/bibs/11"), 2)
+        self.assertEqual(self.count_requests("GET", r"/bibs/11/representations"), 2)
+
+
+class ResponseCacheEvictionTest(TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.clock = Clock()
+        clock = patch("src.services.cache.time", self.clock)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.cache = ResponseCache(join(self.directory.name, "responses.sqlite"), max_bytes=25)
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def put(self, name):
+        self.clock.now += 1
+        self.cache.put("GET", "https://alma.example/almaws/v1/bibs/" + name, b"0123456789")
+
+    def cached_names(self):
+        return [name for name in "abcd" if self.cache.get("GET", "https://alma.example/almaws/v1/bibs/" + name)]
+
+    def test_least_recently_used_entries_are_evicted_past_the_size_cap(self):
+        self.put("a")
+        self.put("b")
+        self.clock.now += 1
+        self.cache.get("GET", "https://alma.example/almaws/v1/bibs/a")  # 'b' is now the least recently used
+        self.put("c")
+
+        self.assertEqual(self.cached_names(), ["a", "c"])
+        self.assertEqual(self.cache.stats()["bytes"], 20)
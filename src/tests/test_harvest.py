@@ -0,0 +1,240 @@
+from datetime import date
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import sleep
+from unittest import TestCase
+from unittest.mock import patch
+
+from src.services.dspace import Dspace, OAI_NAMESPACES
+from src.services.harvest import HarvestState, OaiError, OpenBUHarvester, iter_list_records, parse_list_records
+from src.services.record_utils import iter_marcxml_records
+from src.services.transport import HttpTransport
+from src.tests.http_stub import StubServer, XML_DECLARATION
+
+OAI_PATH = "/oai/request"
+PAGE_SIZE = 2
+
+MARC_RECORD = ('<marc:record xmlns:marc="http://www.loc.gov/MARC21/slim"><marc:leader>00000nam a2200000 i 4500</marc:leader>'
+               '<marc:datafield tag="024" ind1="8" ind2=" "><marc:subfield code="a">old</marc:subfield></marc:datafield>'
+               '<marc:datafield tag="245" ind1="0" ind2="0"><marc:subfield code="a">{title}</marc:subfield></marc:datafield>'
+               '<marc:datafield tag="720" ind1=" " ind2=" "><marc:subfield code="a">Smith, Ann</marc:subfield>'
+               '<marc:subfield code="e">author</marc:subfield></marc:datafield></marc:record>')
+
+
+def oai_response(verb, body):
+    return (200, XML_DECLARATION + '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><{0}>{1}</{0}></OAI-PMH>'.format(
+        verb, body), {"Content-Type": "text/xml"})
+
+
+def oai_error(code, message=""):
+    return (200, XML_DECLARATION + '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><error code="{}">{}</error>'
+            '</OAI-PMH>'.format(code, message), {"Content-Type": "text/xml"})
+
+
+def oai_record(identifier, datestamp, deleted=False):
+    header = '<header{}><identifier>{}</identifier><datestamp>{}</datestamp></header>'.format(
+        ' status="deleted"' if deleted else '', identifier, datestamp)
+    if deleted:
+        return '<record>{}</record>'.format(header)
+    return '<record>{}<metadata>{}</metadata></record>'.format(header, MARC_RECORD.format(title=identifier))
+
+
+def get_title(record):
+    return record.findtext('marc:datafield[@tag="245"]/marc:subfield', namespaces=OAI_NAMESPACES)
+
+
+class OaiStubTestCase(TestCase):
+    """an OpenBU stub serving `self.repository` (identifier -> (datestamp, deleted)), `PAGE_SIZE` records to a
+    `ListRecords` page, selected by `from`/`until` like the real thing"""
+
+    def setUp(self):
+        self.repository = {}
+        self.server = StubServer().__enter__()
+        self.server.route("GET", OAI_PATH, self.serve)
+        self.transport = HttpTransport()
+        for module in ("harvest", "dspace"):
+            oai_url = patch("src.services.{}.OPENBU_OAI_URL".format(module), self.server.url + OAI_PATH)
+            oai_url.start()
+            self.addCleanup(oai_url.stop)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.__exit__(None, None, None)
+
+    def serve(self, request):
+        query = {name: values[0] for name, values in request.query.items()}
+        if "resumptionToken" in query:
+            offset, from_date, until = query["resumptionToken"].split("|")
+        else:
+            offset, from_date, until = 0, query.get("from", ""), query.get("until", "9999")
+        identifiers = [identifier for identifier, (datestamp, _) in sorted(self.repository.items())
+                       if from_date <= datestamp[:10] <= until]
+        if not identifiers:
+            return oai_error("noRecordsMatch")
+
+        offset = int(offset)
+        page = "".join(oai_record(identifier, *self.repository[identifier])
+                       for identifier in identifiers[offset:offset + PAGE_SIZE])
+        if offset + PAGE_SIZE < len(identifiers):
+            page += "<resumptionToken>{}|{}|{}</resumptionToken>".format(offset + PAGE_SIZE, from_date, until)
+        return oai_response("ListRecords", page)
+
+    def list_records_requests(self):
+        return [{name: values[0] for name, values in query.items()} for _, _, query in self.server.requests]
+
+
+class ParseListRecordsTest(TestCase):
+
+    def test_records_are_transformed_and_deletions_kept(self):
+        _, page, _ = oai_response("ListRecords", oai_record("oai:open.bu.edu:2144/1", "2024-01-02") +
+                                  oai_record("oai:open.bu.edu:2144/2", "2024-01-03", deleted=True) +
+                                  "<resumptionToken>next</resumptionToken>")
+
+        records, resumption_token = parse_list_records(page.encode("utf-8"), rights_for=lambda identifier: "pd")
+
+        self.assertEqual(resumption_token, "next")
+        self.assertEqual([record[:3] for record in records], [("oai:open.bu.edu:2144/1", "2024-01-02", False),
+                                                              ("oai:open.bu.edu:2144/2", "2024-01-03", True)])
+        self.assertIsNone(records[1].marc_record)
+        marc_record = records[0].marc_record
+        self.assertEqual(get_title(marc_record), "oai:open.bu.edu:2144/1")
+        self.assertEqual([field.get("tag") for field in marc_record.iterfind("marc:datafield", OAI_NAMESPACES)],
+                         ["245", "100", "024", "924"])
+        self.assertEqual(marc_record.xpath('marc:datafield[@tag="024"]/marc:subfield/text()', namespaces=OAI_NAMESPACES),
+                         ["oai:open.bu.edu:2144/1", "public domain", "OpenBU", "http://hdl.handle.net/2144/1"])
+
+    def test_errors(self):
+        _, no_records, _ = oai_error("noRecordsMatch")
+        _, bad_token, _ = oai_error("badResumptionToken", "expired")
+
+        self.assertEqual(parse_list_records(no_records.encode("utf-8")), ([], None))
+        with self.assertRaisesRegex(OaiError, "badResumptionToken"):
+            parse_list_records(bad_token.encode("utf-8"))
+
+
+class ListRecordsTest(OaiStubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.repository = {"oai:open.bu.edu:2144/{}".format(number): ("2024-01-0{}".format(number), number == 3)
+                           for number in range(1, 6)}
+
+    def test_resumption_tokens_are_followed_to_the_last_page(self):
+        records = list(iter_list_records(transport=self.transport))
+
+        self.assertEqual([record.identifier for record in records], sorted(self.repository))
+        self.assertEqual([record.deleted for record in records], [False, False, True, False, False])
+        self.assertEqual(self.list_records_requests(), [
+            {"verb": "ListRecords", "metadataPrefix": "marc"},
+            {"verb": "ListRecords", "resumptionToken": "2||9999"},  # a token stands alone
+            {"verb": "ListRecords", "resumptionToken": "4||9999"}
+        ])
+
+    def test_windows_are_each_harvested_in_full(self):
+        harvester = OpenBUHarvester(transport=self.transport, max_workers=2, requests_per_second=None)
+
+        records = list(harvester.iter_records(date(2024, 1, 1), date(2024, 1, 6), window_days=2))
+
+        self.assertEqual(sorted(record.identifier for record in records), sorted(self.repository))
+        self.assertEqual(sorted((request.get("from"), request.get("until")) for request in self.list_records_requests()
+                                if "metadataPrefix" in request),
+                         [("2024-01-01", "2024-01-02"), ("2024-01-03", "2024-01-04"), ("2024-01-05", "2024-01-06")])
+
+    def test_a_failed_page_raises(self):
+        self.server.routes.insert(0, ("GET", OAI_PATH, lambda request: (503, "busy") if "resumptionToken" in request.query
+                                      else self.serve(request)))
+
+        with self.assertRaisesRegex(OaiError, "503"):
+            list(iter_list_records(transport=self.transport))
+
+
+class GetRecordPoolTest(OaiStubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.in_flight = self.most_in_flight = 0
+        self.lock = Lock()
+        self.server.routes.insert(0, ("GET", OAI_PATH, self.serve_record))
+
+    def serve_record(self, request):
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        identifier = request.query["identifier"][0]
+        return oai_response("GetRecord", oai_record(identifier, "2024-01-01"))
+
+    def test_get_record_requests_are_bounded_by_the_pool(self):
+        identifiers = ["oai:open.bu.edu:2144/{}".format(number) for number in range(6)]
+
+        results = dict(Dspace.get_many_openBU_results([(identifier, "pd") for identifier in identifiers],
+                                                      max_workers=2, requests_per_second=None))
+
+        self.assertEqual({identifier: get_title(marc_record) for identifier, (_, marc_record) in results.items()},
+                         {identifier: identifier for identifier in identifiers})
+        self.assertEqual(self.most_in_flight, 2)
+
+
+class HarvestChangesTest(OaiStubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = TemporaryDirectory()
+        self.state_path = join(self.directory.name, "state.sqlite")
+        self.harvester = OpenBUHarvester(transport=self.transport, requests_per_second=None)
+        self.repository = {"oai:open.bu.edu:2144/1": ("2024-01-01", False), "oai:open.bu.edu:2144/2": ("2024-01-02", False),
+                           "oai:open.bu.edu:2144/4": ("2024-01-03", False)}
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def harvest_changes(self, until):
+        """a harvest by a fresh `HarvestState`, as a new run of the script would -> (summary, identifiers written)"""
+        state, path = HarvestState(self.state_path), join(self.directory.name, "{}.xml".format(until))
+        try:
+            summary = self.harvester.harvest_changes(state, path, until=until)
+        finally:
+            state.close()
+        return summary, [get_title(record) for record in iter_marcxml_records(path)]
+
+    def test_later_harvests_only_fetch_what_changed(self):
+        first, first_written = self.harvest_changes(date(2024, 1, 3))
+        self.repository.update({"oai:open.bu.edu:2144/1": ("2024-01-05", True),  # deleted
+                                "oai:open.bu.edu:2144/2": ("2024-01-05", False),  # changed
+                                "oai:open.bu.edu:2144/3": ("2024-01-04", False)})  # new
+        second, second_written = self.harvest_changes(date(2024, 1, 6))
+
+        self.assertEqual([request.get("from") for request in self.list_records_requests() if "metadataPrefix" in request],
+                         [None, "2024-01-03"])
+        self.assertEqual((first["new"], first["from"], first["until"]), (3, None, "2024-01-03"))
+        self.assertEqual(first_written, sorted(self.repository)[:2] + ["oai:open.bu.edu:2144/4"])
+        self.assertEqual({key: second[key] for key in ("new", "changed", "unchanged", "deleted", "from")},
+                         {"new": 1, "changed": 1, "unchanged": 1, "deleted": 1, "from": "2024-01-03"})
+        self.assertEqual(second["deleted_identifiers"], ["oai:open.bu.edu:2144/1"])
+        self.assertEqual(second_written, ["oai:open.bu.edu:2144/2", "oai:open.bu.edu:2144/3"])
+
+        state = HarvestState(self.state_path)
+        try:
+            self.assertEqual(state.get_last_harvested("openbu"), "2024-01-06")
+            self.assertEqual(state.get_deleted_identifiers(), ["oai:open.bu.edu:2144/1"])
+            self.assertEqual(state.stats(), {"records": 4, "deleted_records": 1})
+        finally:
+            state.close()
+
+    def test_a_failed_harvest_leaves_the_state_as_it_was(self):
+        self.harvest_changes(date(2024, 1, 3))
+        self.repository.update({"oai:open.bu.edu:2144/{}".format(number): ("2024-01-04", False) for number in (5, 6, 7)})
+        self.server.routes.insert(0, ("GET", OAI_PATH, lambda request: (503, "busy") if "resumptionToken" in request.query
+                                      else self.serve(request)))
+
+        with self.assertRaises(OaiError):
+            self.harvest_changes(date(2024, 1, 6))
+        self.server.routes.pop(0)
+        retried, written = self.harvest_changes(date(2024, 1, 6))
+
+        self.assertEqual((retried["from"], retried["new"], retried["unchanged"]), ("2024-01-03", 3, 1))
+        self.assertEqual(written, ["oai:open.bu.edu:2144/{}".format(number) for number in (5, 6, 7)])
@@ -0,0 +1,53 @@
+from os.path import abspath, dirname
+from subprocess import run
+from sys import executable
+from unittest import TestCase
+
+from src.benchmarks.import_time import DEFERRED_IMPORTS, measure_import
+
+REPO_DIRECTORY = dirname(dirname(dirname(abspath(__file__))))
+
+
+def run_python(code):
+    """run `code` in a fresh interpreter (so nothing is already imported) from the repository's root -> its stdout"""
+    result = run([executable, "-c", code], cwd=REPO_DIRECTORY, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+class ImportRootTest(TestCase):
+
+    def test_services_modules_import_under_a_single_root(self):
+        loaded = run_python(
+            "import sys\n"
+            "import src.services.analytics, src.services.bibs, src.services.harvest, src.services.jobs\n"
+            "print(sorted(name for name in sys.modules if name.split('.')[0] == 'services'))"
+        )
+        self.assertEqual(loaded, "[]")
+
+
+class DeferredImportTest(TestCase):
+    """the check `python -m src.benchmarks.import_time --check` makes (measured once per module rather than best-of-5)"""
+
+    def test_heavy_dependencies_are_deferred(self):
+        for module, deferred in DEFERRED_IMPORTS.items():
+            with self.subTest(module=module):
+                _, heavy_imports = measure_import(module)
+                self.assertEqual([name for name in heavy_imports if name in deferred], [])
+
+    def test_every_services_module_is_checked(self):
+        modules = run_python(
+            "import pkgutil, src.services\n"
+            "print(sorted(name for _, name, _ in pkgutil.iter_modules(src.services.__path__)))"
+        )
+        self.assertEqual(modules, str(sorted(module.rsplit(".", 1)[-1] for module in DEFERRED_IMPORTS
+                                             if module != "src.services")))
+
+    def test_async_services_are_still_available_from_their_modules(self):
+        for module, name in (("bibs", "AsyncAlmaBibs"), ("analytics", "AsyncAlmaAnalytics"),
+                             ("analytics", "AsyncPrimoAnalytics"), ("primo", "AsyncPrimo"), ("dspace", "AsyncDspace")):
+            with self.subTest(name=name):
+                loaded = run_python(
+                    "import sys, src.services.{0} as module\n"
+                    "print('asyncio' in sys.modules, module.{1}.__module__, 'asyncio' in sys.modules)".format(module, name)
+                )
+                self.assertEqual(loaded, "False src.services.async_{} True".format(module))
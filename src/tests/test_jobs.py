@@ -0,0 +1,149 @@
+from json import loads
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from lxml import etree
+
+from src.services.jobs import run_bib_updates, run_holdings_updates, run_representation_loads
+from src.tests.alma_stub import AlmaStubTestCase, xml_response
+
+BIB = ('<bib><mms_id>{}</mms_id><record><leader>00000nam a2200000 i 4500</leader>'
+       '<datafield tag="245" ind1="0" ind2="0"><subfield code="a">A title</subfield></datafield></record></bib>')
+HOLDINGS = ('<holding><holding_id>{}</holding_id><record><leader>00000nx  a2200000zn 4500</leader>'
+            '<datafield tag="852" ind1="0" ind2=" "><subfield code="b">MUG</subfield></datafield></record></holding>')
+
+
+def add_note(record):
+    """a transform that adds a 500 note to a bib or holdings record"""
+    field = etree.SubElement(record.find("record"), "datafield", tag="500", ind1=" ", ind2=" ")
+    etree.SubElement(field, "subfield", code="a").text = "A note"
+    return record
+
+
+def echo_body(request):
+    """Alma answers a successful PUT with the record as saved"""
+    return xml_response(request.body.decode("utf-8"))
+
+
+class JobStubTestCase(AlmaStubTestCase):
+    """journals jobs to a temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = TemporaryDirectory()
+        journal_directory = patch("src.services.jobs.JOURNAL_DIRECTORY", self.directory.name)
+        journal_directory.start()
+        self.addCleanup(journal_directory.stop)
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def read_journal(self, job_name):
+        """the latest journal entry for each id"""
+        with open("{}/{}.jsonl".format(self.directory.name, job_name), encoding="utf-8") as journal_file:
+            return {entry["id"]: entry for entry in map(loads, journal_file)}
+
+
+class RunBibUpdatesTest(JobStubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.route("GET", r"/bibs/(\d+)", lambda request: xml_response(BIB.format(request.groups[0])))
+        self.route("PUT", r"/bibs/(\d+)", echo_body)
+
+    def test_updates_are_journaled_as_done(self):
+        summary = run_bib_updates(self.alma, ["11", "22"], add_note, "bib-updates", skip_unchanged=False)
+        resumed = run_bib_updates(self.alma, ["11", "22"], add_note, "bib-updates", skip_unchanged=False)
+
+        self.assertEqual(summary, {"done": 2, "failed": 0, "skipped": 0})
+        self.assertEqual(resumed, {"done": 0, "failed": 0, "skipped": 2})
+        self.assertEqual({key: entry["status"] for key, entry in self.read_journal("bib-updates").items()},
+                         {"11": "done", "22": "done"})
+        self.assertEqual(self.count_requests("PUT", r"/bibs/\d+"), 2)
+
+    def test_only_changed_bibs_are_updated(self):
+        def add_note_to_bib_11(bib):
+            return add_note(bib) if bib.findtext("mms_id") == "11" else bib
+
+        summary = run_bib_updates(self.alma, ["11", "22"], add_note_to_bib_11, "changed-bibs")
+        resumed = run_bib_updates(self.alma, ["11", "22"], add_note_to_bib_11, "changed-bibs")
+
+        self.assertEqual(summary, {"done": 2, "failed": 0, "skipped": 0, "updated": 1, "unchanged": 1})
+        self.assertEqual(resumed, {"done": 0, "failed": 0, "skipped": 2, "updated": 0, "unchanged": 0})
+        journal = self.read_journal("changed-bibs")
+        self.assertEqual({key: (entry["status"], entry["result"]["outcome"]) for key, entry in journal.items()},
+                         {"11": ("done", "updated"), "22": ("done", "unchanged")})
+        self.assertTrue(journal["11"]["result"]["changes"])
+        self.assertEqual(self.count_requests("PUT", r"/bibs/\d+"), 1)
+
+
+class RunHoldingsUpdatesTest(JobStubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.route("GET", r"/bibs/(\d+)/holdings/(\d+)", lambda request: xml_response(HOLDINGS.format(request.groups[1])))
+        self.route("PUT", r"/bibs/(\d+)/holdings/(\d+)", echo_body)
+
+    def test_updates_are_journaled_as_done(self):
+        ids = [("11", "111"), ("11", "112")]
+        summary = run_holdings_updates(self.alma, ids, add_note, "holdings-updates")
+        resumed = run_holdings_updates(self.alma, ids, add_note, "holdings-updates")
+
+        self.assertEqual(summary, {"done": 2, "failed": 0, "skipped": 0})
+        self.assertEqual(resumed, {"done": 0, "failed": 0, "skipped": 2})
+        self.assertEqual({key: entry["status"] for key, entry in self.read_journal("holdings-updates").items()},
+                         {"11:111": "done", "11:112": "done"})
+        self.assertEqual(self.count_requests("PUT", r"/bibs/\d+/holdings/\d+"), 2)
+
+
+class RunRepresentationLoadsTest(JobStubTestCase):
+    rows = [("11", "oai:open.bu.edu:2144/1", "pd", "ia"), ("22", "oai:open.bu.edu:2144/2", "pd", "ia")]
+
+    def setUp(self):
+        super().setUp()
+        # bib 11 already has a representation of its row's identifier
+        self.route("GET", r"/bibs/(\d+)/representations", lambda request: xml_response(
+            '<representations total_record_count="1"><representation><id>{}0</id>'
+            '<originating_record_id>oai%3Aopen.bu.edu%3A2144%2F1</originating_record_id></representation>'
+            '</representations>'.format(request.groups[0])))
+        self.post_response = lambda request: xml_response("<representation><id>{}9</id></representation>".format(
+            request.groups[0]))
+        self.route("POST", r"/bibs/(\d+)/representations", lambda request: self.post_response(request))
+
+    def read_results(self, job_name):
+        return {key: (entry["status"], entry.get("result")) for key, entry in self.read_journal(job_name).items()}
+
+    def test_existing_representations_are_kept(self):
+        summary = run_representation_loads(self.alma, self.rows, "representations")
+
+        self.assertEqual(summary, {"done": 2, "failed": 0, "skipped": 0})
+        self.assertEqual(self.read_results("representations"), {
+            "11:oai:open.bu.edu:2144/1": ("done", {"outcome": "already present", "representation_id": "110"}),
+            "22:oai:open.bu.edu:2144/2": ("done", {"outcome": "added", "representation_id": "229"})
+        })
+        self.assertEqual(self.count_requests("POST", r"/bibs/\d+/representations"), 1)
+
+    def test_unreadable_response_to_an_added_representation_is_not_retried(self):
+        self.post_response = lambda request: (200, "<representation><id>", {"Content-Type": "application/xml"})
+
+        summary = run_representation_loads(self.alma, self.rows, "representations", skip_existing=False)
+        resumed = run_representation_loads(self.alma, self.rows, "representations", skip_existing=False)
+
+        self.assertEqual(summary, {"done": 2, "failed": 0, "skipped": 0})
+        self.assertEqual(resumed, {"done": 0, "failed": 0, "skipped": 2})
+        self.assertEqual({key: result for key, (_, result) in self.read_results("representations").items()}, {
+            "11:oai:open.bu.edu:2144/1": {"outcome": "added", "representation_id": None},
+            "22:oai:open.bu.edu:2144/2": {"outcome": "added", "representation_id": None}
+        })
+        self.assertEqual(self.count_requests("POST", r"/bibs/\d+/representations"), 2)
+
+    def test_failed_post_is_retried_on_resume(self):
+        self.post_response = lambda request: xml_response("<web_service_result/>", status=400)
+        run_representation_loads(self.alma, self.rows[1:], "representations")
+        self.post_response = lambda request: xml_response("<representation><id>229</id></representation>")
+
+        resumed = run_representation_loads(self.alma, self.rows[1:], "representations")
+
+        self.assertEqual(resumed, {"done": 1, "failed": 0, "skipped": 0})
+        self.assertEqual(self.count_requests("POST", r"/bibs/\d+/representations"), 2)
@@ -0,0 +1,131 @@
+from io import StringIO
+from json import loads
+from re import fullmatch
+from threading import Thread
+from time import sleep
+from unittest import TestCase
+
+from src.services.logs import BufferedWriter, configure_logging, flush_logs, get_logger, render_json
+
+
+class Unformattable:
+    """an argument that fails the test if a message is ever formatted with it"""
+
+    def __format__(self, format_spec):
+        raise AssertionError("the message was formatted")
+
+
+class LoggerTest(TestCase):
+
+    def setUp(self):
+        self.stream = StringIO()
+        self.addCleanup(configure_logging)
+        self.logger = get_logger("test_logs.py")
+
+    def configure(self, **settings):
+        configure_logging(stream=self.stream, **settings)
+
+    def lines(self):
+        flush_logs()
+        return self.stream.getvalue().splitlines()
+
+    def test_records_below_the_level_are_dropped_before_they_are_formatted(self):
+        self.configure(level="WARN", output_format="json")
+
+        self.logger.debug("{}", Unformattable())
+        self.logger.info("{}", Unformattable(), sample="request")
+        self.logger.warning("{} of {}", 1, 2)
+
+        self.assertTrue(self.logger.is_enabled("ERROR"))
+        self.assertFalse(self.logger.is_enabled("INFO"))
+        self.assertEqual([loads(line)["message"] for line in self.lines()], ["1 of 2"])
+
+    def test_sampled_records_are_written_one_in_every_n(self):
+        self.configure(output_format="json", sample_rates="request=3")
+
+        for number in range(7):
+            self.logger.info("request {}", number, sample="request")
+            self.logger.info("response {}", number, sample="response")  # no rate given, so every one is written
+
+        messages = [loads(line)["message"] for line in self.lines()]
+        self.assertEqual([message for message in messages if message.startswith("request")],
+                         ["request 0", "request 3", "request 6"])
+        self.assertEqual(len([message for message in messages if message.startswith("response")]), 7)
+
+    def test_json_lines_carry_the_extra_fields(self):
+        self.configure(output_format="json")
+
+        self.logger.error("unable to update bib {}", "99", mms_id="99", status=400, path=("bibs", "99"))
+
+        record = loads(self.lines()[0])
+        self.assertEqual({key: value for key, value in record.items() if key != "time"},
+                         {"level": "ERROR", "module": "test_logs.py", "message": "unable to update bib 99",
+                          "mms_id": "99", "status": 400, "path": ["bibs", "99"]})
+        self.assertTrue(fullmatch(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}", record["time"]), record["time"])
+
+    def test_json_renders_what_it_cannot_serialize_as_text(self):
+        record = loads(render_json({"time": 1700000000.25, "level": "INFO", "module": "m", "message": "",
+                                    "error": ValueError("bad")}))
+
+        self.assertEqual(record["error"], "bad")
+        self.assertTrue(record["time"].endswith(".250"))
+
+    def test_text_lines_are_in_the_usual_format(self):
+        self.configure()
+
+        self.logger.info("done", count=2)
+
+        self.assertTrue(fullmatch(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d \| test_logs.py \[INFO\] \| done", self.lines()[0]))
+
+
+class BufferedWriterTest(TestCase):
+
+    def setUp(self):
+        self.stream = StringIO()
+        self.writer = BufferedWriter(self.stream, flush_interval=0.01)
+        self.addCleanup(self.writer.close)
+
+    def test_lines_are_written_in_the_background(self):
+        for number in range(100):
+            self.writer.write(str(number))
+        sleep(0.5)
+
+        self.assertEqual(self.stream.getvalue().splitlines(), [str(number) for number in range(100)])
+
+    def test_a_flush_racing_the_background_thread_keeps_lines_in_order(self):
+        with self.writer._lock:  # hold the background thread up as it wakes for the first line
+            self.writer.write("1")
+            sleep(0.1)
+            self.writer.write("2")
+        self.writer.flush()
+        sleep(0.1)
+
+        self.assertEqual(self.stream.getvalue().splitlines(), ["1", "2"])
+
+    def test_flushes_from_many_threads_keep_lines_in_order(self):
+        def write_and_flush(start):
+            for number in range(start, start + 500):
+                self.writer.write(str(number))
+                if number % 7 == 0:
+                    self.writer.flush()
+
+        threads = [Thread(target=write_and_flush, args=(start,)) for start in (0, 500, 1000, 1500)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.writer.flush()
+
+        lines = [int(line) for line in self.stream.getvalue().splitlines()]
+        self.assertEqual(sorted(lines), list(range(2000)))
+        for start in (0, 500, 1000, 1500):
+            self.assertEqual([number for number in lines if start <= number < start + 500],
+                             list(range(start, start + 500)))
+
+    def test_close_writes_what_is_left(self):
+        writer = BufferedWriter(self.stream, flush_interval=60)
+        writer.write("last")
+        writer.close()
+        writer.write("after")  # too late: nothing will write it
+
+        self.assertEqual(self.stream.getvalue(), "last\n")
@@ -0,0 +1,75 @@
+from io import BytesIO
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from lxml import etree
+
+from src.services.pipeline import iter_marcxml_chunks, transform_marcxml_file_in_parallel
+from src.services.record_utils import MARC_NAMESPACE, iter_marcxml_records, sort_marc_tags
+
+# prefixed MARC records, with a comment, an empty record, a non-MARC 'record' and a tag that merely starts with 'record'
+PREFIXED_COLLECTION = ("<?xml version='1.0' encoding='utf-8'?>\n<!-- exported <record> -->\n"
+                       '<marc:collection xmlns:marc="{}" xmlns:other="urn:other">'.format(MARC_NAMESPACE) +
+                       "".join('<marc:record><marc:leader>00000nam a2200000 i 4500</marc:leader>'
+                               '<marc:datafield tag="500" ind1=" " ind2=" "><marc:subfield code="a">note {0}'
+                               '</marc:subfield></marc:datafield><marc:controlfield tag="001">{0}</marc:controlfield>'
+                               '<marc:recordType>x</marc:recordType></marc:record>\n'.format(number)
+                               for number in range(7)) +
+                       '<marc:record/><other:record>not MARC</other:record></marc:collection>').encode("utf-8")
+
+# records with comments, CDATA sections and processing instructions around and inside them that look like record tags
+ANNOTATED_COLLECTION = ("<?xml version='1.0' encoding='utf-8'?>\n"
+                        '<marc:collection xmlns:marc="{}">'.format(MARC_NAMESPACE) +
+                        '<!-- moved <marc:record><marc:controlfield tag="001">x</marc:controlfield></marc:record> -->'
+                        '<marc:record><marc:controlfield tag="001">0</marc:controlfield>'
+                        '<!-- </marc:record> --><?check </marc:record>?></marc:record>\n'
+                        '<?page <marc:record/> ?><![CDATA[ <marc:record> ]]>'
+                        '<marc:record><marc:controlfield tag="001">1</marc:controlfield><marc:datafield tag="500" '
+                        'ind1=" " ind2=" "><marc:subfield code="a"><![CDATA[a </marc:record> note]]></marc:subfield>'
+                        '</marc:datafield></marc:record><!---->'
+                        '<marc:record><marc:controlfield tag="001">2</marc:controlfield><marc:datafield tag="245" '
+                        'ind1="0" ind2="0"><marc:subfield code="a">Why? Because!</marc:subfield></marc:datafield>'
+                        '</marc:record>'
+                        '<!-- the end --></marc:collection>').encode("utf-8")
+
+
+def drop_even_records(record):
+    control_number = record.findtext("{%s}controlfield" % MARC_NAMESPACE)
+    return None if control_number is not None and int(control_number) % 2 == 0 else record
+
+
+class PipelineTest(TestCase):
+
+    def test_chunks_hold_every_record_whatever_the_block_size(self):
+        for block_size in (1, 7, 100, 1024 * 1024):
+            chunks = list(iter_marcxml_chunks(BytesIO(PREFIXED_COLLECTION), 3, block_size))
+
+            records = [record for chunk in chunks for record in etree.fromstring(chunk)]
+            self.assertEqual([len(etree.fromstring(chunk)) for chunk in chunks], [3, 3, 3])
+            self.assertEqual([record.findtext("{%s}controlfield" % MARC_NAMESPACE) for record in records],
+                             ["0", "1", "2", "3", "4", "5", "6", None, None])
+
+    def test_comments_cdata_and_processing_instructions_are_passed_over(self):
+        for block_size in (1, 5, 100, 1024 * 1024):
+            chunks = list(iter_marcxml_chunks(BytesIO(ANNOTATED_COLLECTION), 2, block_size))
+
+            records = [record for chunk in chunks for record in etree.fromstring(chunk)]
+            self.assertEqual([record.findtext("{%s}controlfield" % MARC_NAMESPACE) for record in records],
+                             ["0", "1", "2"])
+            self.assertEqual(records[1].findtext(".//{%s}subfield" % MARC_NAMESPACE), "a </marc:record> note")
+
+    def test_transform_file_in_parallel(self):
+        with TemporaryDirectory() as directory:
+            source, target = join(directory, "records.xml"), join(directory, "sorted.xml")
+            with open(source, "wb") as source_file:
+                source_file.write(PREFIXED_COLLECTION)
+
+            count = transform_marcxml_file_in_parallel(source, target, [drop_even_records, sort_marc_tags],
+                                                       processes=2, chunk_size=2)
+            records = [etree.tostring(record) for record in iter_marcxml_records(target)]
+
+        self.assertEqual(count, 4)  # the odd records, and the empty one (the non-MARC record isn't passed on)
+        self.assertEqual([etree.fromstring(record).findtext("{%s}controlfield" % MARC_NAMESPACE) for record in records],
+                         ["1", "3", "5", None])
+        self.assertEqual([child.get("tag") for child in etree.fromstring(records[0])], [None, "001", "500", None])
@@ -0,0 +1,85 @@
+from json import dumps
+from time import perf_counter
+from unittest import TestCase
+from unittest.mock import patch
+
+from src.services.primo import Primo, PrimoRecord, PrimoSearchError
+from src.services.transport import HttpTransport
+from src.tests.http_stub import StubServer
+
+SEARCH_PATH = "/PrimoWebServices/xservice/search/brief"
+
+# search string -> the titles of its results
+RESULTS = {
+    "war": ["War {}".format(number) for number in range(1, 6)],
+    "peace": ["Peace"]
+}
+
+
+def primo_doc(title):
+    """a result doc as primo returns it: lists for some fields, a lone value for others"""
+    return {"PrimoNMBib": {"record": {
+        "control": {"sourceid": "alma"},
+        "delivery": {"delcategory": ["Alma-P"]},
+        "search": {"recordid": "alma" + title, "title": title, "creatorcontrib": "Author, An", "creationdate": ["2001"]}
+    }}}
+
+
+def search_results(request):
+    """a page of results for the search, or a 500 for any search there are no results for"""
+    search_string = request.query["query"][0].split(",", 2)[2]
+    if search_string not in RESULTS:
+        return 500, "oops"
+    titles = RESULTS[search_string]
+    indx, bulk_size = int(request.query["indx"][0]), int(request.query["bulkSize"][0])
+    docs = [primo_doc(title) for title in titles[indx - 1:indx - 1 + bulk_size]]
+    docset = {"@TOTALHITS": str(len(titles)), "DOC": docs[0] if len(docs) == 1 else docs}
+    return 200, dumps({"SEGMENTS": {"JAGROOT": {"RESULT": {"DOCSET": docset}}}}), {"Content-Type": "application/json"}
+
+
+class PrimoSearchTest(TestCase):
+
+    def setUp(self):
+        self.server = StubServer().__enter__()
+        self.server.route("GET", SEARCH_PATH, search_results)
+        self.transport = HttpTransport()
+        search_url = patch("src.services.primo.PRIMO_SEARCH_URL", self.server.url + SEARCH_PATH)
+        search_url.start()
+        self.addCleanup(search_url.stop)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.__exit__(None, None, None)
+
+    def test_search_pages_through_every_result(self):
+        records = Primo.search_primo("war", bulk_size=2, transport=self.transport)
+
+        self.assertEqual([record.title for record in records], RESULTS["war"])
+        self.assertEqual(records[0], PrimoRecord("alma", "Alma-P", "almaWar 1", "War 1", ("Author, An",), "2001"))
+        self.assertEqual([query["indx"][0] for _, _, query in self.server.requests], ["1", "3", "5"])
+
+    def test_search_stops_at_max_results(self):
+        records = Primo.search_primo("war", bulk_size=2, max_results=3, transport=self.transport)
+
+        self.assertEqual([record.title for record in records], ["War 1", "War 2", "War 3"])
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_search_many_yields_a_pair_per_record(self):
+        results = list(Primo.search_many(["war", "peace", "missing"], bulk_size=2, max_workers=3,
+                                         requests_per_second=None, transport=self.transport))
+
+        self.assertEqual(sorted((search_string, record.title) for search_string, record in results
+                                if not isinstance(record, Exception)),
+                         [("peace", "Peace")] + [("war", title) for title in RESULTS["war"]])
+        self.assertEqual([(search_string, type(error)) for search_string, error in results
+                          if isinstance(error, Exception)], [("missing", PrimoSearchError)])
+
+    def test_search_many_paces_every_page_requested(self):
+        started_at = perf_counter()
+        results = list(Primo.search_many(["war", "peace"], bulk_size=1, max_workers=2, requests_per_second=20,
+                                         transport=self.transport))
+        seconds = perf_counter() - started_at
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertGreaterEqual(seconds, 5 / 20)  # six requests, a twentieth of a second apart
@@ -0,0 +1,73 @@
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from src.services.primo import PrimoRecord
+from src.services.primo_matching import PrimoMatcher, PrimoSearchStore
+
+RECORDS = {
+    "War and peace": [PrimoRecord("alma", "Alma-P", "alma1", "War and peace", ("Tolstoy, Leo",), "1869")],
+    "War": [PrimoRecord("alma", "Alma-P", "alma2", "War", ("Keegan, John",), "1993")]
+}
+
+
+class PrimoMatcherTest(TestCase):
+
+    def setUp(self):
+        search_primo = patch("src.services.primo_matching.Primo.search_primo",
+                             side_effect=lambda search_string, *args, **kwargs: RECORDS.get(search_string.strip(), []))
+        self.search_primo = search_primo.start()
+        self.addCleanup(search_primo.stop)
+
+    def searches_sent(self):
+        return [call.args[0] for call in self.search_primo.call_args_list]
+
+    def test_primo_is_sent_the_search_string_as_given(self):
+        matcher = PrimoMatcher()
+
+        records = matcher.search("War and peace")
+        repeated = matcher.search("  war AND peace. ")
+
+        self.assertEqual(records, RECORDS["War and peace"])
+        self.assertEqual(repeated, RECORDS["War and peace"])
+        self.assertEqual(self.searches_sent(), ["War and peace"])
+
+    def test_index_only_answers_exact_titles(self):
+        matcher = PrimoMatcher()
+        matcher.search("War and peace")
+
+        self.assertEqual(matcher.search("War"), RECORDS["War"])
+        self.assertEqual(matcher.search("WAR and Peace!"), RECORDS["War and peace"])
+        self.assertEqual(self.searches_sent(), ["War and peace", "War"])
+        self.assertEqual(matcher.stats()["memory_hits"], 1)
+
+    def test_index_answers_title_prefixes_when_asked_to(self):
+        matcher = PrimoMatcher(match_title_prefixes=True)
+        matcher.search("War and peace")
+
+        self.assertEqual(matcher.search("War and"), RECORDS["War and peace"])
+        self.assertEqual(matcher.stats()["index_hits"], 1)
+
+    def test_search_many_sends_each_distinct_search_once_as_given(self):
+        matcher = PrimoMatcher()
+
+        results = list(matcher.search_many(["War and peace", "war and peace", "War"], max_workers=1))
+
+        self.assertEqual(sorted(self.searches_sent()), ["War", "War and peace"])
+        self.assertEqual(dict(results)["war and peace"], RECORDS["War and peace"])
+
+    def test_stored_searches_load_as_they_were_found(self):
+        with TemporaryDirectory() as directory:
+            store = PrimoSearchStore(join(directory, "searches.sqlite"))
+            try:
+                PrimoMatcher(store=store).search("War and peace")
+                matcher = PrimoMatcher(store=store)
+                records = matcher.search("War and peace")
+            finally:
+                store.close()
+
+        self.assertEqual(records, RECORDS["War and peace"])
+        self.assertIsInstance(records[0].creators, tuple)
+        self.assertEqual(matcher.stats()["store_hits"], 1)
+        self.assertEqual(self.searches_sent(), ["War and peace"])
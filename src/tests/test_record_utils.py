@@ -0,0 +1,251 @@
+from io import BytesIO
+from os.path import join
+from re import sub
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from lxml import etree
+
+from src.services.record_utils import MARC_NAMESPACE, MAX_FIELD_LENGTH, MAX_RECORD_LENGTH, ControlField, DataField, \
+    MarcCollectionWriter, MarcRecord, MarcRecordIndex, decode_iso2709, encode_iso2709, get_marc_fields, has_marc_field, \
+    iter_iso2709_records, iter_marcxml_records, make_field, sort_marc_tags, sort_marc_tags_in_batch, write_iso2709_records
+
+BIB = ('<bib><mms_id>11</mms_id><record xmlns="{}"><leader>00000nam a2200000 i 4500</leader>'
+       '<controlfield tag="001">11</controlfield>'
+       '<datafield tag="650" ind1=" " ind2="0"><subfield code="a">Cats</subfield><subfield code="x">History</subfield>'
+       '</datafield>'
+       '<datafield tag="245" ind1="0" ind2="0"><subfield code="a">A title</subfield></datafield>'
+       '<datafield tag="650" ind1=" " ind2="0"><subfield code="a">Dogs</subfield></datafield>'
+       '</record></bib>').format(MARC_NAMESPACE)
+
+MARCXML = ('<record xmlns="{}" type="Bibliographic"><leader>01234cam a2200289 i 4500</leader>'
+           '<controlfield tag="001">99123</controlfield><controlfield tag="008">200101s2020    mau      b    001 0 eng d'
+           '</controlfield>'
+           '<datafield tag="020" ind1=" " ind2=" "><subfield code="a">9780000000001</subfield></datafield>'
+           '<datafield tag="245" ind1="1" ind2="0"><subfield code="a">Caf\u00e9s &amp; bars :</subfield>'
+           '<subfield code="b">a  history /</subfield><subfield code="c"/></datafield>'
+           '<datafield tag="650" ind1=" " ind2="0"><subfield code="a">Coffee</subfield><subfield code="x">History</subfield>'
+           '<subfield code="x">Sources</subfield></datafield>'
+           '<controlfield tag="005">20200101000000.0</controlfield>'
+           '</record>').format(MARC_NAMESPACE)
+
+
+def canonical(marcxml):
+    return etree.tostring(etree.fromstring(marcxml), method="c14n")
+
+
+class MarcRecordIndexTest(TestCase):
+
+    def setUp(self):
+        self.bib = etree.fromstring(BIB)
+        self.index = MarcRecordIndex(self.bib)
+
+    def test_lookups_match_a_scan_of_the_record(self):
+        for tag in ("001", "245", "650", "700"):
+            with self.subTest(tag=tag):
+                self.assertEqual(self.index.get_fields(tag), get_marc_fields(tag, self.bib))
+                self.assertEqual(get_marc_fields(tag, self.index), get_marc_fields(tag, self.bib))
+                self.assertEqual(has_marc_field(tag, self.index), has_marc_field(tag, self.bib))
+        self.assertEqual(self.index.get_fields("000"), [self.bib.find("{*}record/{*}leader")])
+        self.assertEqual(self.index.tags(), ["000", "001", "650", "245"])
+        self.assertEqual(self.index.get_subfield_values("650", "a"), ["Cats", "Dogs"])
+        self.assertEqual(self.index.get_first_subfield_value("650", "x"), "History")
+        self.assertEqual(self.index.get_first_subfield_value("245", "c", "none"), "none")
+
+    def test_changes_made_through_the_index_keep_it_current(self):
+        self.index.get_fields("650")  # build the index before changing the record
+        self.index.add_field(make_field({"tag": "700", "ind1": "1", "ind2": " "}, [{"code": "a", "text": "Smith"}]))
+        removed = self.index.remove_fields("650")
+
+        self.assertEqual(removed, 2)
+        self.assertFalse(has_marc_field("650", self.index))
+        self.assertEqual(self.index.get_subfield_values("700", "a"), ["Smith"])
+        self.assertEqual([field.get("tag") for field in self.bib.find("{*}record")], [None, "001", "245", "700"])
+
+    def test_changes_made_elsewhere_need_an_invalidate(self):
+        self.index.get_fields("245")
+        record = self.bib.find("{*}record")
+        record.remove(record.find("{*}datafield[@tag='245']"))
+
+        self.assertTrue(self.index.has_field("245"))
+        self.index.invalidate()
+        self.assertFalse(self.index.has_field("245"))
+
+    def test_a_bib_without_a_record_is_refused(self):
+        with self.assertRaises(ValueError):
+            MarcRecordIndex(etree.fromstring("<bib><mms_id>11</mms_id></bib>"))
+
+
+class MarcRecordTest(TestCase):
+
+    def test_marcxml_round_trip_is_lossless(self):
+        record = MarcRecord.from_marcxml(MARCXML)
+
+        self.assertEqual(canonical(record.to_marcxml()), canonical(MARCXML))
+        self.assertEqual((record.namespace, record.record_type), (MARC_NAMESPACE, "Bibliographic"))
+        self.assertEqual(record.get_fields("001", "005"), [ControlField("001", "99123"),
+                                                           ControlField("005", "20200101000000.0")])
+        self.assertEqual(record.get_fields("245")[0].subfields, [("a", "Caf\u00e9s & bars :"), ("b", "a  history /"),
+                                                                 ("c", None)])
+        self.assertEqual(record.get_fields("650")[0].get_values("x"), ["History", "Sources"])
+
+    def test_namespace_prefixes_and_unqualified_records(self):
+        prefixed = sub(r"<(/?)", r"<\1marc:", MARCXML).replace("xmlns=", "xmlns:marc=")
+        bare = etree.tostring(etree.fromstring('<bib><mms_id>99123</mms_id><record><leader>00000nam a2200000 i 4500'
+                                               '</leader><controlfield tag="001">99123</controlfield></record></bib>'))
+
+        from_prefixed = MarcRecord.from_marcxml(prefixed)
+        from_bare = MarcRecord.from_marcxml(bare)
+
+        self.assertEqual(from_prefixed, MarcRecord.from_marcxml(MARCXML))
+        self.assertEqual(canonical(from_prefixed.to_marcxml()), canonical(MARCXML))  # the same document, unprefixed
+        self.assertIsNone(from_bare.namespace)
+        self.assertEqual(etree.QName(from_bare.to_element()).text, "record")
+        self.assertEqual(etree.QName(from_bare.to_element(MARC_NAMESPACE)).namespace, MARC_NAMESPACE)
+        self.assertEqual(MarcRecord.from_element(from_bare.to_element()), from_bare)
+
+    def test_records_built_in_memory(self):
+        record = MarcRecord("00000nam a2200000 i 4500", [ControlField("001", "1")], MARC_NAMESPACE)
+        record.add_field(DataField("500", subfields=[("a", "A note")]))
+        record.add_field(DataField("020", subfields=[("a", "1"), ("a", "2")]))
+
+        self.assertEqual(MarcRecord.from_marcxml(record.sort_fields().to_marcxml()), record)
+        self.assertEqual([field.tag for field in record.fields], ["001", "020", "500"])
+        self.assertEqual(record.remove_fields("020", "500"), 2)
+
+
+class MarcCollectionTest(TestCase):
+
+    def test_collection_round_trip(self):
+        alma_record = etree.fromstring(BIB.replace(' xmlns="{}"'.format(MARC_NAMESPACE), "")).find("record")
+        records = [MarcRecord.from_marcxml(MARCXML), MarcRecord("00000nam a2200000 i 4500", [ControlField("001", "2")]),
+                   alma_record]
+        collection = BytesIO()
+
+        with MarcCollectionWriter(collection) as writer:
+            for record in records:
+                writer.write(record)
+        read_back = list(iter_marcxml_records(BytesIO(collection.getvalue()), as_model=True))
+
+        self.assertEqual(writer.records_written, 3)
+        self.assertEqual(etree.QName(etree.fromstring(collection.getvalue())).text, "{%s}collection" % MARC_NAMESPACE)
+        # every record lands in the collection's namespace, whatever it was in before
+        self.assertEqual([record.namespace for record in read_back], [MARC_NAMESPACE] * 3)
+        self.assertEqual(read_back[0], records[0])
+        self.assertEqual(read_back[1].fields, records[1].fields)
+        self.assertEqual(read_back[2].fields, MarcRecord.from_element(alma_record).fields)
+
+    def test_records_are_streamed_from_a_file(self):
+        with TemporaryDirectory() as directory:
+            path = join(directory, "records.xml")
+            with MarcCollectionWriter(path) as writer:
+                for number in range(500):
+                    writer.write(MarcRecord("00000nam a2200000 i 4500", [ControlField("001", str(number))]))
+
+            control_numbers, records_before = [], set()
+            for record in iter_marcxml_records(path):
+                control_numbers.append(record.findtext("{%s}controlfield" % MARC_NAMESPACE))
+                records_before.add(sum(1 for _ in record.itersiblings(preceding=True)))
+
+        self.assertEqual(control_numbers, [str(number) for number in range(500)])
+        self.assertEqual(records_before, {0, 1})  # only the record just read is still held, emptied
+
+
+class Iso2709Test(TestCase):
+
+    def setUp(self):
+        self.record = MarcRecord("01234cam a2200289 i 4500", [
+            ControlField("001", "99123"), ControlField("008", "200101s2020    mau      b    001 0 eng d"),
+            DataField("245", "1", "0", [("a", "Caf\u00e9s & bars :"), ("b", "a  history /")]),
+            DataField("650", " ", "0", [("a", "Coffee"), ("x", "History"), ("x", "Sources")])
+        ])
+
+    def test_records_round_trip(self):
+        data = encode_iso2709(self.record)
+        decoded = decode_iso2709(data)
+
+        self.assertEqual(decoded.fields, self.record.fields)
+        self.assertEqual(int(data[:5]), len(data))  # in bytes: the '\u00e9' takes two
+        self.assertEqual((decoded.leader[5:12], decoded.leader[17:]), ("cam a22", " i 4500"))
+        self.assertEqual(data[int(decoded.leader[12:17]) - 1:int(decoded.leader[12:17])], b"\x1e")  # end of directory
+        self.assertEqual(encode_iso2709(self.record.to_element()), data)
+
+    def test_files_round_trip(self):
+        records = [self.record] + [MarcRecord("00000nam a2200000 i 4500", [ControlField("001", str(number))])
+                                   for number in range(3)]
+        with TemporaryDirectory() as directory:
+            path = join(directory, "records.mrc")
+            written = write_iso2709_records(records, path)
+            with open(path, "rb") as marc_file:
+                data = marc_file.read()
+            read_back = list(iter_iso2709_records(path, as_model=True))
+
+        # some tools put a line break after each record
+        elements = list(iter_iso2709_records(BytesIO(data.replace(b"\x1d", b"\x1d\r\n"))))
+
+        self.assertEqual(written, 4)
+        self.assertEqual([record.fields for record in read_back], [record.fields for record in records])
+        self.assertEqual([MarcRecord.from_element(element).fields for element in elements],
+                         [record.fields for record in records])
+
+    def test_malformed_records_are_refused(self):
+        data = encode_iso2709(self.record)
+
+        with self.assertRaises(ValueError):
+            list(iter_iso2709_records(BytesIO(data[:-1] + b" ")))
+
+    def test_fields_and_records_too_long_for_the_format_are_refused(self):
+        long_field = MarcRecord(fields=[DataField("500", subfields=[("a", "x" * MAX_FIELD_LENGTH)])])
+        long_record = MarcRecord(fields=[DataField("500", subfields=[("a", "x" * 9000)])
+                                         for _ in range(MAX_RECORD_LENGTH // 9000 + 1)])
+        longest_field = MarcRecord(fields=[DataField("500", subfields=[("a", "x" * (MAX_FIELD_LENGTH - 5))])])  # just fits
+
+        with self.assertRaisesRegex(ValueError, "field 500"):
+            encode_iso2709(long_field)
+        with self.assertRaisesRegex(ValueError, "record is"):
+            encode_iso2709(long_record)
+        self.assertEqual(decode_iso2709(encode_iso2709(longest_field)).fields, longest_field.fields)
+
+
+class SortMarcTagsTest(TestCase):
+
+    def fields(self, record):
+        return [(field.get("tag"), field.findtext("{*}subfield") or field.text) for field in record]
+
+    def test_repeated_tags_keep_their_order(self):
+        record = etree.fromstring(MARCXML)
+        record.insert(0, make_field({"tag": "650", "ind1": " ", "ind2": "0"}, [{"code": "a", "text": "Tea"}]))
+        record.append(make_field({"tag": "650", "ind1": " ", "ind2": "0"}, [{"code": "a", "text": "Cocoa"}]))
+        record.append(make_field({"tag": "020", "ind1": " ", "ind2": " "}, [{"code": "a", "text": "9780000000002"}]))
+
+        sorted_record = sort_marc_tags(record)
+
+        self.assertIs(sorted_record, record)
+        self.assertEqual(self.fields(record), [
+            (None, "01234cam a2200289 i 4500"), ("001", "99123"), ("005", "20200101000000.0"),
+            ("008", "200101s2020    mau      b    001 0 eng d"), ("020", "9780000000001"), ("020", "9780000000002"),
+            ("245", "Caf\u00e9s & bars :"), ("650", "Tea"), ("650", "Coffee"), ("650", "Cocoa")
+        ])
+
+    def test_namespace_and_wrapper_are_kept(self):
+        bib = etree.fromstring(BIB)
+        before = etree.tostring(bib)
+
+        sort_marc_tags(bib)
+        record = bib.find("{%s}record" % MARC_NAMESPACE)
+
+        self.assertEqual({etree.QName(element).namespace for element in record.iter()}, {MARC_NAMESPACE})
+        self.assertEqual(bib.findtext("mms_id"), "11")
+        self.assertEqual([field.get("tag") for field in record], [None, "001", "245", "650", "650"])
+        self.assertEqual([value for field in record.iterfind("{*}datafield[@tag='650']")
+                          for value in field.xpath("*/text()")], ["Cats", "History", "Dogs"])
+        self.assertEqual(len(etree.tostring(bib)), len(before))  # nothing was added or dropped, only moved
+
+    def test_records_are_sorted_as_they_stream_past(self):
+        records = (etree.fromstring(MARCXML) for _ in range(3))
+
+        sorted_records = list(sort_marc_tags_in_batch(records))
+
+        self.assertEqual(len(sorted_records), 3)
+        for record in sorted_records:
+            self.assertEqual([field.get("tag") for field in record], [None, "001", "005", "008", "020", "245", "650"])
@@ -0,0 +1,128 @@
+from http.client import HTTPException
+from time import sleep
+from unittest import TestCase
+
+from src.services import Service, ServiceRequestError
+from src.services.rate_limit import RateLimiter, RetryPolicy
+from src.services.transport import HttpTransport
+from src.tests.http_stub import StubServer
+
+
+class HttpTransportTest(TestCase):
+
+    def setUp(self):
+        self.server = StubServer().__enter__()
+        self.server.route("GET", "/ping", lambda request: (200, "pong"))
+        self.transport = HttpTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.__exit__(None, None, None)
+
+    def test_sequential_requests_reuse_one_connection(self):
+        for _ in range(9):
+            response = self.transport.request("GET", self.server.url + "/ping")
+            self.assertEqual((response.status, response.body), (200, b"pong"))
+
+        stats = self.transport.stats()["http://127.0.0.1:{}".format(self.server.url.rsplit(":", 1)[1])]
+        self.assertEqual(stats["connections_created"], 1)
+        self.assertEqual(stats["connections_reused"], 8)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_services_share_the_transport_they_are_given(self):
+        services = [Service(logging=False, transport=self.transport) for _ in range(3)]
+        for service in services:
+            service.base_url = self.server.url
+            self.assertEqual(service.make_request("/ping"), "pong")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_idle_connections_past_their_timeout_are_replaced(self):
+        transport = HttpTransport(idle_timeout=0)
+        try:
+            transport.request("GET", self.server.url + "/ping")
+            transport.request("GET", self.server.url + "/ping")
+        finally:
+            transport.close()
+        self.assertEqual(self.server.connections, 2)
+
+
+class RetryTest(TestCase):
+
+    def setUp(self):
+        self.server = StubServer().__enter__()
+        self.transport = HttpTransport()
+        self.service = Service(logging=False, transport=self.transport, rate_limiter=RateLimiter(1000),
+                               retry_policy=RetryPolicy(max_retries=2, backoff_factor=0))
+        self.service.base_url = self.server.url
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.__exit__(None, None, None)
+
+    def respond_in_turn(self, *responses):
+        responses = list(responses)
+        return lambda request: responses.pop(0) if len(responses) > 1 else responses[0]
+
+    def test_server_errors_are_retried_for_idempotent_methods(self):
+        for method in ("GET", "PUT", "DELETE"):
+            self.server.route(method, "/flaky", self.respond_in_turn((500, "oops"), (200, "ok")))
+            self.assertEqual(self.service.make_request("/flaky", method=method), "ok")
+            self.assertEqual(self.server.count_requests(method, "/flaky"), 2)
+
+    def test_server_errors_are_not_retried_for_post(self):
+        self.server.route("POST", "/create", lambda request: (500, "oops"))
+        with self.assertRaises(ServiceRequestError) as raised:
+            self.service.make_request("/create", method="POST", requestBody=b"<new/>")
+        self.assertEqual(raised.exception.status, 500)
+        self.assertEqual(self.server.count_requests("POST", "/create"), 1)
+
+    def test_client_errors_raise_with_the_status_and_url(self):
+        self.server.route("GET", "/bibs/404", lambda request: (400, "<web_service_result>no such bib</web_service_result>"))
+
+        with self.assertRaises(ServiceRequestError) as raised:
+            self.service.make_request("/bibs/404", {"apikey": "secret", "view": "full"})
+
+        self.assertEqual(raised.exception.status, 400)
+        self.assertEqual(raised.exception.url, self.server.url + "/bibs/404?view=full")
+        self.assertIn("no such bib", raised.exception.body)
+        self.assertNotIn("secret", str(raised.exception))
+        self.assertEqual(self.server.count_requests("GET", "/bibs/404"), 1)
+
+    def test_too_many_requests_is_retried_for_post(self):
+        self.server.route("POST", "/create", self.respond_in_turn((429, "slow down"), (200, "created")))
+        self.assertEqual(self.service.make_request("/create", method="POST", requestBody=b"<new/>"), "created")
+        self.assertEqual(self.server.count_requests("POST", "/create"), 2)
+
+    def test_dropped_get_is_resent_once_on_a_new_connection(self):
+        self.server.route("GET", "/ping", lambda request: (200, "pong"))
+        self.server.route("GET", "/dropped", self.respond_in_turn(None, (200, "ok")))
+        self.transport.request("GET", self.server.url + "/ping")
+
+        response = self.transport.request("GET", self.server.url + "/dropped")
+
+        self.assertEqual(response.body, b"ok")
+        self.assertEqual(self.server.count_requests("GET", "/dropped"), 2)
+
+    def test_dropped_post_is_not_resent(self):
+        self.server.route("GET", "/ping", lambda request: (200, "pong"))
+        self.server.route("POST", "/dropped", lambda request: None)
+        self.transport.request("GET", self.server.url + "/ping")
+
+        with self.assertRaises((HTTPException, ConnectionError)):
+            self.transport.request("POST", self.server.url + "/dropped", body=b"<new/>")
+        self.assertEqual(self.server.count_requests("POST", "/dropped"), 1)
+
+    def test_post_is_not_sent_on_a_connection_the_server_closed_while_idle(self):
+        def hang_up(request):
+            request.hang_up_after_response = True
+            return 200, "pong"
+        self.server.route("GET", "/ping", hang_up)
+        self.server.route("POST", "/create", lambda request: (200, "created"))
+        self.transport.request("GET", self.server.url + "/ping")
+        sleep(0.1)  # give the server's hang-up time to arrive
+
+        response = self.transport.request("POST", self.server.url + "/create", body=b"<new/>")
+
+        self.assertEqual(response.body, b"created")
+        self.assertEqual(self.server.count_requests("POST", "/create"), 1)
+        self.assertEqual(self.server.connections, 2)